@@ -0,0 +1,308 @@
+"""Throughput and latency benchmarks of the proxy against local servers.
+
+Run with `poetry run python benchmarks/bench.py -o result.json` and compare two results with
+`python benchmarks/compare.py before.json after.json`.
+The servers, the proxy and the load generator run in separate processes,
+the peak RSS is the one of the proxy process"""
+from __future__ import annotations
+from argparse import ArgumentParser, Namespace
+from asyncio import gather, new_event_loop, open_connection, run, sleep
+from collections.abc import Callable
+from json import dump
+from multiprocessing import get_context
+from multiprocessing.process import BaseProcess
+from platform import platform, python_version
+from subprocess import DEVNULL, CalledProcessError, check_output
+from sys import stderr, stdout
+from time import perf_counter
+
+from laproxy import (
+    Handler,
+    NoHTTPHandler,
+    NoTCPHandler,
+    LoopFactory,
+    SocketOptions,
+    TCPLineHandler,
+    TCPProxy,
+    default_loop_factory,
+)
+from servers import ADDRESS, main as serve
+
+BASE_PORT = 9100
+
+
+class EchoLines(TCPLineHandler):
+    def process_line(self, line: bytes, inbound: bool, /) -> bytes | None:
+        return line
+
+
+SCENARIOS: dict[str, tuple[str, Callable[[], Handler]]] = {
+    "tcp_echo": ("echo", NoTCPHandler),
+    "tcp_bulk": ("bulk", NoTCPHandler),
+    "tcp_line": ("echo", EchoLines),
+    "http_keep_alive": ("http", NoHTTPHandler),
+}
+"""The server and the handler used by each scenario"""
+
+SOCKET_OPTIONS: dict[str, Callable[[], SocketOptions | None]] = {
+    "default": lambda: None,
+    "latency": SocketOptions.latency,
+    "throughput": SocketOptions.throughput,
+}
+"""The socket options selected by --socket-options"""
+
+
+def loop_factory(name: str, /) -> LoopFactory:
+    if name == "asyncio":
+        return new_event_loop
+    if name == "uvloop":
+        import uvloop  # type: ignore
+
+        return uvloop.new_event_loop  # type: ignore
+    return default_loop_factory()
+
+
+def percentile(values: list[float], fraction: float, /) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def peak_rss(pid: int, /) -> int:
+    """Peak resident memory of a process in KiB, read from /proc"""
+    with open(f"/proc/{pid}/status") as file:
+        for line in file:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return 0
+
+
+def proxy(
+    handler: Callable[[], Handler],
+    listen_port: int,
+    target_port: int,
+    engine: str,
+    loop: str,
+    socket_options: str,
+) -> None:
+    TCPProxy(
+        ADDRESS,
+        listen_port,
+        ADDRESS,
+        target_port,
+        handler,
+        engine=engine,  # type: ignore
+        socket_options=SOCKET_OPTIONS[socket_options](),
+    ).run(log_level=None, loop_factory=loop_factory(loop))
+
+
+async def echo_client(
+    port: int, messages: int, size: int, line: bool, latencies: list[float]
+) -> int:
+    reader, writer = await open_connection(ADDRESS, port)
+    message = b"x" * (size - 1) + (b"\n" if line else b"x")
+    for _ in range(messages):
+        start = perf_counter()
+        writer.write(message)
+        await reader.readexactly(size)
+        latencies.append(perf_counter() - start)
+    writer.close()
+    return messages * size * 2
+
+
+async def bulk_client(port: int, size: int, latencies: list[float]) -> int:
+    start = perf_counter()
+    reader, writer = await open_connection(ADDRESS, port)
+    writer.write(b"%d\n" % size)
+    received = 0
+    while data := await reader.read(1024 * 1024):
+        received += len(data)
+    latencies.append(perf_counter() - start)
+    writer.close()
+    return received
+
+
+async def http_client(
+    port: int, requests: int, size: int, latencies: list[float]
+) -> int:
+    reader, writer = await open_connection(ADDRESS, port)
+    request = b"GET /%d HTTP/1.1\r\nHost: localhost\r\n\r\n" % size
+    received = 0
+    for _ in range(requests):
+        start = perf_counter()
+        writer.write(request)
+        head = await reader.readuntil(b"\r\n\r\n")
+        await reader.readexactly(size)
+        latencies.append(perf_counter() - start)
+        received += len(head) + size
+    writer.close()
+    return received + requests * len(request)
+
+
+async def load(scenario: str, port: int, args: Namespace) -> dict[str, object]:
+    latencies: list[float] = []
+    start = perf_counter()
+    if scenario == "tcp_bulk":
+        clients = [
+            bulk_client(port, args.bulk_size, latencies)
+            for _ in range(args.concurrency)
+        ]
+    elif scenario == "http_keep_alive":
+        clients = [
+            http_client(port, args.messages, args.size, latencies)
+            for _ in range(args.concurrency)
+        ]
+    else:
+        clients = [
+            echo_client(
+                port, args.messages, args.size, scenario == "tcp_line", latencies
+            )
+            for _ in range(args.concurrency)
+        ]
+    transferred = sum(await gather(*clients))
+    elapsed = perf_counter() - start
+    latencies.sort()
+    return {
+        "seconds": elapsed,
+        "mb_per_s": transferred / elapsed / 1e6,
+        "requests_per_s": len(latencies) / elapsed,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.5) * 1e3,
+            "p99": percentile(latencies, 0.99) * 1e3,
+            "p999": percentile(latencies, 0.999) * 1e3,
+        },
+    }
+
+
+async def listening(port: int, timeout: float, /) -> None:
+    """Wait for a port to accept connections"""
+    deadline = perf_counter() + timeout
+    while True:
+        try:
+            _, writer = await open_connection(ADDRESS, port)
+        except OSError:
+            if perf_counter() > deadline:
+                raise
+            await sleep(0.05)
+            continue
+        writer.close()
+        return
+
+
+def start(target: Callable[..., None], *args: object) -> BaseProcess:
+    process = get_context("spawn").Process(target=target, args=args, daemon=True)
+    process.start()
+    return process
+
+
+def measure(
+    scenario: str, ports: dict[str, int], args: Namespace
+) -> dict[str, object]:
+    server, handler = SCENARIOS[scenario]
+    listen_port = ports["proxy"]
+    process = start(
+        proxy,
+        handler,
+        listen_port,
+        ports[server],
+        args.engine,
+        args.loop,
+        args.socket_options,
+    )
+    try:
+        run(listening(listen_port, args.startup))
+        result = run(load(scenario, listen_port, args))
+        result["peak_rss_kb"] = peak_rss(process.pid)  # type: ignore
+    finally:
+        process.terminate()
+        process.join()
+    return result
+
+
+def commit() -> str | None:
+    try:
+        output = check_output(["git", "rev-parse", "HEAD"], stderr=DEVNULL)
+        return output.decode().strip()
+    except (OSError, CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        description="Throughput and latency benchmarks of the proxy against local servers."
+    )
+    parser.add_argument("-o", "--output", help="file to write the JSON results to")
+    parser.add_argument(
+        "-s",
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="scenario to run, can be repeated, all of them by default",
+    )
+    parser.add_argument("-c", "--concurrency", type=int, default=32)
+    parser.add_argument(
+        "-n", "--messages", type=int, default=1000, help="messages per connection"
+    )
+    parser.add_argument("--size", type=int, default=512, help="size of a message")
+    parser.add_argument(
+        "--bulk-size",
+        type=int,
+        default=64 * 1024 * 1024,
+        help="bytes downloaded by each connection of tcp_bulk",
+    )
+    parser.add_argument("--engine", choices=("streams", "protocol"), default="streams")
+    parser.add_argument(
+        "--loop",
+        choices=("auto", "asyncio", "uvloop"),
+        default="auto",
+        help="event loop of the proxy, auto uses uvloop when it is installed",
+    )
+    parser.add_argument(
+        "--socket-options",
+        choices=sorted(SOCKET_OPTIONS),
+        default="default",
+        help="socket options preset of the proxy",
+    )
+    parser.add_argument(
+        "--port", type=int, default=BASE_PORT, help="first port to use"
+    )
+    parser.add_argument(
+        "--startup",
+        type=float,
+        default=10.0,
+        help="seconds to wait for the servers and the proxy to listen",
+    )
+    args = parser.parse_args()
+    ports = {"echo": args.port, "bulk": args.port + 1, "http": args.port + 2}
+    servers = start(serve, ports)
+    results: dict[str, object] = {}
+    try:
+        for port in ports.values():
+            run(listening(port, args.startup))
+        ports["proxy"] = args.port + 3
+        for scenario in args.scenario or SCENARIOS:
+            results[scenario] = measure(scenario, ports, args)
+            print(scenario, results[scenario], file=stderr, flush=True)
+    finally:
+        servers.terminate()
+        servers.join()
+    report = {
+        "commit": commit(),
+        "python": python_version(),
+        "platform": platform(),
+        "parameters": {
+            name: value
+            for name, value in vars(args).items()
+            if name not in ("output", "port", "startup")
+        },
+        "results": results,
+    }
+    if args.output is None:
+        dump(report, stdout, indent=2)
+        return
+    with open(args.output, "w") as file:
+        dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
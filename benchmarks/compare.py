@@ -0,0 +1,56 @@
+"""Compare two results of bench.py, exiting with 1 if a metric got worse than the threshold"""
+from __future__ import annotations
+from argparse import ArgumentParser
+from collections.abc import Iterator, Mapping
+from json import load
+
+HIGHER_IS_BETTER = ("mb_per_s", "requests_per_s")
+
+
+def metrics(
+    result: Mapping[str, object], prefix: str = "", /
+) -> Iterator[tuple[str, float]]:
+    for name, value in result.items():
+        if isinstance(value, Mapping):
+            yield from metrics(value, f"{prefix}{name}.")
+        elif name != "seconds" and isinstance(value, (int, float)):
+            yield f"{prefix}{name}", float(value)
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("before", help="the reference result")
+    parser.add_argument("after", help="the result to check")
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="percentage a metric can get worse before it is a regression",
+    )
+    args = parser.parse_args()
+    with open(args.before) as file:
+        before = load(file)["results"]
+    with open(args.after) as file:
+        after = load(file)["results"]
+    regressions = 0
+    for scenario in sorted(before.keys() & after.keys()):
+        new = dict(metrics(after[scenario]))
+        for name, old in metrics(before[scenario]):
+            if name not in new or old == 0:
+                continue
+            change = (new[name] - old) / old * 100
+            worse = -change if name in HIGHER_IS_BETTER else change
+            flag = ""
+            if worse > args.threshold:
+                regressions += 1
+                flag = "  REGRESSION"
+            print(
+                f"{scenario:16} {name:16} {old:12.3f} {new[name]:12.3f} {change:+7.1f}%{flag}"
+            )
+    if regressions:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
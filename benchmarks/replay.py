@@ -0,0 +1,40 @@
+"""Replay recorded connections through a handler, exiting with 1 if its behaviour changed.
+
+Run with `poetry run python benchmarks/replay.py module:Handler recordings/*.lprec`,
+the module is imported from the current directory"""
+from __future__ import annotations
+from argparse import ArgumentParser
+from asyncio import run
+from importlib import import_module
+from json import dump
+from sys import path, stdout
+
+from attrs import asdict
+from laproxy import replay
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        description="Replay recorded connections through a handler, "
+        "exiting with 1 if its behaviour changed."
+    )
+    parser.add_argument("handler", help="the handler class as module:name")
+    parser.add_argument("recordings", nargs="+", help="the files written by a Recorder")
+    args = parser.parse_args()
+    module, _, name = args.handler.partition(":")
+    path.insert(0, ".")
+    handler = getattr(import_module(module), name)
+    report = run(replay(args.recordings, handler))
+    result = {
+        **asdict(report),
+        "packets_per_s": report.packets / report.seconds if report.seconds else 0.0,
+        "mb_per_s": report.bytes / report.seconds / 1e6 if report.seconds else 0.0,
+    }
+    dump(result, stdout, indent=2)
+    print()
+    if report.mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
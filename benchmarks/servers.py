@@ -0,0 +1,79 @@
+"""Local servers standing in for the target of the proxy during the benchmarks"""
+from __future__ import annotations
+from asyncio import (
+    IncompleteReadError,
+    LimitOverrunError,
+    StreamReader,
+    StreamWriter,
+    gather,
+    run,
+    start_server,
+)
+
+ADDRESS = "127.0.0.1"
+BULK_CHUNK = 64 * 1024
+
+
+async def echo(reader: StreamReader, writer: StreamWriter) -> None:
+    """Send back everything that is received"""
+    try:
+        while data := await reader.read(65536):
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def bulk(reader: StreamReader, writer: StreamWriter) -> None:
+    """Read the number of bytes requested as a decimal line and send them"""
+    try:
+        size = int(await reader.readline())
+        chunk = b"x" * BULK_CHUNK
+        while size > 0:
+            writer.write(chunk[:size])
+            size -= BULK_CHUNK
+            await writer.drain()
+    except (ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def http(reader: StreamReader, writer: StreamWriter) -> None:
+    """Answer keep-alive requests with a body of the size given in the path"""
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            path = head.split(b" ", 2)[1]
+            size = int(path[1:] or b"0")
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s"
+                % (size, b"x" * size)
+            )
+            await writer.drain()
+    except (IncompleteReadError, LimitOverrunError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+SERVERS = {"echo": echo, "bulk": bulk, "http": http}
+
+
+async def serve(ports: dict[str, int], /) -> None:
+    """Run the servers until cancelled
+
+    - ports: The port of each server by its name"""
+    servers = [
+        await start_server(SERVERS[name], ADDRESS, port) for name, port in ports.items()
+    ]
+    await gather(*(server.serve_forever() for server in servers))
+
+
+def main(ports: dict[str, int], /) -> None:
+    """Entry point of the process running the servers
+
+    - ports: The port of each server by its name"""
+    run(serve(ports))
@@ -44,6 +44,37 @@
 >     TCPProxy("0.0.0.0", 1234, "127.0.0.1", 5005, Handler).run()
 > ```
 >
+> ### Rules
+>
+> ```yaml
+> # rules.yaml, also readable as JSON or TOML
+> rules:
+>   - name: flags
+>     direction: outbound
+>     regex: "flag[{][^}]*[}]"
+>     action: replace
+>     replacement: "flag{nope}"
+>   - name: exploit
+>     direction: inbound
+>     method: POST
+>     path: /api/
+>     header: { name: User-Agent, regex: python-requests }
+>     action: drop
+> ```
+>
+> ```python
+> from laproxy import TCPProxy, RuleHTTPHandler, RuleSet, load_rules
+>
+>
+> class Handler(RuleHTTPHandler):
+>     def rules(self) -> RuleSet:
+>         return load_rules("rules.yaml")
+>
+>
+> if __name__ == "__main__":
+>     TCPProxy("0.0.0.0", 1234, "127.0.0.1", 5005, Handler).run()
+> ```
+>
 > You can find more examples in the samples folder
 
 ## Installation
@@ -54,6 +85,12 @@
 > python3 -m pip install laproxy
 > ```
 >
+> Add the `brotli` extra, `laproxy[brotli]`, to read brotli compressed bodies with `decoded_body`
+>
+> Add the `uvloop` extra, `laproxy[uvloop]`, to run the proxy on the faster uvloop event loop
+>
+> Add the `yaml` extra, `laproxy[yaml]`, to read YAML rules files, and on Python 3.10 and earlier the `toml` extra to read TOML ones
+>
 > Or use it in a docker compose:
 >
 > ```yaml
@@ -69,20 +106,90 @@
 
 """
 from __future__ import annotations
-from ._laproxy import Proxy, Handler
+from ._laproxy import Proxy, Handler, FlowControl, FlowStats, forward
 from ._tcp import TCPProxy, TCPHandler, NoTCPHandler, TCPLineHandler
-from ._http import HTTPHandler, HTTPPayload, HTTPResponse, HTTPRequest, NoHTTPHandler
+from ._multi import MultiProxy
+from ._http import (
+    HTTPHandler,
+    HTTPHeaders,
+    HTTPPayload,
+    HTTPResponse,
+    HTTPRequest,
+    NoHTTPHandler,
+)
+from ._websocket import WebSocketFrame, MalformedFrameException
+from ._body import BodyTooLargeException
+from ._spool import Spool
+from ._cache import VerdictCache, CacheStats, CachedVerdict
+from ._encoding import (
+    Decoder,
+    ContentEncodingException,
+    DecodedBodyTooLargeException,
+)
+from ._matcher import Pattern
+from ._rules import (
+    Rule,
+    RuleSet,
+    Verdict,
+    RuleTCPHandler,
+    RuleHTTPHandler,
+    InvalidRulesException,
+    load_rules,
+    parse_rules,
+)
+from ._pool import PoolConfig
+from ._sockets import SocketOptions
+from ._loop import LoopFactory, default_loop_factory
+from ._admission import Limits
+from ._access import AccessLog
+from ._recorder import Recorder, Record, read_records
+from ._replay import ReplayReport, replay
 
 __all__ = [
     "Proxy",
     "Handler",
+    "FlowControl",
+    "FlowStats",
+    "forward",
     "TCPProxy",
     "TCPHandler",
     "NoTCPHandler",
     "TCPLineHandler",
+    "MultiProxy",
     "HTTPHandler",
+    "HTTPHeaders",
     "HTTPPayload",
     "HTTPResponse",
     "HTTPRequest",
     "NoHTTPHandler",
+    "WebSocketFrame",
+    "MalformedFrameException",
+    "BodyTooLargeException",
+    "Spool",
+    "VerdictCache",
+    "CacheStats",
+    "CachedVerdict",
+    "Decoder",
+    "ContentEncodingException",
+    "DecodedBodyTooLargeException",
+    "Pattern",
+    "Rule",
+    "RuleSet",
+    "Verdict",
+    "RuleTCPHandler",
+    "RuleHTTPHandler",
+    "InvalidRulesException",
+    "load_rules",
+    "parse_rules",
+    "PoolConfig",
+    "SocketOptions",
+    "LoopFactory",
+    "default_loop_factory",
+    "Limits",
+    "AccessLog",
+    "Recorder",
+    "Record",
+    "read_records",
+    "ReplayReport",
+    "replay",
 ]
@@ -0,0 +1,71 @@
+from __future__ import annotations
+from json import dumps
+from logging import FileHandler, Formatter, LogRecord, makeLogRecord
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from random import random
+from time import perf_counter, time
+
+from ._laproxy import Connection
+
+
+class _JSONFormatter(Formatter):
+    def format(self, record: LogRecord) -> str:
+        return dumps(getattr(record, "access"), separators=(",", ":"))
+
+
+class AccessLog:
+    """Structured log of the proxied connections, one JSON object per line.
+    The entries are put in a queue and written to the file by a background thread,
+    so the event loop never waits for the disk"""
+
+    def __init__(self, path: str, /, *, sample_rate: float = 1.0):
+        """- path: The file to append the entries to
+        - sample_rate: The fraction of the connections to log, the dropped ones are always logged
+        """
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(f"Invalid sample rate {sample_rate}")
+        self.__path = path
+        self.__sample_rate = sample_rate
+        self.__queue: SimpleQueue[LogRecord] = SimpleQueue()
+        self.__handler = QueueHandler(self.__queue)
+        self.__listener: QueueListener | None = None
+
+    def start(self) -> None:
+        """Open the file and start the thread writing the entries"""
+        if self.__listener is not None:
+            return
+        handler = FileHandler(self.__path, encoding="utf-8")
+        handler.setFormatter(_JSONFormatter())
+        self.__listener = QueueListener(self.__queue, handler)
+        self.__listener.start()
+
+    def stop(self) -> None:
+        """Write the queued entries and close the file"""
+        listener = self.__listener
+        if listener is None:
+            return
+        self.__listener = None
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+    def record(self, connection: Connection, /) -> None:
+        """Queue the entry of a connection that ended, if it is sampled
+
+        - connection: The state of the connection"""
+        if self.__listener is None:
+            return
+        if connection.drop_reason is None and random() >= self.__sample_rate:
+            return
+        duration = perf_counter() - connection.started
+        access = {
+            "time": time() - duration,
+            "connection": connection.id,
+            "peer": connection.peer,
+            "duration": duration,
+            "bytes_inbound": connection.bytes_inbound,
+            "bytes_outbound": connection.bytes_outbound,
+            "dropped": connection.drop_reason,
+        }
+        self.__handler.handle(makeLogRecord({"msg": "access", "access": access}))
@@ -0,0 +1,218 @@
+from __future__ import annotations
+from collections import defaultdict
+from logging import getLogger
+from time import monotonic
+from typing import TYPE_CHECKING
+from attrs import define
+
+from ._metrics import Metrics
+from ._sockets import DEFAULT_BACKLOG
+
+if TYPE_CHECKING:
+    from ._laproxy import Connection
+
+PRUNE_SIZE = 4096
+WATCH_MIN_INTERVAL = 0.05
+
+
+@define
+class Limits:
+    """Admission control and timeouts of the connections of a proxy,
+    the rejected connections are closed as soon as they are accepted"""
+
+    max_connections: int | None = None
+    """Maximum number of open connections, None for no limit"""
+    max_connections_per_ip: int | None = None
+    """Maximum number of open connections from the same address, None for no limit"""
+    connection_rate: float | None = None
+    """New connections per second allowed from the same address, None for no limit"""
+    connection_burst: int = 10
+    """New connections allowed at once from the same address before the rate applies"""
+    byte_rate: float | None = None
+    """Bytes per second forwarded for the same address, in both directions, None for no limit.
+    Reads are delayed when it is exceeded and the kernel passthrough is not used"""
+    byte_burst: int = 1024 * 1024
+    """Bytes forwarded at once for the same address before the rate applies"""
+    header_timeout: float | None = None
+    """Seconds an HTTPHandler waits for a request, including the wait between keep-alive requests,
+    or for the response to a forwarded request. None for no limit"""
+    idle_timeout: float | None = None
+    """Seconds without data in both directions after which a connection is closed, None for no limit
+    """
+    backlog: int = DEFAULT_BACKLOG
+    """Maximum number of connections waiting in the kernel to be accepted"""
+
+
+class TokenBucket:
+    """Allows a rate of events with bursts, the tokens are refilled continuously"""
+
+    def __init__(self, rate: float, burst: float, /):
+        """- rate: The tokens added every second
+        - burst: The maximum number of tokens"""
+        self.__rate = rate
+        self.__burst = burst
+        self.__tokens = burst
+        self.__updated = monotonic()
+
+    def full(self) -> bool:
+        """If the bucket has refilled completely
+
+        - returns: True if no tokens are missing"""
+        self.__refill()
+        return self.__tokens >= self.__burst
+
+    def try_take(self, amount: float = 1, /) -> bool:
+        """Take tokens only if there are enough
+
+        - amount: The number of tokens
+
+        - returns: False if there were not enough tokens"""
+        self.__refill()
+        if self.__tokens < amount:
+            return False
+        self.__tokens -= amount
+        return True
+
+    def take(self, amount: float, /) -> float:
+        """Take tokens, going in debt when there are not enough
+
+        - amount: The number of tokens
+
+        - returns: The seconds to wait for the debt to be paid, 0 if there were enough tokens
+        """
+        self.__refill()
+        self.__tokens -= amount
+        if self.__tokens >= 0:
+            return 0.0
+        return -self.__tokens / self.__rate
+
+    def __refill(self) -> None:
+        now = monotonic()
+        self.__tokens = min(
+            self.__burst, self.__tokens + (now - self.__updated) * self.__rate
+        )
+        self.__updated = now
+
+
+class _Client:
+    def __init__(self, limits: Limits, /):
+        self.connections = 0
+        self.rate = (
+            None
+            if limits.connection_rate is None
+            else TokenBucket(limits.connection_rate, limits.connection_burst)
+        )
+        self.bytes = (
+            None
+            if limits.byte_rate is None
+            else TokenBucket(limits.byte_rate, limits.byte_burst)
+        )
+
+    def idle(self) -> bool:
+        return (
+            self.connections == 0
+            and (self.rate is None or self.rate.full())
+            and (self.bytes is None or self.bytes.full())
+        )
+
+
+class Admission:
+    """Applies the limits of a proxy, counting the rejected connections"""
+
+    __logger = getLogger("laproxy.Admission")
+
+    def __init__(self, limits: Limits, metrics: Metrics, /):
+        """- limits: The limits to apply
+        - metrics: Where to count the rejections"""
+        self.__limits = limits
+        self.__metrics = metrics
+        self.__open = 0
+        self.__clients: defaultdict[str, _Client] = defaultdict(
+            lambda: _Client(limits)
+        )
+
+    def admit(self, ip: str, /) -> bool:
+        """Check if a new connection can be handled, counting it as open if it can
+
+        - ip: The address of the client
+
+        - returns: False if the connection should be closed"""
+        limits = self.__limits
+        if len(self.__clients) > PRUNE_SIZE:
+            self.__prune()
+        client = self.__clients[ip]
+        reason: str | None = None
+        if limits.max_connections is not None and self.__open >= limits.max_connections:
+            reason = "max_connections"
+        elif (
+            limits.max_connections_per_ip is not None
+            and client.connections >= limits.max_connections_per_ip
+        ):
+            reason = "max_connections_per_ip"
+        elif client.rate is not None and not client.rate.try_take():
+            reason = "connection_rate"
+        if reason is not None:
+            Admission.__logger.debug(f"Rejecting a connection from {ip}: {reason}")
+            self.__metrics.inc("laproxy_rejected_total", reason=reason)
+            return False
+        self.__open += 1
+        client.connections += 1
+        return True
+
+    def release(self, ip: str, /) -> None:
+        """Count a connection admitted with admit() as closed
+
+        - ip: The address of the client"""
+        self.__open -= 1
+        self.__clients[ip].connections -= 1
+
+    def throttle(self, ip: str, /) -> TokenBucket | None:
+        """Get the bucket of the bytes forwarded for a client
+
+        - ip: The address of the client
+
+        - returns: The bucket shared by the connections of the client or None for no limit
+        """
+        return self.__clients[ip].bytes
+
+    def timeouts(self) -> bool:
+        """If the open connections have to be checked with expired()
+
+        - returns: True if a timeout is set"""
+        limits = self.__limits
+        return limits.idle_timeout is not None or limits.header_timeout is not None
+
+    def interval(self) -> float:
+        """Seconds between two checks of the open connections
+
+        - returns: A fraction of the shortest timeout"""
+        timeouts = [
+            timeout
+            for timeout in (self.__limits.idle_timeout, self.__limits.header_timeout)
+            if timeout is not None
+        ]
+        return max(min(timeouts) / 4, WATCH_MIN_INTERVAL)
+
+    def expired(self, connection: Connection, now: float, /) -> str | None:
+        """Check the timeouts of an open connection
+
+        - connection: The connection to check
+        - now: The current monotonic time
+
+        - returns: The name of the expired timeout or None"""
+        limits = self.__limits
+        if (
+            limits.idle_timeout is not None
+            and now - connection.active > limits.idle_timeout
+        ):
+            return "idle_timeout"
+        if limits.header_timeout is not None and any(
+            now - started > limits.header_timeout
+            for started in connection.heads.values()
+        ):
+            return "header_timeout"
+        return None
+
+    def __prune(self) -> None:
+        for ip in [ip for ip, client in self.__clients.items() if client.idle()]:
+            del self.__clients[ip]
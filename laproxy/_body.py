@@ -0,0 +1,235 @@
+from __future__ import annotations
+from asyncio import IncompleteReadError, LimitOverrunError, StreamReader
+from re import compile
+from typing import TYPE_CHECKING, Any, Literal
+
+from ._laproxy import CONNECTION
+
+if TYPE_CHECKING:
+    from ._http import HTTPHeaders
+
+Framing = Literal["none", "length", "chunked", "close"]
+"""How the end of a body is found: no body, Content-Length, chunked encoding or end of the stream"""
+
+PIECE_SIZE = 64 * 1024
+BODYLESS_CODES = (204, 304)
+_CHUNK_SIZE = compile(rb"[0-9A-Fa-f]+")
+
+
+class MalformedBodyException(Exception):
+    """Exception raised when the framing of an http body is malformed"""
+
+    ...
+
+
+class BodyTooLargeException(Exception):
+    """Exception raised when an http body is larger than the maximum size"""
+
+    ...
+
+
+def is_chunked(headers: HTTPHeaders, /) -> bool:
+    """Check if a body uses the chunked encoding
+
+    - headers: The headers of the message
+
+    - returns: True if the last transfer encoding is chunked"""
+    encoding = headers.get_raw(b"transfer-encoding")
+    return encoding is not None and encoding.lower().endswith(b"chunked")
+
+
+def body_framing(
+    headers: HTTPHeaders, code: int | None, /, *, method: str | None = None
+) -> tuple[Framing, int]:
+    """Find how the body of a message is delimited
+
+    - headers: The headers of the message
+    - code: The status code for a response, None for a request
+    - method: The method of the request a response answers, None if it is unknown
+
+    - returns: The framing of the body and its length when it is known"""
+    if code is not None and (
+        code < 200
+        or code in BODYLESS_CODES
+        or method == "HEAD"
+        or (method == "CONNECT" and code < 300)
+    ):
+        return "none", 0
+    if is_chunked(headers):
+        return "chunked", 0
+    length = headers.get_raw(b"content-length")
+    if length is not None:
+        if not length.isdigit():
+            raise MalformedBodyException(f"Content-Length: {length!r}")
+        return "length", int(length)
+    if code is None:
+        return "none", 0
+    return "close", 0
+
+
+def encode_chunk(data: bytes, /) -> list[bytes]:
+    """Encode a piece of a body with the chunked encoding
+
+    - data: The content of the chunk
+
+    - returns: The buffers of the encoded chunk"""
+    if not data:
+        return []
+    return [b"%x\r\n" % len(data), data, b"\r\n"]
+
+
+def encode_last_chunk(trailers: bytes, /) -> bytes:
+    """Encode the end of a chunked body
+
+    - trailers: The serialized trailer lines
+
+    - returns: The last chunk followed by the trailers"""
+    return b"0\r\n" + trailers + b"\r\n"
+
+
+class BodyReader:
+    """Reads an http body piece by piece as the data arrives,
+    removing the chunked encoding.
+    When pickled for a process pool, only the framing and the trailers are kept"""
+
+    def __init__(
+        self,
+        reader: StreamReader,
+        framing: Framing,
+        length: int,
+        /,
+        *,
+        max_size: int | None = None,
+    ) -> None:
+        """- reader: The stream to read the body from
+        - framing: How the end of the body is found
+        - length: The length of the body when the framing is length
+        - max_size: The size after which a BodyTooLargeException is raised, None for no limit.
+        It is raised at once when the Content-Length is larger"""
+        if length < 0:
+            raise MalformedBodyException(f"Negative body length {length}")
+        if max_size is not None and framing == "length" and length > max_size:
+            raise BodyTooLargeException(f"Content-Length {length} > {max_size}")
+        self.__max_size = max_size
+        self.__size = 0
+        self.__reader = reader
+        self.__framing: Framing = framing
+        self.__remaining = length
+        self.__done = framing == "none" or (framing == "length" and length == 0)
+        self.__pending: list[bytes] = []
+        connection = CONNECTION.get()
+        self.__activity = None if connection is None else connection.touch
+        self.trailers: list[tuple[bytes, bytes]] = []
+        """The raw trailer fields of a chunked body, available when the body is read"""
+
+    @property
+    def framing(self) -> Framing:
+        """How the end of the body is found"""
+        return self.__framing
+
+    def unread(self, data: bytes, /) -> None:
+        """Push back data that was already read, it will be the next piece returned
+
+        - data: The data to push back"""
+        if data:
+            self.__pending.append(data)
+
+    async def read_all(self, limit: int, /) -> bytes | None:
+        """Read the whole body if it is not larger than a limit
+
+        - limit: The maximum size of the body
+
+        - returns: The body or None if it is larger than the limit, in that case the read data is pushed back
+        """
+        if self.__framing == "length":
+            if self.__remaining > limit:
+                return None
+            pieces: list[bytes] = []
+            while not self.__done:
+                pieces.append(await self.read())
+            return b"".join(pieces)
+        body = bytearray()
+        while len(body) <= limit:
+            piece = await self.read()
+            if not piece:
+                return bytes(body)
+            body.extend(piece)
+        self.unread(bytes(body))
+        return None
+
+    async def read(self) -> bytes:
+        """Read the next piece of the body
+
+        - returns: The piece or an empty bytes at the end of the body"""
+        if self.__pending:
+            return self.__pending.pop(0)
+        if self.__done:
+            return b""
+        if self.__framing == "chunked" and self.__remaining == 0:
+            self.__remaining = await self.__read_chunk_size()
+            if self.__remaining == 0:
+                await self.__read_trailers()
+                self.__done = True
+                return b""
+        size = PIECE_SIZE
+        if self.__framing != "close":
+            size = min(size, self.__remaining)
+        data = await self.__reader.read(size)
+        if not data:
+            self.__done = True
+            if self.__framing != "close":
+                raise MalformedBodyException("Truncated body")
+            return b""
+        if self.__activity is not None:
+            self.__activity()
+        self.__size += len(data)
+        if self.__max_size is not None and self.__size > self.__max_size:
+            raise BodyTooLargeException(f"Body larger than {self.__max_size}")
+        if self.__framing != "close":
+            self.__remaining -= len(data)
+            if self.__remaining == 0:
+                if self.__framing == "length":
+                    self.__done = True
+                elif await self.__reader.readexactly(2) != b"\r\n":
+                    raise MalformedBodyException("Missing CRLF after chunk")
+        return data
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_BodyReader__reader"] = None
+        state["_BodyReader__pending"] = []
+        state["_BodyReader__done"] = True
+        state["_BodyReader__activity"] = None
+        return state
+
+    def __aiter__(self) -> BodyReader:
+        return self
+
+    async def __anext__(self) -> bytes:
+        data = await self.read()
+        if not data:
+            raise StopAsyncIteration
+        return data
+
+    async def __read_chunk_size(self) -> int:
+        try:
+            line = await self.__reader.readuntil(b"\r\n")
+        except (IncompleteReadError, LimitOverrunError) as e:
+            raise MalformedBodyException("Truncated chunk size") from e
+        size = line.split(b";", 1)[0].rstrip()
+        if _CHUNK_SIZE.fullmatch(size) is None:
+            raise MalformedBodyException(f"Chunk size {line!r}")
+        return int(size, 16)
+
+    async def __read_trailers(self) -> None:
+        while True:
+            try:
+                line = await self.__reader.readuntil(b"\r\n")
+            except (IncompleteReadError, LimitOverrunError) as e:
+                raise MalformedBodyException("Truncated trailers") from e
+            if line == b"\r\n":
+                return
+            name, colon, value = line.partition(b":")
+            if not colon:
+                raise MalformedBodyException(line)
+            self.trailers.append((name, value.strip()))
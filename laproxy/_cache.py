@@ -0,0 +1,150 @@
+from __future__ import annotations
+from collections import OrderedDict
+from collections.abc import Hashable, Sequence
+from hashlib import blake2b
+from logging import getLogger
+from time import monotonic
+from typing import TYPE_CHECKING
+from attrs import define
+
+if TYPE_CHECKING:
+    from ._http import HTTPPayload, HTTPRequest
+
+DEFAULT_CACHE_SIZE = 4096
+DEFAULT_CACHE_TTL = 60.0
+DEFAULT_CACHE_HEADERS = ("host", "content-type", "cookie", "authorization")
+
+
+@define
+class CacheStats:
+    """Counters of the lookups of a verdict cache"""
+
+    hits: int = 0
+    """Number of messages whose verdict was found"""
+    misses: int = 0
+    """Number of messages that had to be given to the handler"""
+    evictions: int = 0
+    """Number of verdicts removed because the cache was full"""
+    expirations: int = 0
+    """Number of verdicts removed because they were older than the ttl"""
+    invalidations: int = 0
+    """Number of times the cache was emptied because the handler was reloaded"""
+
+
+@define(frozen=True)
+class CachedVerdict:
+    """What the handler did with a message"""
+
+    forward: bool
+    """If the message was forwarded unchanged, otherwise the connection was dropped"""
+    reason: str = "handler"
+    """Why the connection was dropped, as given to Handler.dropping()"""
+
+
+class VerdictCache:
+    """Bounded LRU cache of the verdicts of HTTPHandler.request() and response(),
+    shared by the connections so that repeated messages are forwarded or dropped
+    without calling the handler again.
+    The verdicts expire after a ttl and are forgotten when the handler code is reloaded.
+    Only the messages forwarded unchanged and the dropped ones are cached,
+    so the handler must decide only from the fields in the fingerprint and have no side effects
+    """
+
+    __logger = getLogger("laproxy.VerdictCache")
+
+    def __init__(
+        self,
+        size: int = DEFAULT_CACHE_SIZE,
+        ttl: float = DEFAULT_CACHE_TTL,
+        /,
+        *,
+        headers: Sequence[str] = DEFAULT_CACHE_HEADERS,
+    ):
+        """- size: The maximum number of verdicts, the least recently used are evicted
+        - ttl: Seconds a verdict is kept
+        - headers: The headers the handler looks at, included in the fingerprint"""
+        self.__size = size
+        self.__ttl = ttl
+        self.__headers = tuple(header.lower() for header in headers)
+        self.__entries: OrderedDict[Hashable, tuple[float, CachedVerdict]] = (
+            OrderedDict()
+        )
+        self.__generation = 0
+        self.__stats = CacheStats()
+
+    @property
+    def stats(self) -> CacheStats:
+        """Counters of the lookups of this cache"""
+        return self.__stats
+
+    def fingerprint(
+        self, message: HTTPPayload, request: HTTPRequest | None, /
+    ) -> Hashable | None:
+        """Compute the key of a message from the method and path of its request,
+        the status code of a response, the selected headers and a hash of the body
+
+        - message: The request or the response
+        - request: The request, the message itself for a request and the answered one for a response
+
+        - returns: The key or None if the body is streamed or spooled and the message can't be cached
+        """
+        if message.streaming or message.spool is not None:
+            return None
+        headers = message.headers
+        return (
+            message is request,
+            None if request is None else (request.method, request.path),
+            getattr(message, "code", None),
+            tuple(tuple(headers.get_all(name)) for name in self.__headers),
+            blake2b(message.body, digest_size=16).digest(),
+        )
+
+    def get(self, key: Hashable, generation: int, /) -> CachedVerdict | None:
+        """Look for the verdict of a message
+
+        - key: The fingerprint of the message
+        - generation: The number of reloads of the handler, the cache is emptied when it grows
+        and the connections still using an older handler always miss
+
+        - returns: The verdict or None if it is not cached"""
+        if generation > self.__generation:
+            VerdictCache.__logger.info(
+                "Handler reloaded, forgetting %d verdicts", len(self.__entries)
+            )
+            self.__entries.clear()
+            self.__generation = generation
+            self.__stats.invalidations += 1
+        entry = None if generation < self.__generation else self.__entries.get(key)
+        if entry is None:
+            self.__stats.misses += 1
+            return None
+        expires, verdict = entry
+        if expires < monotonic():
+            del self.__entries[key]
+            self.__stats.expirations += 1
+            self.__stats.misses += 1
+            return None
+        self.__entries.move_to_end(key)
+        self.__stats.hits += 1
+        return verdict
+
+    def put(self, key: Hashable, generation: int, verdict: CachedVerdict, /) -> None:
+        """Remember the verdict of a message
+
+        - key: The fingerprint of the message
+        - generation: The number of reloads of the handler the verdict comes from
+        - verdict: What the handler did with the message"""
+        if generation != self.__generation:
+            return
+        self.__entries[key] = (monotonic() + self.__ttl, verdict)
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.__size:
+            self.__entries.popitem(last=False)
+            self.__stats.evictions += 1
+
+    def clear(self) -> None:
+        """Forget all the verdicts"""
+        self.__entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.__entries)
@@ -0,0 +1,189 @@
+from __future__ import annotations
+from gzip import compress as gzip_compress
+from typing import TYPE_CHECKING, Any
+from zlib import MAX_WBITS, compress as zlib_compress, decompressobj, error
+
+try:
+    import brotli  # type: ignore
+except ImportError:  # pragma: no cover
+    brotli = None
+
+if TYPE_CHECKING:
+    from ._http import HTTPHeaders
+
+DEFAULT_DECODED_LIMIT = 64 * 1024 * 1024
+BROTLI_PIECE_SIZE = 1024
+SUPPORTED_ENCODINGS = ("gzip", "x-gzip", "deflate", "br")
+
+
+class ContentEncodingException(Exception):
+    """Exception raised when a body can't be decoded,
+    because its encoding is unknown or its data is corrupted"""
+
+    ...
+
+
+class DecodedBodyTooLargeException(ContentEncodingException):
+    """Exception raised when a decoded body exceeds the limit given to the decoder"""
+
+    ...
+
+
+def content_encodings(headers: HTTPHeaders, /) -> list[str]:
+    """Find the encodings applied to a body
+
+    - headers: The headers of the message
+
+    - returns: The lowercase encodings in the order they were applied, without identity
+    """
+    return [
+        encoding
+        for value in headers.get_all("content-encoding")
+        for encoding in (token.strip().lower() for token in value.split(","))
+        if encoding and encoding != "identity"
+    ]
+
+
+class _ZlibStage:
+    def __init__(self, encoding: str, limit: int, /):
+        self.__gzip = encoding != "deflate"
+        self.__limit = limit
+        self.__size = 0
+        self.__raw = False
+        self.__object = self.__new()
+
+    def __new(self) -> Any:
+        if self.__gzip:
+            return decompressobj(16 + MAX_WBITS)
+        return decompressobj(-MAX_WBITS if self.__raw else MAX_WBITS)
+
+    def feed(self, data: bytes, /) -> bytes:
+        parts: list[bytes] = []
+        while data:
+            try:
+                output = self.__object.decompress(
+                    data, self.__limit - self.__size + 1
+                )
+            except error as e:
+                if self.__gzip or self.__raw or self.__size > 0:
+                    raise ContentEncodingException(str(e)) from e
+                # some servers send deflate without the zlib header
+                self.__raw = True
+                self.__object = self.__new()
+                continue
+            self.__size += len(output)
+            if self.__size > self.__limit:
+                raise DecodedBodyTooLargeException(f"More than {self.__limit} bytes")
+            parts.append(output)
+            data = self.__object.unconsumed_tail
+            if not data and self.__object.eof and self.__gzip:
+                data = self.__object.unused_data
+                if data:
+                    self.__object = self.__new()
+        return b"".join(parts)
+
+    def flush(self) -> bytes:
+        output: bytes = self.__object.flush()
+        self.__size += len(output)
+        if self.__size > self.__limit:
+            raise DecodedBodyTooLargeException(f"More than {self.__limit} bytes")
+        return output
+
+
+class _BrotliStage:
+    def __init__(self, limit: int, /):
+        if brotli is None:
+            raise ContentEncodingException("The brotli package is not installed")
+        self.__limit = limit
+        self.__size = 0
+        self.__object = brotli.Decompressor()
+
+    def feed(self, data: bytes, /) -> bytes:
+        assert brotli is not None
+        parts: list[bytes] = []
+        for start in range(0, len(data), BROTLI_PIECE_SIZE):
+            try:
+                output: bytes = self.__object.process(
+                    data[start : start + BROTLI_PIECE_SIZE]
+                )
+            except brotli.error as e:
+                raise ContentEncodingException(str(e)) from e
+            self.__size += len(output)
+            if self.__size > self.__limit:
+                raise DecodedBodyTooLargeException(f"More than {self.__limit} bytes")
+            parts.append(output)
+        return b"".join(parts)
+
+    def flush(self) -> bytes:
+        return b""
+
+
+class Decoder:
+    """Incremental decoder of a body, to inspect it piece by piece as it is streamed.
+    The size of the output of every encoding is limited, to stop decompression bombs"""
+
+    def __init__(
+        self, encodings: list[str], /, *, limit: int = DEFAULT_DECODED_LIMIT
+    ):
+        """- encodings: The encodings in the order they were applied, as returned by content_encodings()
+        - limit: The maximum number of decoded bytes"""
+        self.__stages: list[_ZlibStage | _BrotliStage] = []
+        for encoding in reversed(encodings):
+            if encoding == "br":
+                self.__stages.append(_BrotliStage(limit))
+            elif encoding in SUPPORTED_ENCODINGS:
+                self.__stages.append(_ZlibStage(encoding, limit))
+            else:
+                raise ContentEncodingException(f"Unsupported encoding {encoding}")
+
+    def feed(self, data: bytes, /) -> bytes:
+        """Decode a piece of the body
+
+        - data: The encoded bytes
+
+        - returns: The decoded bytes available so far"""
+        for stage in self.__stages:
+            data = stage.feed(data)
+        return data
+
+    def flush(self) -> bytes:
+        """Decode the data still buffered at the end of the body
+
+        - returns: The last decoded bytes"""
+        data = b""
+        for stage in self.__stages:
+            data = stage.feed(data) + stage.flush()
+        return data
+
+
+def decode(
+    data: bytes, encodings: list[str], /, *, limit: int = DEFAULT_DECODED_LIMIT
+) -> bytes:
+    """Decode a whole body
+
+    - data: The encoded body
+    - encodings: The encodings in the order they were applied
+    - limit: The maximum number of decoded bytes
+
+    - returns: The decoded body"""
+    decoder = Decoder(encodings, limit=limit)
+    return decoder.feed(data) + decoder.flush()
+
+
+def encode(data: bytes, encodings: list[str], /) -> bytes:
+    """Encode a whole body
+
+    - data: The decoded body
+    - encodings: The encodings to apply, in order
+
+    - returns: The encoded body"""
+    for encoding in encodings:
+        if encoding in ("gzip", "x-gzip"):
+            data = gzip_compress(data, mtime=0)
+        elif encoding == "deflate":
+            data = zlib_compress(data)
+        elif encoding == "br" and brotli is not None:
+            data = brotli.compress(data)
+        else:
+            raise ContentEncodingException(f"Unsupported encoding {encoding}")
+    return data
@@ -1,21 +1,47 @@
 from __future__ import annotations
-from asyncio import StreamReader, StreamWriter
+from asyncio import (
+    Future,
+    IncompleteReadError,
+    LimitOverrunError,
+    StreamReader,
+    StreamWriter,
+    get_running_loop,
+)
 from abc import ABC, abstractmethod
-from laproxy._laproxy import Handler
+from laproxy._laproxy import CONNECTION, Handler, forward, log_context
 from laproxy._tcp import get_remote_host
-from collections import UserDict
-from re import compile
-from typing import TYPE_CHECKING, final
+from laproxy._matcher import Scanner
+from collections import deque
+from collections.abc import Callable, Iterator
+from functools import lru_cache
+from typing import Any, MutableMapping, final
 from typing_extensions import override
-from logging import getLogger
-from attrs import define
+from logging import DEBUG, getLogger
+from sys import maxsize
+from time import monotonic
+from attrs import Attribute, define, field, setters
+from ._encoding import (
+    DEFAULT_DECODED_LIMIT,
+    ContentEncodingException,
+    content_encodings,
+    decode,
+    encode,
+)
+from ._websocket import WebSocketFrame, read_frame
+from ._spool import Spool
+from ._cache import CachedVerdict, VerdictCache
+from ._body import (
+    BodyReader,
+    BodyTooLargeException,
+    body_framing,
+    encode_chunk,
+    encode_last_chunk,
+    is_chunked,
+)
 
-if TYPE_CHECKING:
-    UserDict = UserDict[str, str]
-
-HEADER_RE = compile(r"([^:]+):\s+(.+)")
-REQUEST_LINE_RE = compile(r"(\w+)\s+(.+)\s+HTTP\/(\d\.\d)")
-RESPONSE_LINE_RE = compile(r"HTTP\/(\d\.\d)\s+(\d+)\s+(.+)")
+HEAD_END = b"\r\n\r\n"
+DEFAULT_BODY_THRESHOLD = 4 * 1024 * 1024
+TUNNEL_SIZE = 256 * 1024
 
 
 class MalformedHeaderException(Exception):
@@ -36,8 +62,84 @@ class MalformedResponseLineException(Exception):
     ...
 
 
-class HTTPHeaders(UserDict):
-    """Case insensitive dictionary to use to store http headers"""
+async def read_head(reader: StreamReader, /) -> bytes | None:
+    """Read the head of an http message, up to the empty line that ends the headers,
+    searching the end of the head in the buffered data in one pass
+
+    - reader: The stream reader to read the data from
+
+    - returns: The head including the final empty line or None if the end of the stream is reached before starting the reading
+    """
+    try:
+        head = await reader.readuntil(HEAD_END)
+    except IncompleteReadError as e:
+        if e.partial.strip():
+            raise MalformedHeaderException(e.partial) from e
+        return None
+    except LimitOverrunError as e:
+        raise MalformedHeaderException("Head too long") from e
+    return head.lstrip(b"\r\n")
+
+
+async def read_header_block(reader: StreamReader, /) -> bytes:
+    """Read the header lines of an http message, including the final empty line
+
+    - reader: The stream reader to read the data from
+
+    - returns: The header lines"""
+    first = await reader.readline()
+    if first.strip() == b"":
+        return first
+    try:
+        return first + await reader.readuntil(HEAD_END)
+    except IncompleteReadError as e:
+        raise MalformedHeaderException(e.partial) from e
+    except LimitOverrunError as e:
+        raise MalformedHeaderException("Head too long") from e
+
+
+def split_head(head: bytes, /) -> tuple[bytes, list[tuple[bytes, bytes]]]:
+    """Split the head of an http message in its first line and its headers without decoding them
+
+    - head: The head of the message
+
+    - returns: The first line and the list of header names and values"""
+    lines = head.split(b"\r\n")
+    headers: list[tuple[bytes, bytes]] = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        if line[0] in b" \t" and headers:
+            name, value = headers[-1]
+            headers[-1] = (name, value + b" " + line.strip())
+            continue
+        name, colon, value = line.partition(b":")
+        if not colon or not name or name != name.strip():
+            raise MalformedHeaderException(line)
+        headers.append((name, value.strip()))
+    return lines[0], headers
+
+
+def _decode(value: bytes) -> str:
+    return value.decode(errors="surrogateescape")
+
+
+def _encode(value: str) -> bytes:
+    return value.encode(errors="surrogateescape")
+
+
+@lru_cache(maxsize=1024)
+def _key(name: str) -> bytes:
+    return _encode(name.lower())
+
+
+class HTTPHeaders(MutableMapping[str, str]):
+    """Case insensitive mapping to use to store http headers.
+    The fields are kept as a list of names and values in the order they were received,
+    with their original case, and are decoded only when they are accessed.
+    A repeated field is a single key whose value is the last one, get_all() and add()
+    give access to all of them, and unchanged fields are serialized as they were received
+    """
 
     __logger = getLogger("laproxy.HTTPHeaders")
 
@@ -47,34 +149,189 @@ class HTTPHeaders(UserDict):
 
         - reader: The stream reader to read the data from
 
-        - returns: A case insensitive dict containing all the headers"""
+        - returns: A case insensitive mapping containing all the headers"""
+        _, headers = split_head(b"\r\n" + await read_header_block(reader))
+        return HTTPHeaders.from_raw(headers)
+
+    @staticmethod
+    def from_raw(raw: list[tuple[bytes, bytes]], /) -> HTTPHeaders:
+        """Create the headers from the names and values found in a message,
+        the list is used without copying it
+
+        - raw: The list of names and values
+
+        - returns: The headers"""
         result = HTTPHeaders()
-        while True:
-            line = (await reader.readline()).strip().decode()
-            if not line:
-                break
-            match = HEADER_RE.match(line)
-            if match is None:
-                raise MalformedHeaderException(line)
-            key = match.group(1)
-            value = match.group(2)
-            HTTPHeaders.__logger.debug(f"Found header {key}={value} from {line}")
-            result[key] = value
+        result.__raw = raw
+        result.__modified = False
         return result
 
+    def __init__(self, *args: Any, **kwargs: Any):
+        self.__raw: list[tuple[bytes, bytes]] = []
+        self.__index: dict[bytes, list[int]] | None = None
+        self.__modified = True
+        self.update(*args, **kwargs)
+
+    @property
+    def modified(self) -> bool:
+        """If the headers were changed since they were parsed"""
+        return self.__modified
+
+    def get_raw(self, name: bytes, /) -> bytes | None:
+        """Get the value of a header without decoding the other ones
+
+        - name: The lowercase name of the header
+
+        - returns: The last value of the header or None if it is missing"""
+        positions = self.__lookup().get(name)
+        if positions is None:
+            return None
+        return self.__raw[positions[-1]][1]
+
+    def get_all(self, name: str, /) -> list[str]:
+        """Get all the values of a repeated header, like Set-Cookie
+
+        - name: The name of the header
+
+        - returns: The values in the order they appear, empty if the header is missing
+        """
+        raw = self.__raw
+        return [_decode(raw[i][1]) for i in self.__lookup().get(_key(name), ())]
+
+    def add(self, name: str, value: str, /) -> None:
+        """Add a header after the other ones, keeping the previous values of the same name
+
+        - name: The name of the header, serialized with the given case
+        - value: The value of the header"""
+        encoded = _encode(name)
+        if self.__index is not None:
+            self.__index.setdefault(encoded.lower(), []).append(len(self.__raw))
+        self.__raw.append((encoded, _encode(value)))
+        self.__modified = True
+
+    def fields(self) -> list[tuple[str, str]]:
+        """Get all the headers, including the repeated ones
+
+        - returns: The names, with their original case, and the values in order"""
+        return [(_decode(name), _decode(value)) for name, value in self.__raw]
+
+    def serialize(self) -> bytes:
+        """Serialize the header lines, without the final empty line
+
+        - returns: The header lines"""
+        return b"".join(name + b": " + value + b"\r\n" for name, value in self.__raw)
+
+    def copy(self) -> HTTPHeaders:
+        """Copy the headers, so that they can be changed independently
+
+        - returns: The new headers"""
+        result = HTTPHeaders.from_raw(self.__raw.copy())
+        result.__modified = self.__modified
+        return result
+
+    def __lookup(self) -> dict[bytes, list[int]]:
+        if self.__index is None:
+            index: dict[bytes, list[int]] = {}
+            for position, (name, _) in enumerate(self.__raw):
+                index.setdefault(name.lower(), []).append(position)
+            self.__index = index
+            HTTPHeaders.__logger.debug("Indexed %d headers", len(self.__raw))
+        return self.__index
+
     def __getitem__(self, item: str) -> str:
-        return self.data[item.lower()]
+        value = self.get_raw(_key(item))
+        if value is None:
+            raise KeyError(item)
+        return _decode(value)
 
     def __setitem__(self, item: str, value: str) -> None:
-        self.data[item.lower()] = value
+        positions = self.__lookup().get(_key(item))
+        if positions is None:
+            self.add(item, value)
+            return
+        first, *others = positions
+        self.__raw[first] = (self.__raw[first][0], _encode(value))
+        if others:
+            for position in reversed(others):
+                del self.__raw[position]
+            self.__index = None
+        self.__modified = True
+
+    def __delitem__(self, item: str) -> None:
+        positions = self.__lookup().get(_key(item))
+        if positions is None:
+            raise KeyError(item)
+        for position in reversed(positions):
+            del self.__raw[position]
+        self.__index = None
+        self.__modified = True
 
     def __contains__(self, key: object) -> bool:
         if not isinstance(key, str):
             return False
-        return key.lower() in self.data
+        return _key(key) in self.__lookup()
+
+    def __iter__(self) -> Iterator[str]:
+        return (_decode(name) for name in self.__lookup())
+
+    def __len__(self) -> int:
+        return len(self.__lookup())
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, HTTPHeaders):
+            return NotImplemented
+        return [(name.lower(), value) for name, value in self.__raw] == [
+            (name.lower(), value) for name, value in other.__raw
+        ]
+
+    def __repr__(self) -> str:
+        return f"HTTPHeaders({self.fields()!r})"
+
+
+def _upgrade(request: HTTPRequest, /) -> str | None:
+    if request.method == "CONNECT":
+        return "connect"
+    protocol = request.headers.get_raw(b"upgrade")
+    if protocol is None:
+        return None
+    return _decode(protocol).strip().lower()
+
+
+def _switched(request: HTTPRequest, response: HTTPResponse, /) -> bool:
+    if request.method == "CONNECT":
+        return 200 <= response.code < 300
+    return response.code == 101
+
+
+def _keep_alive(headers: HTTPHeaders, version: float, /) -> bool:
+    connection = headers.get_raw(b"connection") or b""
+    tokens = [token.strip().lower() for token in connection.split(b",")]
+    if b"close" in tokens:
+        return False
+    return version >= 1.1 or b"keep-alive" in tokens
+
+
+def _invalidate_head(instance: Any, attribute: Attribute[Any], value: Any) -> Any:
+    if attribute.name == "body" and instance.spool is not None:
+        instance.spool.close()
+        object.__setattr__(instance, "spool", None)
+    if attribute.name not in (
+        "head",
+        "body",
+        "trailers",
+        "spool",
+        "_stream",
+        "_decoded",
+        "_decoded_from",
+    ):
+        object.__setattr__(instance, "head", None)
+    return value
+
+
+_on_setattr = setters.pipe(setters.convert, setters.validate, _invalidate_head)
 
 
-@define
+@define(on_setattr=_on_setattr)
 class HTTPPayload:
     """Common fields of an http request and response"""
 
@@ -97,57 +354,230 @@ class HTTPPayload:
         - reader: The stream reader to read the data from
 
         - returns: The resulting data"""
-        headers = await HTTPHeaders.parse_headers(reader)
-        if "Content-Length" not in headers:
-            HTTPPayload.__logger.warning("Missing Content-Length header")
-        body = await HTTPPayload.parse_body(
-            reader, int(headers.get("Content-Length", 0))
+        block = await read_header_block(reader)
+        _, headers = split_head(b"\r\n" + block)
+        return await HTTPPayload.parse_rest(reader, block, headers)
+
+    @staticmethod
+    async def parse_rest(
+        reader: StreamReader,
+        head: bytes,
+        headers: list[tuple[bytes, bytes]],
+        /,
+        *,
+        code: int | None = None,
+        method: str | None = None,
+        threshold: int | None = None,
+        spool: bool = False,
+        max_size: int | None = None,
+    ) -> HTTPPayload:
+        """Read the body of an http message whose head was already read
+
+        - reader: The stream reader to read the data from
+        - head: The raw head of the message
+        - headers: The raw headers found in the head
+        - code: The status code of a response, None for a request
+        - method: The method of the request a response answers, None if it is unknown
+        - threshold: The maximum size of a body to read, larger ones are left to be streamed, None for no limit
+        - spool: If the bodies larger than the threshold are written to a temporary file instead of being streamed
+        - max_size: The maximum size of a body, a BodyTooLargeException is raised for larger ones, None for no limit
+
+        - returns: The resulting data"""
+        result = HTTPHeaders.from_raw(headers)
+        framing, length = body_framing(result, code, method=method)
+        stream = BodyReader(reader, framing, length, max_size=max_size)
+        body = await stream.read_all(maxsize if threshold is None else threshold)
+        if body is None and spool:
+            HTTPPayload.__logger.debug("Spooling %s body", framing)
+            spooled = await Spool.read(stream)
+        elif body is None:
+            HTTPPayload.__logger.debug("Streaming %s body", framing)
+            return HTTPPayload(result, b"", head=head, stream=stream)
+        else:
+            spooled = None
+        trailers = HTTPHeaders.from_raw(stream.trailers) if stream.trailers else None
+        return HTTPPayload(
+            result, body or b"", head=head, trailers=trailers, spool=spooled
         )
-        return HTTPPayload(headers, body)
 
     headers: HTTPHeaders
     """The headers of the http message"""
     body: bytes
-    """The content of the body"""
+    """The content of the body, empty when the body is streamed"""
+    head: bytes | None = field(default=None, kw_only=True, eq=False, repr=False)
+    """The head as it was received, sent as it is if the message is not modified"""
+    trailers: HTTPHeaders | None = field(default=None, kw_only=True)
+    """The trailer fields of a chunked body"""
+    spool: Spool | None = field(default=None, kw_only=True, eq=False, repr=False)
+    """The body written to a temporary file when it is larger than HTTPHandler.body_threshold()
+    and HTTPHandler.spool_bodies() is enabled, the body field is then empty.
+    Assigning the body replaces the spooled one"""
+    _stream: BodyReader | None = field(
+        default=None, kw_only=True, eq=False, repr=False, alias="stream"
+    )
+    _decoded: bytes | None = field(default=None, init=False, eq=False, repr=False)
+    _decoded_from: bytes | None = field(default=None, init=False, eq=False, repr=False)
+
+    @property
+    def streaming(self) -> bool:
+        """If the body was too large to be read at once and is
+        forwarded piece by piece through HTTPHandler.body_chunk()"""
+        return self._stream is not None
+
+    @property
+    def decoded_body(self) -> bytes:
+        """The body without its Content-Encoding, decoded only when it is read
+        and cached until the body changes.
+        Assigning it encodes the new content with the same encodings,
+        while a body that was only read is forwarded as it was received"""
+        return self.decode_body()
+
+    @decoded_body.setter
+    def decoded_body(self, value: bytes) -> None:
+        encodings = content_encodings(self.headers)
+        self.body = encode(value, encodings) if encodings else value
+        self._update_length()
+        self._decoded = value
+        self._decoded_from = self.body
+
+    def decode_body(self, limit: int = DEFAULT_DECODED_LIMIT, /) -> bytes:
+        """Get the body without its Content-Encoding, raising a ContentEncodingException
+        if the encoding is unknown or the data is corrupted
+
+        - limit: The maximum size of the decoded body, larger ones raise a DecodedBodyTooLargeException
+
+        - returns: The decoded body, the same as body if it is not encoded"""
+        if self._decoded is not None and self._decoded_from is self.body:
+            return self._decoded
+        encodings = content_encodings(self.headers)
+        if not encodings:
+            return self.body
+        HTTPPayload.__logger.debug("Decoding %s body", ", ".join(encodings))
+        self._decoded = decode(self.body, encodings, limit=limit)
+        self._decoded_from = self.body
+        return self._decoded
+
+    def serialize_head(self) -> bytes:
+        """Serialize the first line and the headers, including the final empty line
+
+        - returns: The received head if nothing was changed, otherwise a new one"""
+        if self.head is not None and not self.headers.modified:
+            return self.head
+        return self._first_line() + self.headers.serialize() + b"\r\n"
+
+    def chunks(self) -> list[bytes]:
+        """Serialize the message avoiding to join the head and the body
+
+        - returns: The parts of the message"""
+        head = self.serialize_head()
+        if self.streaming or self.spool is not None:
+            return [head]
+        if is_chunked(self.headers):
+            trailers = b"" if self.trailers is None else self.trailers.serialize()
+            return [head, *encode_chunk(self.body), encode_last_chunk(trailers)]
+        return [head, self.body] if self.body else [head]
+
+    def _first_line(self) -> bytes:
+        return b""
+
+    def _spool_framing(self) -> tuple[bytes, bytes]:
+        assert self.spool is not None
+        if not is_chunked(self.headers):
+            return b"", b""
+        trailers = b"" if self.trailers is None else self.trailers.serialize()
+        if not self.spool:
+            return b"", encode_last_chunk(trailers)
+        return b"%x\r\n" % len(self.spool), b"\r\n" + encode_last_chunk(trailers)
+
+    def _update_length(self) -> None:
+        if not is_chunked(self.headers) and "content-length" in self.headers:
+            self.headers["content-length"] = str(len(self.body))
 
     def __bytes__(self) -> bytes:
-        result = bytearray()
-        for key, value in self.headers.items():
-            result.extend(f"{key}: {value}\r\n".encode())
-        result.extend(b"\r\n")
-        if self.body:
-            result.extend(self.body)
-        return bytes(result)
+        if self.spool is None:
+            return b"".join(self.chunks())
+        prefix, suffix = self._spool_framing()
+        return self.serialize_head() + prefix + self.spool.data[:] + suffix
 
 
-@define
+@define(on_setattr=_on_setattr)
 class HTTPRequest(HTTPPayload):
     """Fields of an http request"""
 
     __logger = getLogger("laproxy.HTTPRequest")
 
     @staticmethod
-    async def parse_request(reader: StreamReader, /) -> HTTPRequest | None:
+    async def parse_request(
+        reader: StreamReader,
+        /,
+        *,
+        threshold: int | None = None,
+        spool: bool = False,
+        max_size: int | None = None,
+    ) -> HTTPRequest | None:
         """Read an http request from a stream reader
 
         - reader: The stream reader to read the data from
+        - threshold: The maximum size of a body to read, larger ones are left to be streamed, None for no limit
+        - spool: If the bodies larger than the threshold are written to a temporary file instead of being streamed
+        - max_size: The maximum size of a body, a BodyTooLargeException is raised for larger ones, None for no limit
 
         - returns: The resulting HTTPRequest or None if the end of the stream is reached before starting the reading
         """
-        line = (await reader.readline()).decode().strip()
-        if not line:
+        head = await read_head(reader)
+        if head is None:
             return None
-        match = REQUEST_LINE_RE.match(line)
-        if match is None:
+        return await HTTPRequest.parse_head(
+            reader, head, threshold=threshold, spool=spool, max_size=max_size
+        )
+
+    @staticmethod
+    async def parse_head(
+        reader: StreamReader,
+        head: bytes,
+        /,
+        *,
+        threshold: int | None = None,
+        spool: bool = False,
+        max_size: int | None = None,
+    ) -> HTTPRequest:
+        """Parse the head of an http request that was already read and read its body
+
+        - reader: The stream reader to read the body from
+        - head: The head of the request, as returned by read_head()
+        - threshold: The maximum size of a body to read, larger ones are left to be streamed, None for no limit
+        - spool: If the bodies larger than the threshold are written to a temporary file instead of being streamed
+        - max_size: The maximum size of a body, a BodyTooLargeException is raised for larger ones, None for no limit
+
+        - returns: The HTTPRequest
+        """
+        line, headers = split_head(head)
+        parts = line.split()
+        if len(parts) != 3 or not parts[2].startswith(b"HTTP/"):
             raise MalformedRequestLineException(line)
-        method = match.group(1)
-        path = match.group(2)
-        version = float(match.group(3))
+        try:
+            version = float(parts[2][5:])
+        except ValueError as e:
+            raise MalformedRequestLineException(line) from e
+        method = parts[0].decode()
+        path = _decode(parts[1])
         HTTPRequest.__logger.debug(
-            f"Got request line {method} {path} {version} from {line}"
+            "Got request line %s %s %s", method, path, version
+        )
+        payload = await HTTPPayload.parse_rest(
+            reader, head, headers, threshold=threshold, spool=spool, max_size=max_size
+        )
+        return HTTPRequest(
+            payload.headers,
+            payload.body,
+            method,
+            path,
+            version,
+            head=head,
+            trailers=payload.trailers,
+            spool=payload.spool,
+            stream=payload._stream,
         )
-        payload = await HTTPPayload.parse_payload(reader)
-        return HTTPRequest(payload.headers, payload.body, method, path, version)
 
     method: str
     """Method of the request"""
@@ -156,46 +586,104 @@ class HTTPRequest(HTTPPayload):
     version: float
     """HTTP version"""
 
-    def __bytes__(self) -> bytes:
-        return (
-            f"{self.method} {self.path} HTTP/{self.version}\r\n".encode()
-            + super().__bytes__()
-        )
+    @override
+    def _first_line(self) -> bytes:
+        return _encode(f"{self.method} {self.path} HTTP/{self.version}\r\n")
 
 
-@define
+@define(on_setattr=_on_setattr)
 class HTTPResponse(HTTPPayload):
     """Fields of an http response"""
 
     __logger = getLogger("laproxy.HTTPResponse")
 
     @staticmethod
-    async def parse_response(reader: StreamReader, /) -> HTTPResponse | None:
+    async def parse_response(
+        reader: StreamReader,
+        /,
+        *,
+        threshold: int | None = None,
+        request: HTTPRequest | None = None,
+        spool: bool = False,
+        max_size: int | None = None,
+    ) -> HTTPResponse | None:
         """Read an http response from a stream reader
 
         - reader: The stream reader to read the data from
+        - threshold: The maximum size of a body to read, larger ones are left to be streamed, None for no limit
+        - request: The request the response answers, needed to know that the response to a HEAD has no body
+        - spool: If the bodies larger than the threshold are written to a temporary file instead of being streamed
+        - max_size: The maximum size of a body, a BodyTooLargeException is raised for larger ones, None for no limit
 
         - returns: The HTTPResponse or None if the end of stream is reached before starting the reading
         """
-        line = (await reader.readline()).decode().strip()
-        if not line:
+        head = await read_head(reader)
+        if head is None:
             return None
-        match = RESPONSE_LINE_RE.match(line)
-        if not match:
+        return await HTTPResponse.parse_head(
+            reader,
+            head,
+            threshold=threshold,
+            request=request,
+            spool=spool,
+            max_size=max_size,
+        )
+
+    @staticmethod
+    async def parse_head(
+        reader: StreamReader,
+        head: bytes,
+        /,
+        *,
+        threshold: int | None = None,
+        request: HTTPRequest | None = None,
+        spool: bool = False,
+        max_size: int | None = None,
+    ) -> HTTPResponse:
+        """Parse the head of an http response that was already read and read its body
+
+        - reader: The stream reader to read the body from
+        - head: The head of the response, as returned by read_head()
+        - threshold: The maximum size of a body to read, larger ones are left to be streamed, None for no limit
+        - request: The request the response answers, needed to know that the response to a HEAD has no body
+        - spool: If the bodies larger than the threshold are written to a temporary file instead of being streamed
+        - max_size: The maximum size of a body, a BodyTooLargeException is raised for larger ones, None for no limit
+
+        - returns: The HTTPResponse
+        """
+        line, headers = split_head(head)
+        parts = line.split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith(b"HTTP/"):
             raise MalformedResponseLineException(line)
-        version = match.group(1)
-        code = match.group(2)
-        message = match.group(3)
+        try:
+            version = float(parts[0][5:])
+            code = int(parts[1])
+        except ValueError as e:
+            raise MalformedResponseLineException(line) from e
+        message = _decode(parts[2]) if len(parts) == 3 else ""
         HTTPResponse.__logger.debug(
-            f"Got response line {version} {code} {message} from {line}"
+            "Got response line %s %d %s", version, code, message
+        )
+        payload = await HTTPPayload.parse_rest(
+            reader,
+            head,
+            headers,
+            code=code,
+            method=None if request is None else request.method,
+            threshold=threshold,
+            spool=spool,
+            max_size=max_size,
         )
-        payload = await HTTPPayload.parse_payload(reader)
         return HTTPResponse(
             payload.headers,
             payload.body,
-            float(version),
-            int(code),
+            version,
+            code,
             message,
+            head=head,
+            trailers=payload.trailers,
+            spool=payload.spool,
+            stream=payload._stream,
         )
 
     version: float
@@ -205,51 +693,492 @@ class HTTPResponse(HTTPPayload):
     message: str
     """The status message"""
 
-    def __bytes__(self) -> bytes:
-        return (
-            f"HTTP/{self.version} {self.code} {self.message}\r\n".encode()
-            + super().__bytes__()
-        )
+    @override
+    def _first_line(self) -> bytes:
+        return _encode(f"HTTP/{self.version} {self.code} {self.message}\r\n")
 
 
 class HTTPHandler(Handler, ABC):
-    """Handler of an HTTP connection"""
+    """Handler of an HTTP connection.
+    When the server accepts an Upgrade or a CONNECT request the connection
+    stops being parsed as HTTP and the data is relayed as it is,
+    or frame by frame through websocket_frame() when it is overridden"""
 
     __logger = getLogger("laproxy.HTTPHandler")
 
+    def __init__(self):
+        super().__init__()
+        self.__requests: deque[HTTPRequest] = deque()
+        self.__upgrade: Future[bool] | None = None
+        self.__outstanding = 0
+        self.__persistent = True
+        self.__finished = False
+
+    @override
+    @final
+    def reusable(self) -> bool:
+        return self.__finished and self.__persistent and self.__outstanding == 0
+
     @override
     @final
     async def handle(
         self, reader: StreamReader, writer: StreamWriter, inbound: bool, /
     ) -> None:
         ip, port = get_remote_host(writer)
+        threshold = self.body_threshold()
+        spool = self.spool_bodies()
+        max_size = self.max_body_size()
+        cache = self.verdict_cache()
+        scanner = self.scanner(inbound)
+        logger = HTTPHandler.__logger
+        debug = logger.isEnabledFor(DEBUG)
+        extra = log_context(inbound)
+        recording = self.recording()
+        connection = CONNECTION.get()
+        heads: dict[bool, float] = {} if connection is None else connection.heads
+        requests = self.__requests
+        correlated = type(self).response_to is not HTTPHandler.response_to
+        if (
+            not inbound
+            and not correlated
+            and type(self).response is HTTPHandler.response
+        ):
+            cache = None
+        framed = type(self).websocket_frame is not HTTPHandler.websocket_frame
         while True:
+            message: HTTPPayload | None
+            request: HTTPRequest | None = None
             if inbound:
-                HTTPHandler.__logger.debug("Waiting for HTTP request")
-                request = await HTTPRequest.parse_request(reader)
-                if request is None:
-                    HTTPHandler.__logger.debug("End of HTTP requests stream")
+                heads[True] = monotonic()
+                try:
+                    head = await read_head(reader)
+                finally:
+                    del heads[True]
+                if head is None:
+                    if debug:
+                        logger.debug("End of HTTP requests stream", extra=extra)
+                    self.__finished = True
+                    break
+                try:
+                    message = await HTTPRequest.parse_head(
+                        reader,
+                        head,
+                        threshold=threshold,
+                        spool=spool,
+                        max_size=max_size,
+                    )
+                except BodyTooLargeException as e:
+                    self.__too_large(e, inbound)
                     break
-                content = self.request(request)
+                if recording is not None:
+                    recording.record("received", bytes(message), inbound)
+                if scanner is not None and not self.__scan(scanner, message):
+                    content = None
+                else:
+                    content = await self.__decide(
+                        cache, message, message, self.request, message
+                    )
+                if content is not None:
+                    requests.append(content)
+                    if _upgrade(content) is not None:
+                        self.__upgrade = get_running_loop().create_future()
             else:
-                HTTPHandler.__logger.debug("Waiting for HTTP response")
-                response = await HTTPResponse.parse_response(reader)
-                if response is None:
-                    HTTPHandler.__logger.debug("End of HTTP responses stream")
+                head = await read_head(reader)
+                heads.pop(False, None)
+                if head is None:
+                    if debug:
+                        logger.debug("End of HTTP responses stream", extra=extra)
                     break
-                content = self.response(response)
+                request = requests[0] if requests else None
+                try:
+                    message = await HTTPResponse.parse_head(
+                        reader,
+                        head,
+                        threshold=threshold,
+                        request=request,
+                        spool=spool,
+                        max_size=max_size,
+                    )
+                except BodyTooLargeException as e:
+                    self.__too_large(e, inbound)
+                    break
+                if (message.code >= 200 or message.code == 101) and requests:
+                    requests.popleft()
+                if recording is not None:
+                    recording.record("received", bytes(message), inbound)
+                if scanner is not None and not self.__scan(scanner, message):
+                    content = None
+                elif correlated:
+                    content = await self.__decide(
+                        cache, message, request, self.response_to, request, message
+                    )
+                else:
+                    content = await self.__decide(
+                        cache, message, request, self.response, message
+                    )
             if content is None:
-                HTTPHandler.__logger.info(
-                    f"Dropping HTTP connection of {ip}:{port}, inbound={inbound}"
+                logger.info(
+                    "Dropping HTTP connection of %s:%d, inbound=%s",
+                    ip,
+                    port,
+                    inbound,
+                    extra=extra,
+                )
+                self.__persistent = False
+                self.dropped()
+                break
+            await self.delayed(inbound)
+            chunks = content.chunks()
+            if recording is not None:
+                sent = b"".join(chunks) if content.spool is None else bytes(content)
+                recording.record("sent", sent, inbound)
+            if not await forward(writer, chunks, inbound) or (
+                content.spool is not None
+                and not await self.__send_spool(content, writer, inbound)
+            ):
+                logger.info(
+                    "Stopping HTTP forwarding of %s:%d, inbound=%s",
+                    ip,
+                    port,
+                    inbound,
+                    extra=extra,
+                )
+                self.__persistent = False
+                break
+            if message.streaming and not await self.__stream(
+                message, writer, inbound
+            ):
+                logger.info(
+                    "Dropping HTTP connection of %s:%d while streaming, inbound=%s",
+                    ip,
+                    port,
+                    inbound,
+                    extra=extra,
+                )
+                self.__persistent = False
+                self.dropped()
+                break
+            self.__track(content, request)
+            if self.__outstanding > 0:
+                heads.setdefault(False, monotonic())
+            upgrade = self.__upgrade
+            if upgrade is None:
+                continue
+            if inbound:
+                switched = await upgrade
+                self.__upgrade = None
+                protocol = _upgrade(content)
+            elif request is None or _upgrade(request) is None:
+                continue
+            elif not isinstance(message, HTTPResponse) or (
+                message.code < 200 and message.code != 101
+            ):
+                continue
+            else:
+                switched = _switched(request, content)
+                upgrade.set_result(switched)
+                protocol = _upgrade(request)
+            if switched:
+                if debug:
+                    logger.debug(
+                        "Switching to %s, inbound=%s", protocol, inbound, extra=extra
+                    )
+                self.__persistent = False
+                await self.__tunnel(
+                    reader, writer, inbound, framed and protocol == "websocket"
                 )
                 break
-            writer.write(bytes(content))
-        writer.close()
-        await writer.wait_closed()
+        if not inbound and self.__upgrade is not None and not self.__upgrade.done():
+            self.__upgrade.set_result(False)
+        if not (inbound and self.reusable()):
+            writer.close()
+            await writer.wait_closed()
+
+    async def __decide(
+        self,
+        cache: VerdictCache | None,
+        message: HTTPPayload,
+        request: HTTPRequest | None,
+        callback: Callable[..., Any],
+        /,
+        *args: Any,
+    ) -> Any:
+        key = None if cache is None else cache.fingerprint(message, request)
+        if cache is None or key is None:
+            return await self.call(callback, *args)
+        connection = CONNECTION.get()
+        generation = 0 if connection is None else connection.generation
+        verdict = cache.get(key, generation)
+        if connection is not None:
+            connection.metrics.inc(
+                "laproxy_verdict_cache_total",
+                result="miss" if verdict is None else "hit",
+            )
+        if verdict is not None:
+            if verdict.forward:
+                return message
+            self.dropping(verdict.reason)
+            return None
+        head, body, trailers = message.head, message.body, message.trailers
+        content = await self.call(callback, *args)
+        if content is None:
+            cache.put(key, generation, CachedVerdict(False, self.drop_reason()))
+        elif (
+            content is message
+            and head is not None
+            and content.head is head
+            and content.body is body
+            and content.trailers is trailers
+            and not content.headers.modified
+        ):
+            cache.put(key, generation, CachedVerdict(True))
+        return content
+
+    def __track(self, message: HTTPPayload, request: HTTPRequest | None, /) -> None:
+        if isinstance(message, HTTPRequest):
+            self.__outstanding += 1
+            if not _keep_alive(message.headers, message.version):
+                self.__persistent = False
+        elif isinstance(message, HTTPResponse):
+            if message.code < 200 and message.code != 101:
+                return
+            self.__outstanding -= 1
+            if (
+                not _keep_alive(message.headers, message.version)
+                or body_framing(
+                    message.headers,
+                    message.code,
+                    method=None if request is None else request.method,
+                )[0]
+                == "close"
+            ):
+                self.__persistent = False
+
+    async def __tunnel(
+        self, reader: StreamReader, writer: StreamWriter, inbound: bool, framed: bool, /
+    ) -> None:
+        recording = self.recording()
+        if framed:
+            while (frame := await read_frame(reader)) is not None:
+                if recording is not None:
+                    recording.record("received", bytes(frame), inbound)
+                result = await self.call(self.websocket_frame, frame, inbound)
+                if result is None:
+                    HTTPHandler.__logger.info(
+                        "Dropping websocket connection, inbound=%s",
+                        inbound,
+                        extra=log_context(inbound),
+                    )
+                    self.dropped()
+                    return
+                data = bytes(result)
+                if recording is not None:
+                    recording.record("sent", data, inbound)
+                if not await forward(writer, data, inbound):
+                    return
+            return
+        while data := await reader.read(TUNNEL_SIZE):
+            if recording is not None:
+                recording.record("received", data, inbound)
+                recording.record("sent", data, inbound)
+            if not await forward(writer, data, inbound):
+                return
+
+    async def __send_spool(
+        self, message: HTTPPayload, writer: StreamWriter, inbound: bool, /
+    ) -> bool:
+        spool = message.spool
+        assert spool is not None
+        prefix, suffix = message._spool_framing()
+        try:
+            return (
+                (not prefix or await forward(writer, prefix, inbound))
+                and await spool.send(writer, inbound)
+                and (not suffix or await forward(writer, suffix, inbound))
+            )
+        finally:
+            spool.close()
+
+    def __too_large(self, error: BodyTooLargeException, inbound: bool, /) -> None:
+        HTTPHandler.__logger.info(
+            "Dropping HTTP connection, %s, inbound=%s",
+            error,
+            inbound,
+            extra=log_context(inbound),
+        )
+        self.__persistent = False
+        self.dropping("body_too_large")
+        self.dropped()
+
+    @override
+    def __getstate__(self) -> dict[str, Any]:
+        state = super().__getstate__()
+        state["_HTTPHandler__upgrade"] = None
+        return state
+
+    def __scan(self, scanner: Scanner, message: HTTPPayload, /) -> bool:
+        scanner.reset()
+        if message.streaming:
+            return True
+        decoded = False
+        if message.spool is not None:
+            data = message.spool.data
+        elif content_encodings(message.headers):
+            try:
+                data = message.decoded_body
+                decoded = True
+            except ContentEncodingException:
+                data = message.body
+        else:
+            data = message.body
+        body = scanner.scan(data, final=True)  # type: ignore
+        if body is None:
+            return False
+        if body is not data:
+            if decoded:
+                message.decoded_body = body
+            else:
+                message.body = body
+                message._update_length()
+        return True
+
+    async def __stream(
+        self, message: HTTPPayload, writer: StreamWriter, inbound: bool, /
+    ) -> bool:
+        stream = message._stream
+        assert stream is not None
+        chunked = stream.framing == "chunked"
+        scanner = self.scanner(inbound)
+        recording = self.recording()
+        received = 0
+        scanned = 0
+        try:
+            while True:
+                piece = await self.receive(stream.read, inbound)
+                if not piece and not self.holding(inbound):
+                    break
+                if recording is not None and piece:
+                    raw = b"".join(encode_chunk(piece)) if chunked else piece
+                    recording.record("received", raw, inbound)
+                if scanner is not None:
+                    received += len(piece)
+                    piece = scanner.scan(piece, final=not piece)
+                    if piece is None:
+                        return False
+                    scanned += len(piece)
+                    if not self.__same_length(stream, received, scanned + scanner.held):
+                        return False
+                if piece and not await self.__chunk(message, piece, writer, inbound):
+                    return False
+        except BodyTooLargeException as e:
+            HTTPHandler.__logger.info(
+                "Streamed body too large, %s, inbound=%s",
+                e,
+                inbound,
+                extra=log_context(inbound),
+            )
+            self.dropping("body_too_large")
+            return False
+        if chunked:
+            trailers = HTTPHeaders.from_raw(stream.trailers)
+            message.trailers = trailers
+            last = encode_last_chunk(trailers.serialize())
+            if recording is not None:
+                recording.record("received", last, inbound)
+                recording.record("sent", last, inbound)
+            return await forward(writer, last, inbound)
+        return True
+
+    async def __chunk(
+        self, message: HTTPPayload, piece: bytes, writer: StreamWriter, inbound: bool, /
+    ) -> bool:
+        stream = message._stream
+        assert stream is not None
+        chunked = stream.framing == "chunked"
+        chunk = await self.call(self.body_chunk, message, piece, inbound)
+        if chunk is None:
+            return False
+        recording = self.recording()
+        if recording is not None:
+            sent = b"".join(encode_chunk(chunk)) if chunked else chunk
+            recording.record("sent", sent, inbound)
+        return await forward(writer, encode_chunk(chunk) if chunked else chunk, inbound)
+
+    @staticmethod
+    def __same_length(stream: BodyReader, received: int, scanned: int, /) -> bool:
+        if received != scanned and stream.framing == "length":
+            HTTPHandler.__logger.warning(
+                "A replacement changed the length of a streamed body"
+            )
+            return False
+        return True
+
+    def spool_bodies(self) -> bool:
+        """If the bodies larger than body_threshold() are written to a temporary file
+        and given to request() and response() as HTTPPayload.spool instead of being streamed.
+        The spooled bodies can be searched without reading them in memory
+        and are forwarded with sendfile
+
+        - returns: True to spool the large bodies"""
+        return False
+
+    def verdict_cache(self) -> VerdictCache | None:
+        """Cache of the verdicts of request() and response(), so that repeated messages
+        are forwarded or dropped without calling them again.
+        The same cache must be returned to every connection, for example by creating it at the module level.
+        Only the messages forwarded unchanged and the dropped ones are cached,
+        so enable it only when the verdict depends just on the fields in VerdictCache.fingerprint()
+
+        - returns: The cache or None to call the handler for every message"""
+        return None
+
+    def max_body_size(self) -> int | None:
+        """Size above which a body is not forwarded and the connection is closed,
+        checked before reading when the Content-Length is known
+
+        - returns: The size in bytes or None for no limit"""
+        return None
+
+    def body_threshold(self) -> int:
+        """Size above which a body is not read at once but streamed piece by piece.
+        The request and response methods receive a streamed message without its body,
+        the body is then passed to body_chunk() as it arrives
+
+        - returns: The threshold in bytes"""
+        return DEFAULT_BODY_THRESHOLD
+
+    def body_chunk(
+        self, message: HTTPPayload, chunk: bytes, inbound: bool, /
+    ) -> bytes | None:
+        """Process a piece of a streamed body,
+        with Content-Length bodies the returned piece must keep the same length.
+        It can be declared with async def to be awaited by the handler
+
+        - message: The message the body belongs to
+        - chunk: The piece of the body
+        - inbound: If the body is coming from the outside
+
+        - returns: The modified piece or None if the connection should be closed"""
+        return chunk
+
+    def websocket_frame(
+        self, frame: WebSocketFrame, inbound: bool, /
+    ) -> WebSocketFrame | None:
+        """Process a frame of a websocket connection, the frames are parsed only if it is overridden,
+        otherwise the upgraded connection is relayed without inspection.
+        The returned frame is masked again with its key.
+        It can be declared with async def to be awaited by the handler
+
+        - frame: The frame with its payload unmasked
+        - inbound: If the frame is coming from the outside
+
+        - returns: The modified frame or None if the connection should be closed"""
+        return frame
 
     @abstractmethod
     def request(self, request: HTTPRequest, /) -> HTTPRequest | None:
-        """Process an HTTP request
+        """Process an HTTP request,
+        it can be declared with async def to be awaited by the handler
 
         - request: The HTTP request to process
 
@@ -257,15 +1186,32 @@ class HTTPHandler(Handler, ABC):
         """
         ...
 
-    @abstractmethod
     def response(self, response: HTTPResponse, /) -> HTTPResponse | None:
-        """Process an HTTP response
+        """Process an HTTP response,
+        it can be declared with async def to be awaited by the handler.
+        It is not called if response_to() is overridden
 
-        - request: The HTTP response to process
+        - response: The HTTP response to process
 
         - returns: The modified HTTP response or None if the connection should be closed
         """
-        ...
+        return response
+
+    def response_to(
+        self, request: HTTPRequest | None, response: HTTPResponse, /
+    ) -> HTTPResponse | None:
+        """Process an HTTP response knowing the request it answers,
+        override it instead of response() when the request is needed.
+        The requests sent on the connection are queued and matched with the responses in order,
+        so the request is the one forwarded to the server, after request() modified it.
+        It can be declared with async def to be awaited by the handler
+
+        - request: The HTTP request the response answers, None if the response was not requested
+        - response: The HTTP response to process
+
+        - returns: The modified HTTP response or None if the connection should be closed
+        """
+        return self.response(response)
 
 
 class NoHTTPHandler(HTTPHandler):
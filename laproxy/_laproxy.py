@@ -1,7 +1,262 @@
 from __future__ import annotations
-from asyncio import run, StreamWriter, StreamReader
+from asyncio import (
+    Future,
+    ensure_future,
+    get_running_loop,
+    iscoroutinefunction,
+    sleep,
+    wait,
+    StreamWriter,
+    StreamReader,
+)
 from abc import ABC, abstractmethod
+from collections.abc import Awaitable, Callable, Sequence
+from concurrent.futures import Executor
+from contextvars import ContextVar
+from functools import partial
+from itertools import count
 from logging import INFO, basicConfig, getLogger
+from time import monotonic, perf_counter
+from typing import Any, final
+from attrs import define, field
+
+from ._admission import TokenBucket
+from ._loop import LoopFactory, run_loop
+from ._matcher import HOLD_TIMEOUT, Pattern, Scanner, compile_patterns
+from ._metrics import METRICS_ADDRESS, Metrics, expose
+from ._recorder import Event, Recorder
+
+DEFAULT_HIGH_WATERMARK = 64 * 1024
+DEFAULT_LOW_WATERMARK = 16 * 1024
+DEFAULT_SLOW_CALLBACK = 0.1
+
+_forward_logger = getLogger("laproxy.forward")
+_callback_logger = getLogger("laproxy.callback")
+_connection_ids = count(1)
+
+
+@define
+class FlowControl:
+    """Write buffer limits of one direction of a connection"""
+
+    high_watermark: int = DEFAULT_HIGH_WATERMARK
+    """Size of the write buffer above which reads from the other side are paused"""
+    low_watermark: int = DEFAULT_LOW_WATERMARK
+    """Size the write buffer has to drain to before reads are resumed"""
+    max_buffer: int | None = None
+    """Number of buffered bytes above which the connection is dropped, None for no limit"""
+
+
+@define
+class FlowStats:
+    """Counters of the flow control events of a proxy"""
+
+    throttled_inbound: int = 0
+    """Number of times the inbound direction waited for the target to read its data"""
+    throttled_outbound: int = 0
+    """Number of times the outbound direction waited for the client to read its data"""
+    overflowed_inbound: int = 0
+    """Number of connections dropped because the inbound buffer limit was exceeded"""
+    overflowed_outbound: int = 0
+    """Number of connections dropped because the outbound buffer limit was exceeded"""
+
+    def throttled(self, inbound: bool, /) -> None:
+        """Record a write that had to wait for the buffer to drain
+
+        - inbound: The direction of the write"""
+        if inbound:
+            self.throttled_inbound += 1
+        else:
+            self.throttled_outbound += 1
+
+    def overflowed(self, inbound: bool, /) -> None:
+        """Record a connection dropped because of its buffer limit
+
+        - inbound: The direction of the write"""
+        if inbound:
+            self.overflowed_inbound += 1
+        else:
+            self.overflowed_outbound += 1
+
+
+@define
+class Connection:
+    """State shared by the two directions of a proxied connection"""
+
+    inbound: FlowControl = field(factory=FlowControl)
+    """Flow control of the data going to the target"""
+    outbound: FlowControl = field(factory=FlowControl)
+    """Flow control of the data going to the client"""
+    stats: FlowStats = field(factory=FlowStats)
+    """Counters to update with the flow control events"""
+    executor: Executor | None = None
+    """Executor where the handler callbacks are run, None to run them in the event loop"""
+    metrics: Metrics = field(factory=Metrics)
+    """Metrics of the proxy to update"""
+    slow_callback: float = DEFAULT_SLOW_CALLBACK
+    """Seconds a callback can block the event loop before a warning is logged"""
+    peer: str = ""
+    """Address of the client as ip:port"""
+    id: int = field(factory=lambda: next(_connection_ids))
+    """Number identifying the connection in the logs"""
+    started: float = field(factory=perf_counter)
+    """Performance counter when the connection was accepted"""
+    bytes_inbound: int = 0
+    """Bytes forwarded to the target"""
+    bytes_outbound: int = 0
+    """Bytes forwarded to the client"""
+    drop_reason: str | None = None
+    """Why the proxy dropped the connection, None if it wasn't dropped"""
+    recorder: Recorder | None = None
+    """Where the data of the connection is recorded, None to not record it"""
+    throttle: TokenBucket | None = None
+    """Bytes allowed to the client of the connection, None for no limit"""
+    active: float = field(factory=monotonic)
+    """Monotonic time of the last data forwarded"""
+    heads: dict[bool, float] = field(factory=dict)
+    """Monotonic time since the head of a message is awaited, by direction"""
+    generation: int = 0
+    """Number of reloads of the handler code when the connection was accepted"""
+
+    def flow(self, inbound: bool, /) -> FlowControl:
+        """Get the flow control of a direction
+
+        - inbound: If the direction is the one coming from the outside
+
+        - returns: The flow control of the direction"""
+        return self.inbound if inbound else self.outbound
+
+    def transferred(self, size: int, inbound: bool, /) -> float:
+        """Record data forwarded in a direction
+
+        - size: The number of bytes
+        - inbound: If the direction is the one coming from the outside
+
+        - returns: The seconds to wait before reading again because of the byte rate limit
+        """
+        self.active = monotonic()
+        if inbound:
+            self.bytes_inbound += size
+        else:
+            self.bytes_outbound += size
+        self.metrics.inc(
+            "laproxy_bytes_total", size, direction="inbound" if inbound else "outbound"
+        )
+        if self.throttle is None:
+            return 0.0
+        return self.throttle.take(size)
+
+    def touch(self) -> None:
+        """Record that the connection is active while its data is relayed by the kernel
+        or while a body is read before being forwarded"""
+        self.active = monotonic()
+
+    def dropped(self, reason: str, /) -> None:
+        """Record a connection dropped by the proxy
+
+        - reason: A short name of the reason"""
+        self.drop_reason = reason
+        self.metrics.inc("laproxy_drops_total", reason=reason)
+        self.record("drop", reason.encode(), False)
+
+    def record(self, event: Event, data: bytes | memoryview, inbound: bool, /) -> None:
+        """Write an event of the connection to its recorder, if there is one
+
+        - event: What happened
+        - data: The bytes of the event
+        - inbound: The direction of the data"""
+        if self.recorder is not None:
+            self.recorder.record(self.id, event, data, inbound)
+
+    def context(self, inbound: bool, /) -> dict[str, object]:
+        """Fields to attach to the log records of a direction with extra=,
+        built once so the per-packet logs don't format them
+
+        - inbound: If the direction is the one coming from the outside
+
+        - returns: The connection id, the peer and the direction"""
+        return {
+            "connection": self.id,
+            "peer": self.peer,
+            "direction": "inbound" if inbound else "outbound",
+        }
+
+    def timed(self, callback: str, elapsed: float, blocking: bool, /) -> None:
+        """Record how long a handler callback took
+
+        - callback: The name of the callback
+        - elapsed: The duration in seconds
+        - blocking: If the callback ran in the event loop, stopping the other connections"""
+        self.metrics.observe("laproxy_callback_seconds", elapsed, callback=callback)
+        if blocking and elapsed > self.slow_callback:
+            _callback_logger.warning(
+                f"Callback {callback} blocked the event loop for {elapsed:.3f}s"
+            )
+
+
+CONNECTION: ContextVar[Connection | None] = ContextVar(
+    "laproxy.connection", default=None
+)
+"""The connection handled by the current task, set by the proxy"""
+
+
+def log_context(inbound: bool, /) -> dict[str, object]:
+    """Fields to attach to the log records of a direction of the current connection
+
+    - inbound: If the direction is the one coming from the outside
+
+    - returns: The fields, only the direction outside of a proxied connection"""
+    connection = CONNECTION.get()
+    if connection is None:
+        return {"direction": "inbound" if inbound else "outbound"}
+    return connection.context(inbound)
+
+
+async def forward(
+    writer: StreamWriter, data: bytes | list[bytes], inbound: bool, /
+) -> bool:
+    """Write data to a stream waiting for its buffer to drain when it is full
+
+    - writer: The stream to write the data to
+    - data: The data to write or a list of buffers to write one after the other
+    - inbound: If the data is coming from the outside
+
+    - returns: False if the connection should be dropped because the stream is closed or has buffered too much data.
+    When the client exceeded its byte rate the return is delayed, slowing down the reads
+    """
+    connection = CONNECTION.get()
+    delay = 0.0
+    try:
+        if isinstance(data, list):
+            writer.writelines(data)
+        else:
+            writer.write(data)
+        if connection is not None:
+            delay = connection.transferred(
+                sum(map(len, data)) if isinstance(data, list) else len(data), inbound
+            )
+            size = writer.transport.get_write_buffer_size()
+            flow = connection.flow(inbound)
+            if flow.max_buffer is not None and size > flow.max_buffer:
+                _forward_logger.info(
+                    "Write buffer limit exceeded, %d > %d, inbound=%s",
+                    size,
+                    flow.max_buffer,
+                    inbound,
+                    extra=connection.context(inbound),
+                )
+                connection.stats.overflowed(inbound)
+                connection.dropped("buffer_limit")
+                return False
+            if size > flow.high_watermark:
+                connection.stats.throttled(inbound)
+        await writer.drain()
+    except ConnectionError:
+        _forward_logger.debug("Stream closed while writing, inbound=%s", inbound)
+        return False
+    if delay:
+        await sleep(delay)
+    return True
 
 
 class Proxy(ABC):
@@ -9,16 +264,36 @@ class Proxy(ABC):
 
     __logger = getLogger("laproxy.Proxy")
 
-    def run(self, *, log_level: int | None = INFO) -> None:
+    def run(
+        self,
+        *,
+        log_level: int | None = INFO,
+        workers: int = 1,
+        metrics_port: int | None = None,
+        loop_factory: LoopFactory | None = None,
+    ) -> None:
         """Start this proxy.
         This method is blocking.
         Creates an asyncio event loop.
-        If an event loop is already running, use run_async()"""
+        If an event loop is already running, use run_async()
+
+        - log_level: The level of the logs, None to not configure logging
+        - workers: The number of processes to use, each one with its own event loop.
+        When greater than 1, crashed workers are restarted and SIGTERM stops all of them
+        - metrics_port: The local port where the counters are exposed in the Prometheus format,
+        None to not expose them
+        - loop_factory: The function creating the event loop of every process,
+        None to use uvloop when it is installed and the asyncio loop otherwise"""
         if log_level is not None:
             basicConfig(level=log_level)
+        if workers > 1:
+            from ._workers import Supervisor
+
+            Supervisor(self, workers, log_level, metrics_port, loop_factory).run()
+            return
         try:
             Proxy.__logger.debug("Starting event loop")
-            run(self.run_async())
+            run_loop(self.__serve(metrics_port), loop_factory=loop_factory)
         except KeyboardInterrupt:
             Proxy.__logger.debug("Keyboard Interrupt received, stopping server")
 
@@ -27,6 +302,32 @@ class Proxy(ABC):
         """Children should implement this method to provide proxy functionality"""
         ...
 
+    async def __serve(self, metrics_port: int | None, /) -> None:
+        if metrics_port is None:
+            await self.run_async()
+            return
+        endpoint = get_running_loop().create_task(
+            expose(self.counters, METRICS_ADDRESS, metrics_port)
+        )
+        try:
+            await self.run_async()
+        finally:
+            endpoint.cancel()
+
+    def bind(self, *, reuse_port: bool) -> None:
+        """Create the listening sockets before run_async() is called.
+        Used by the worker mode, in the main process when the sockets are shared
+        or in every worker when SO_REUSEPORT is available
+
+        - reuse_port: If the sockets should be bound with SO_REUSEPORT"""
+        ...
+
+    def counters(self) -> dict[str, float]:
+        """Counters of this proxy, summed among the workers in the worker mode
+
+        - returns: The counters by name and labels"""
+        return {}
+
 
 class Handler(ABC):
     """Abstract base class for a connection handler.
@@ -37,9 +338,234 @@ class Handler(ABC):
         self, reader: StreamReader, writer: StreamWriter, inbound: bool, /
     ) -> None:
         """Manages a connection using asyncio.
-        This method will be called 2 times, one with inbound=false and one with inbound=true, per instance
+        This method will be called 2 times, one with inbound=false and one with inbound=true, per instance.
+        Implementations should write using forward() to respect the flow control of the proxy
 
         - reader: input stream
         - writer: output stream
         - inbound: if the connection is coming from the outside to the inside"""
         ...
+
+    def executor(self) -> Executor | None:
+        """Executor where the synchronous callbacks of this handler are run,
+        by default the one given to the proxy.
+        The callbacks of a direction are run one after the other,
+        the two directions of a connection may run at the same time in a thread pool.
+        With a process pool the handler and the data are pickled for every call,
+        so the callbacks must not rely on changes to the state of the handler
+
+        - returns: The executor or None to run the callbacks in the event loop"""
+        connection = CONNECTION.get()
+        return None if connection is None else connection.executor
+
+    @final
+    async def call(self, callback: Callable[..., Any], /, *args: Any) -> Any:
+        """Run a callback of this handler, awaiting it if it is declared with async def,
+        otherwise running it in the executor when there is one.
+        The duration of the callback is recorded in the metrics
+
+        - callback: The callback to run
+        - args: The arguments of the callback
+
+        - returns: The result of the callback"""
+        if iscoroutinefunction(callback):
+            start = perf_counter()
+            result = await callback(*args)
+            self.__timed(callback, perf_counter() - start, False)
+            return result
+        executor = self.executor()
+        if executor is None:
+            return self.call_sync(callback, *args)
+        start = perf_counter()
+        result = await get_running_loop().run_in_executor(
+            executor, partial(callback, *args)
+        )
+        self.__timed(callback, perf_counter() - start, False)
+        return result
+
+    @final
+    def call_sync(self, callback: Callable[..., Any], /, *args: Any) -> Any:
+        """Run a synchronous callback of this handler in the event loop,
+        recording its duration in the metrics and warning when it is too slow
+
+        - callback: The callback to run
+        - args: The arguments of the callback
+
+        - returns: The result of the callback"""
+        start = perf_counter()
+        result = callback(*args)
+        self.__timed(callback, perf_counter() - start, True)
+        return result
+
+    def __timed(
+        self, callback: Callable[..., Any], elapsed: float, blocking: bool, /
+    ) -> None:
+        connection = CONNECTION.get()
+        if connection is not None:
+            connection.timed(callback.__name__, elapsed, blocking)
+
+    @final
+    def recording(self) -> Connection | None:
+        """Get the current connection if its data is being recorded,
+        so the data passing through the handler can be given to Connection.record()
+
+        - returns: The connection or None if it is not recorded"""
+        connection = CONNECTION.get()
+        if connection is None or connection.recorder is None:
+            return None
+        return connection
+
+    @final
+    def dropping(self, reason: str, /) -> None:
+        """Record why the connection is going to be dropped, reported in the metrics
+
+        - reason: A short name of the reason"""
+        self.__reason = reason
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        state.pop("_Handler__reading", None)
+        return state
+
+    @final
+    def delaying(self, delay: float, inbound: bool, /) -> None:
+        """Make the packet or the message being processed wait before being forwarded,
+        so that a synchronous callback can slow down a direction without blocking the event loop.
+        The TCP handlers that use it must return True from TCPHandler.waits()
+
+        - delay: Seconds to wait
+        - inbound: The direction of the data"""
+        try:
+            delays = self.__delays
+        except AttributeError:
+            delays = self.__delays = [0.0, 0.0]
+        delays[inbound] = max(delays[inbound], delay)
+
+    @final
+    async def delayed(self, inbound: bool, /) -> None:
+        """Wait for the delay requested with delaying(), called by the proxy before forwarding
+
+        - inbound: The direction of the data"""
+        try:
+            delay = self.__delays[inbound]
+        except AttributeError:
+            return
+        if delay:
+            self.__delays[inbound] = 0.0
+            await sleep(delay)
+
+    @final
+    def dropped(self) -> None:
+        """Record in the metrics that a direction of the connection is dropped,
+        with the reason given to dropping()"""
+        connection = CONNECTION.get()
+        if connection is not None:
+            connection.dropped(self.drop_reason())
+
+    @final
+    def drop_reason(self) -> str:
+        """Get why the connection was dropped
+
+        - returns: The reason given to dropping() or "handler" when a callback returned None
+        """
+        try:
+            return self.__reason
+        except AttributeError:
+            return "handler"
+
+    def reusable(self) -> bool:
+        """If the connection to the target can be given to another client
+        after the client closed its side, used by the upstream pool of the proxy
+
+        - returns: True if the target is waiting for a new request"""
+        return False
+
+    def patterns(self) -> Sequence[Pattern]:
+        """Patterns to look for in the data of the connection, compiled together and
+        matched even when they are split among packets.
+        HTTP handlers apply them to the bodies of the messages without their Content-Encoding
+
+        - returns: The patterns with the action to take when they are found"""
+        return ()
+
+    def scanner(self, inbound: bool, /) -> Scanner | None:
+        """Get the scanner that applies the patterns to a direction of this connection.
+        It can be overridden to scan with patterns compiled in another way,
+        the same scanner must be returned for a direction
+
+        - inbound: The direction of the data
+
+        - returns: The scanner or None if no pattern applies to the direction"""
+        try:
+            scanners = self.__scanners
+        except AttributeError:
+            matcher = compile_patterns(tuple(self.patterns()))
+            scanners = self.__scanners = (
+                matcher.scanner(False),
+                matcher.scanner(True),
+            )
+        return scanners[inbound]
+
+    @final
+    def scan(
+        self, data: bytes | memoryview, inbound: bool, /, *, final: bool = False
+    ) -> bytes | memoryview | None:
+        """Apply the patterns to the next data of a direction,
+        a memoryview is copied only when there are patterns to apply
+
+        - data: The data to scan
+        - inbound: The direction of the data
+        - final: If the direction ended and the data held back by the scanner is returned
+
+        - returns: The data with the replacements applied, without the end held back
+        to replace the matches split among packets, or None if the connection should be dropped
+        """
+        scanner = self.scanner(inbound)
+        if scanner is None:
+            return data
+        result = scanner.scan(bytes(data), final=final)
+        if result is None:
+            self.dropping("pattern")
+        return result
+
+    @final
+    def holding(self, inbound: bool, /) -> bool:
+        """If the scanner of a direction holds back data that must be flushed
+        with a final scan when the direction ends
+
+        - inbound: The direction of the data
+
+        - returns: True if there is held back data"""
+        scanner = self.scanner(inbound)
+        return scanner is not None and scanner.held > 0
+
+    @final
+    async def receive(
+        self, read: Callable[[], Awaitable[bytes]], inbound: bool, /
+    ) -> bytes:
+        """Wait for the next data of a direction. While the scanner holds back data
+        the wait lasts at most HOLD_TIMEOUT, then an empty bytes is returned
+        so that the held back data is flushed with a final scan,
+        and the read is resumed by the next call
+
+        - read: The function that reads the next data
+        - inbound: The direction of the data
+
+        - returns: The data, an empty bytes at the end of the stream or to flush"""
+        try:
+            reading = self.__reading
+        except AttributeError:
+            reading: list[Future[bytes] | None] = [None, None]
+            self.__reading = reading
+        pending = reading[inbound]
+        if pending is None:
+            if not self.holding(inbound):
+                return await read()
+            pending = ensure_future(read())
+        if self.holding(inbound):
+            done, _ = await wait((pending,), timeout=HOLD_TIMEOUT)
+            if not done:
+                reading[inbound] = pending
+                return b""
+        reading[inbound] = None
+        return await pending
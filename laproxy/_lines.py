@@ -0,0 +1,84 @@
+from __future__ import annotations
+from typing import Literal
+
+Overflow = Literal["drop", "split"]
+"""What to do with a line longer than the maximum: close the connection or pass it in pieces"""
+
+DEFAULT_MAX_LINE_LENGTH = 1024 * 1024
+
+
+class LineOverflowException(Exception):
+    """Exception raised when a line is longer than the maximum and the policy is drop"""
+
+    ...
+
+
+class LineBuffer:
+    """Splits a stream of packets in lines.
+    The buffer remembers up to where it was searched for a new line,
+    so every byte is scanned once, and it is compacted only when
+    most of it was consumed"""
+
+    def __init__(self, max_line_length: int | None, overflow: Overflow, /) -> None:
+        """- max_line_length: The maximum length of a line, None for no limit
+        - overflow: What to do when a line is longer than the maximum"""
+        self.__max_line_length = max_line_length
+        self.__overflow: Overflow = overflow
+        self.__buffer = bytearray()
+        self.__start = 0
+        self.__scanned = 0
+
+    def __len__(self) -> int:
+        return len(self.__buffer) - self.__start
+
+    def feed(self, data: bytes | memoryview, /) -> list[bytes]:
+        """Add a packet to the buffer and extract the complete lines
+
+        - data: The packet
+
+        - returns: The complete lines, including their new line"""
+        lines: list[bytes] = []
+        if not self.__buffer and isinstance(data, bytes):
+            end = self.__split(data, 0, 0, lines)
+            if end < len(data):
+                self.__buffer.extend(memoryview(data)[end:])
+        else:
+            self.__buffer.extend(data)
+            self.__start = self.__split(
+                self.__buffer, self.__start, self.__scanned, lines
+            )
+        self.__scanned = len(self.__buffer)
+        self.__limit(lines)
+        self.__compact()
+        return lines
+
+    def __split(
+        self, data: bytes | bytearray, start: int, scanned: int, lines: list[bytes]
+    ) -> int:
+        with memoryview(data) as view:
+            index = data.find(b"\n", scanned)
+            while index != -1:
+                lines.append(bytes(view[start : index + 1]))
+                start = index + 1
+                index = data.find(b"\n", start)
+        return start
+
+    def __limit(self, lines: list[bytes]) -> None:
+        maximum = self.__max_line_length
+        if maximum is None or len(self) <= maximum:
+            return
+        if self.__overflow == "drop":
+            raise LineOverflowException(f"Line longer than {maximum} bytes")
+        with memoryview(self.__buffer) as view:
+            while len(self) > maximum:
+                lines.append(bytes(view[self.__start : self.__start + maximum]))
+                self.__start += maximum
+
+    def __compact(self) -> None:
+        if self.__start == len(self.__buffer):
+            self.__buffer.clear()
+            self.__start = self.__scanned = 0
+        elif self.__start > len(self.__buffer) // 2:
+            del self.__buffer[: self.__start]
+            self.__scanned -= self.__start
+            self.__start = 0
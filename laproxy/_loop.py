@@ -0,0 +1,50 @@
+from __future__ import annotations
+from asyncio import AbstractEventLoop, all_tasks, gather, new_event_loop, set_event_loop
+from logging import getLogger
+from typing import Any, Callable, Coroutine, TypeVar
+
+LoopFactory = Callable[[], AbstractEventLoop]
+"""Function creating a new event loop"""
+
+T = TypeVar("T")
+
+_loop_logger = getLogger("laproxy.loop")
+
+
+def default_loop_factory() -> LoopFactory:
+    """Choose the fastest event loop available
+
+    - returns: The uvloop factory when uvloop is installed, otherwise the asyncio one"""
+    try:
+        import uvloop  # type: ignore
+    except ImportError:
+        return new_event_loop
+    return uvloop.new_event_loop  # type: ignore
+
+
+def run_loop(
+    main: Coroutine[Any, Any, T], /, *, loop_factory: LoopFactory | None = None
+) -> T:
+    """Run a coroutine in a new event loop, like asyncio.run with a custom loop
+
+    - main: The coroutine to run
+    - loop_factory: The function creating the loop, None for default_loop_factory()
+
+    - returns: The result of the coroutine"""
+    loop = (loop_factory or default_loop_factory())()
+    _loop_logger.debug(f"Starting {type(loop).__module__}.{type(loop).__name__}")
+    try:
+        set_event_loop(loop)
+        return loop.run_until_complete(main)
+    finally:
+        try:
+            tasks = all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            if hasattr(loop, "shutdown_default_executor"):
+                loop.run_until_complete(loop.shutdown_default_executor())
+        finally:
+            set_event_loop(None)
+            loop.close()
@@ -0,0 +1,242 @@
+from __future__ import annotations
+from collections.abc import Sequence
+from functools import lru_cache
+from logging import getLogger
+from re import Match, Pattern as RegexPattern, compile, escape
+from typing import Literal
+from attrs import define
+
+Action = Literal["drop", "replace", "log"]
+"""What to do when a pattern is found: close the connection, replace the match or log it"""
+
+DEFAULT_WINDOW = 256
+HOLD_TIMEOUT = 0.01
+"""Seconds the data held back by a scanner waits for the next packet before being sent"""
+_FLAGS = {2: "i", 8: "m", 16: "s", 64: "x"}
+
+
+@define(frozen=True)
+class Pattern:
+    """A literal or a regular expression to look for in the data of a connection"""
+
+    pattern: bytes | RegexPattern[bytes]
+    """The bytes or the compiled bytes regular expression to find"""
+    action: Action = "drop"
+    """What to do when the pattern is found"""
+    replacement: bytes = b""
+    """The bytes to put in place of a match when the action is replace"""
+    inbound: bool | None = None
+    """The direction to look into, None for both"""
+    window: int = DEFAULT_WINDOW
+    """Maximum length of a regular expression match that is found when split among packets"""
+
+    def regex(self) -> str:
+        """Convert the pattern to a regular expression that can be combined with others
+
+        - returns: The source of the regular expression"""
+        if isinstance(self.pattern, bytes):
+            return escape(self.pattern.decode("latin-1"))
+        source = self.pattern.pattern.decode("latin-1")
+        flags = "".join(
+            flag for value, flag in _FLAGS.items() if self.pattern.flags & value
+        )
+        return f"(?{flags}:{source})" if flags else f"(?:{source})"
+
+    def span(self) -> int:
+        """Maximum length of a match that can span two packets
+
+        - returns: The length"""
+        if isinstance(self.pattern, bytes):
+            return len(self.pattern)
+        return self.window
+
+
+class Scanner:
+    """Looks for patterns in the data of one direction of a connection.
+    The end of the previous data is kept to find the matches split among packets,
+    only that end is scanned again.
+    When a pattern is replaced the end that could start a match is held back
+    instead of being returned, so that a match split among packets is replaced whole.
+    For literals only the end that is the start of one of them is held back,
+    for regular expressions the whole overlap.
+    The held back data is returned with the next data or by a final scan,
+    that the proxy does at the end of the stream or when no data arrives in HOLD_TIMEOUT"""
+
+    __logger = getLogger("laproxy.Scanner")
+
+    def __init__(
+        self,
+        regex: RegexPattern[bytes],
+        patterns: dict[str, Pattern],
+        overlap: int,
+        /,
+        *,
+        quiet: bool = False,
+    ):
+        """- regex: The combined regular expression, with a named group for each pattern
+        - patterns: The patterns by the name of their group
+        - overlap: The number of bytes of the previous data to keep
+        - quiet: If the patterns with the log action are only added to found"""
+        self.__regex = regex
+        self.__patterns = patterns
+        self.__overlap = overlap
+        self.__quiet = quiet
+        self.__found: list[Pattern] = []
+        self.__holdback = overlap > 0 and any(
+            pattern.action == "replace" for pattern in patterns.values()
+        )
+        literals = tuple(
+            pattern.pattern
+            for pattern in patterns.values()
+            if isinstance(pattern.pattern, bytes)
+        )
+        self.__literals = literals if len(literals) == len(patterns) else None
+        self.__tail = b""
+        self.__sent = b""
+
+    @property
+    def found(self) -> list[Pattern]:
+        """The patterns found by the last scan, in the order they were found"""
+        return self.__found
+
+    @property
+    def held(self) -> int:
+        """Number of bytes held back waiting for the next data"""
+        return len(self.__tail) if self.__holdback else 0
+
+    def reset(self) -> None:
+        """Forget the previous data, used when a new independent stream starts"""
+        self.__tail = b""
+        self.__sent = b""
+
+    def scan(self, data: bytes, /, *, final: bool = False) -> bytes | None:
+        """Apply the patterns to the next data of the stream
+
+        - data: The data to scan
+        - final: If this is the end of the stream and the held back data must be returned
+
+        - returns: The data with the replacements applied, without the end that is held back,
+        or None if the connection should be dropped
+        """
+        self.__found = []
+        if self.__holdback:
+            return self.__hold(data, final)
+        tail = self.__tail
+        if tail:
+            offset = len(tail)
+            for match in self.__regex.finditer(tail + data[: self.__overlap]):
+                if match.start() < offset < match.end() and not self.__apply(match):
+                    return None
+        for match in self.__regex.finditer(data):
+            if not self.__apply(match):
+                return None
+        if self.__overlap:
+            self.__tail = bytes((tail + data[-self.__overlap :])[-self.__overlap :])
+        return data
+
+    def __hold(self, data: bytes, final: bool, /) -> bytes | None:
+        # The end of the data returned since the last final scan is only used
+        # to find the matches that started in it, they can't be replaced anymore
+        sent = self.__sent
+        tail = self.__tail
+        buffer = sent + tail + data if sent or tail else data
+        offset = len(sent)
+        cut = len(buffer) if final else self.__cut(buffer, offset)
+        pieces: list[bytes] = []
+        last = offset
+        end = cut
+        for match in self.__regex.finditer(buffer):
+            if match.start() >= cut:
+                break
+            if match.end() <= offset:
+                continue
+            if not self.__apply(match):
+                return None
+            pattern = self.__patterns[match.lastgroup]  # type: ignore
+            if pattern.action == "replace" and match.start() >= offset:
+                pieces.append(buffer[last : match.start()])
+                pieces.append(pattern.replacement)
+                last = match.end()
+            end = max(end, match.end())
+        self.__tail = bytes(buffer[end:])
+        if final or (offset and end - offset < self.__overlap):
+            self.__sent = bytes(buffer[max(end - self.__overlap, 0) : end])
+        else:
+            self.__sent = b""
+        if not pieces and not offset and end == len(buffer):
+            return buffer
+        pieces.append(buffer[last:end])
+        return b"".join(pieces)
+
+    def __cut(self, buffer: bytes, offset: int, /) -> int:
+        start = max(len(buffer) - self.__overlap, offset)
+        if self.__literals is None:
+            return start
+        for position in range(start, len(buffer)):
+            suffix = buffer[position:]
+            if any(
+                len(literal) > len(suffix) and literal.startswith(suffix)
+                for literal in self.__literals
+            ):
+                return position
+        return len(buffer)
+
+    def __apply(self, match: Match[bytes], /) -> bool:
+        assert match.lastgroup is not None
+        pattern = self.__patterns[match.lastgroup]
+        self.__found.append(pattern)
+        if pattern.action == "drop":
+            Scanner.__logger.info(f"Found {pattern.pattern!r}, dropping the connection")
+            return False
+        if pattern.action == "log" and not self.__quiet:
+            Scanner.__logger.warning(f"Found {pattern.pattern!r} in {match.group()!r}")
+        return True
+
+
+class Matcher:
+    """Patterns compiled in a single regular expression for each direction"""
+
+    def __init__(self, patterns: Sequence[Pattern], /):
+        """- patterns: The patterns to look for"""
+        self.__directions: dict[
+            bool, tuple[RegexPattern[bytes], dict[str, Pattern], int]
+        ] = {}
+        for inbound in (False, True):
+            selected = {
+                f"_laproxy{index}": pattern
+                for index, pattern in enumerate(patterns)
+                if pattern.inbound is None or pattern.inbound == inbound
+            }
+            if not selected:
+                continue
+            regex = "|".join(
+                f"(?P<{group}>{pattern.regex()})" for group, pattern in selected.items()
+            )
+            overlap = max(pattern.span() for pattern in selected.values()) - 1
+            self.__directions[inbound] = (
+                compile(regex.encode("latin-1")),
+                selected,
+                overlap,
+            )
+
+    def scanner(self, inbound: bool, /, *, quiet: bool = False) -> Scanner | None:
+        """Create the state needed to scan a direction of a connection
+
+        - inbound: The direction to scan
+        - quiet: If the patterns with the log action are only added to Scanner.found
+
+        - returns: The scanner or None if there are no patterns for the direction"""
+        direction = self.__directions.get(inbound)
+        if direction is None:
+            return None
+        return Scanner(*direction, quiet=quiet)
+
+
+@lru_cache(maxsize=128)
+def compile_patterns(patterns: tuple[Pattern, ...], /) -> Matcher:
+    """Compile the patterns, reusing the result for the same patterns
+
+    - patterns: The patterns to compile
+
+    - returns: The compiled patterns"""
+    return Matcher(patterns)
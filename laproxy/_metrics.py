@@ -0,0 +1,209 @@
+from __future__ import annotations
+from asyncio import (
+    IncompleteReadError,
+    LimitOverrunError,
+    StreamReader,
+    StreamWriter,
+    start_server,
+)
+from bisect import bisect_left
+from collections import defaultdict
+from collections.abc import Callable, Mapping
+from logging import getLogger
+
+_expose_logger = getLogger("laproxy.metrics")
+
+METRICS_ADDRESS = "127.0.0.1"
+
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+"""Upper bounds in seconds of the buckets of the latency histograms"""
+
+
+def _key(name: str, labels: dict[str, str]) -> str:
+    if not labels:
+        return name
+    inner = ",".join(f'{label}="{value}"' for label, value in sorted(labels.items()))
+    return f"{name}{{{inner}}}"
+
+
+class Metrics:
+    """Counters, gauges and histograms of a proxy.
+    The samples are kept already flattened with their labels,
+    so they can be summed among the workers and rendered without conversions.
+    Counter names end with _total, histograms are exposed with _bucket, _sum and _count
+    """
+
+    def __init__(self) -> None:
+        self.__samples: defaultdict[str, float] = defaultdict(float)
+        self.__keys: dict[tuple[str, tuple[tuple[str, str], ...]], str] = {}
+
+    def inc(self, name: str, value: float = 1, /, **labels: str) -> None:
+        """Increase a counter or a gauge
+
+        - name: The name of the metric
+        - value: The amount to add, negative to decrease a gauge
+        - labels: The labels of the sample"""
+        self.__samples[self.__lookup(name, labels)] += value
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        /,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+        **labels: str,
+    ) -> None:
+        """Record a value in a histogram
+
+        - name: The name of the histogram
+        - value: The observed value
+        - buckets: The upper bounds of the buckets
+        - labels: The labels of the sample"""
+        samples = self.__samples
+        index = bisect_left(buckets, value)
+        if index < len(buckets):
+            samples[self.__bucket(name, labels, buckets[index])] += 1
+        samples[self.__lookup(f"{name}_sum", labels)] += value
+        samples[self.__lookup(f"{name}_count", labels)] += 1
+
+    def samples(self) -> dict[str, float]:
+        """The current value of every sample, histogram buckets are not cumulative
+
+        - returns: The values by the name and labels of the samples"""
+        return dict(self.__samples)
+
+    def __lookup(self, name: str, labels: dict[str, str]) -> str:
+        cache = (name, tuple(labels.items()))
+        key = self.__keys.get(cache)
+        if key is None:
+            key = self.__keys[cache] = _key(name, labels)
+        return key
+
+    def __bucket(self, name: str, labels: dict[str, str], bound: float) -> str:
+        return self.__lookup(f"{name}_bucket", {**labels, "le": repr(bound)})
+
+
+def labelled(samples: Mapping[str, float], /, **labels: str) -> dict[str, float]:
+    """Add labels to every sample, used to tell apart the samples of different proxies
+
+    - samples: The values by the name and labels of the samples
+    - labels: The labels to add
+
+    - returns: The values by the name and the new labels of the samples"""
+    added = ",".join(f'{label}="{value}"' for label, value in sorted(labels.items()))
+    result: dict[str, float] = {}
+    for key, value in samples.items():
+        name, _, inner = key.partition("{")
+        result[f"{name}{{{added},{inner}" if inner else f"{name}{{{added}}}"] = value
+    return result
+
+
+def render(samples: Mapping[str, float], /) -> str:
+    """Format samples with the Prometheus text exposition format
+
+    - samples: The values by the name and labels of the samples
+
+    - returns: The text to expose"""
+    families: defaultdict[str, list[tuple[str, float]]] = defaultdict(list)
+    for key, value in sorted(samples.items()):
+        families[key.split("{", 1)[0]].append((key, value))
+    histograms = {
+        name[: -len("_count")]
+        for name in families
+        if name.endswith("_count") and f"{name[: -len('_count')]}_sum" in families
+    }
+    parts = {f"{base}_{suffix}" for base in histograms for suffix in _PARTS}
+    names = sorted((families.keys() - parts) | histograms)
+    lines: list[str] = []
+    for name in names:
+        if name in histograms:
+            lines.append(f"# TYPE {name} histogram")
+            lines.extend(_histogram(name, families))
+        else:
+            kind = "counter" if name.endswith("_total") else "gauge"
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{key} {_number(value)}" for key, value in families[name])
+    return "\n".join(lines) + "\n"
+
+
+_PARTS = ("bucket", "sum", "count")
+
+
+def _number(value: float, /) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _labels(key: str, /) -> str:
+    _, _, labels = key.partition("{")
+    return labels[:-1]
+
+
+def _histogram(
+    name: str, families: Mapping[str, list[tuple[str, float]]], /
+) -> list[str]:
+    buckets: defaultdict[str, list[tuple[float, str, float]]] = defaultdict(list)
+    for key, value in families.get(f"{name}_bucket", []):
+        labels = _labels(key).split(",")
+        bound = next(label for label in labels if label.startswith("le="))
+        rest = ",".join(label for label in labels if not label.startswith("le="))
+        buckets[rest].append((float(bound[4:-1]), key, value))
+    sums = {_labels(key): value for key, value in families[f"{name}_sum"]}
+    lines: list[str] = []
+    for key, count in families[f"{name}_count"]:
+        rest = _labels(key)
+        total = 0.0
+        for _, bucket, value in sorted(buckets[rest]):
+            total += value
+            lines.append(f"{bucket} {_number(total)}")
+        infinity = f'{rest},le="+Inf"' if rest else 'le="+Inf"'
+        suffix = f"{{{rest}}}" if rest else ""
+        lines.append(f"{name}_bucket{{{infinity}}} {_number(count)}")
+        lines.append(f"{name}_sum{suffix} {_number(sums.get(rest, 0.0))}")
+        lines.append(f"{name}_count{suffix} {_number(count)}")
+    return lines
+
+
+async def expose(
+    samples: Callable[[], Mapping[str, float]], address: str, port: int, /
+) -> None:
+    """Serve the samples over http in the Prometheus format until cancelled
+
+    - samples: Function returning the current samples
+    - address: The address to listen on
+    - port: The port to listen on"""
+
+    async def respond(reader: StreamReader, writer: StreamWriter) -> None:
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = render(samples()).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                b"Content-Length: %d\r\n"
+                b"Connection: close\r\n\r\n" % len(body)
+            )
+            writer.write(body)
+            await writer.drain()
+        except (IncompleteReadError, LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await start_server(respond, address, port)
+    _expose_logger.info(f"Exposing the metrics on {address}:{port}")
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,57 @@
+from __future__ import annotations
+from asyncio import gather, get_running_loop, wait
+from collections.abc import Mapping
+from logging import getLogger
+from typing_extensions import override
+from typing import final
+
+from ._laproxy import Proxy
+from ._metrics import labelled
+
+
+class MultiProxy(Proxy):
+    """Proxy running several routes in the same event loop,
+    and in the same worker processes when run with more than one worker.
+    Every route keeps its own handler, limits and flow control,
+    its counters are labelled with route="name\""""
+
+    __logger = getLogger("laproxy.MultiProxy")
+
+    def __init__(self, routes: Mapping[str, Proxy], /):
+        """- routes: The proxies to run by the name of their route"""
+        if not routes:
+            raise ValueError("No route to run")
+        self.__routes = dict(routes)
+
+    @property
+    def routes(self) -> Mapping[str, Proxy]:
+        """The proxies of the routes by their name"""
+        return self.__routes
+
+    @override
+    def counters(self) -> dict[str, float]:
+        samples: dict[str, float] = {}
+        for name, proxy in self.__routes.items():
+            samples.update(labelled(proxy.counters(), route=name))
+        return samples
+
+    @override
+    def bind(self, *, reuse_port: bool) -> None:
+        for proxy in self.__routes.values():
+            proxy.bind(reuse_port=reuse_port)
+
+    @override
+    @final
+    async def run_async(self) -> None:
+        MultiProxy.__logger.info(f"Starting {len(self.__routes)} routes")
+        loop = get_running_loop()
+        tasks = [
+            loop.create_task(proxy.run_async(), name=f"route {name}")
+            for name, proxy in self.__routes.items()
+        ]
+        try:
+            await gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await wait(tasks)
@@ -0,0 +1,126 @@
+from __future__ import annotations
+from asyncio import Event, TimeoutError, wait_for
+from collections import deque
+from logging import getLogger
+from socket import MSG_PEEK, socket
+from time import monotonic
+from attrs import define
+
+from ._sockets import Resolver, SocketOptions, connect
+
+DEFAULT_DNS_TTL = 30.0
+RETRY_DELAY = 1.0
+
+
+@define
+class PoolConfig:
+    """Limits of the pool of idle connections to the target"""
+
+    min_idle: int = 4
+    """Number of connected sockets kept ready, refilled in the background"""
+    max_idle: int = 16
+    """Maximum number of idle sockets, including the ones given back by keep-alive reuse"""
+    max_age: float = 30.0
+    """Seconds after which an idle socket is closed instead of being used"""
+    dns_ttl: float = DEFAULT_DNS_TTL
+    """Seconds the resolution of the target address is kept"""
+
+
+def _healthy(sock: socket, /) -> bool:
+    try:
+        return sock.recv(1, MSG_PEEK) != b""
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+
+
+class UpstreamPool:
+    """Connections to the target opened before the clients arrive"""
+
+    __logger = getLogger("laproxy.UpstreamPool")
+
+    def __init__(
+        self,
+        address: str,
+        port: int,
+        config: PoolConfig,
+        /,
+        *,
+        options: SocketOptions | None = None,
+    ) -> None:
+        """- address: The address of the target
+        - port: The port of the target
+        - config: The limits of the pool
+        - options: The options of the sockets, None for the defaults of the proxy"""
+        self.__options = options
+        self.__address = address
+        self.__port = port
+        self.__config = config
+        self.__resolver = Resolver(config.dns_ttl)
+        self.__idle: deque[tuple[socket, float]] = deque()
+        self.__wakeup = Event()
+
+    def __len__(self) -> int:
+        return len(self.__idle)
+
+    async def acquire(self) -> socket:
+        """Get a connected socket, opening a new one if none of the idle ones is usable
+
+        - returns: The socket"""
+        self.__wakeup.set()
+        now = monotonic()
+        while self.__idle:
+            sock, created = self.__idle.popleft()
+            if now - created < self.__config.max_age and _healthy(sock):
+                return sock
+            sock.close()
+        UpstreamPool.__logger.debug("No idle connection available")
+        return await connect(
+            self.__address,
+            self.__port,
+            resolver=self.__resolver,
+            options=self.__options,
+        )
+
+    def release(self, sock: socket, /) -> None:
+        """Give back a socket that can be reused by another client
+
+        - sock: The socket, closed if the pool is full"""
+        if len(self.__idle) >= self.__config.max_idle or not _healthy(sock):
+            sock.close()
+            return
+        self.__idle.append((sock, monotonic()))
+
+    async def run(self) -> None:
+        """Keep the pool filled until cancelled, closing the idle sockets at the end"""
+        try:
+            while True:
+                self.__expire()
+                while len(self.__idle) < self.__config.min_idle:
+                    try:
+                        sock = await connect(
+                            self.__address,
+                            self.__port,
+                            resolver=self.__resolver,
+                            options=self.__options,
+                        )
+                    except OSError:
+                        UpstreamPool.__logger.warning(
+                            "Unable to connect to the target", exc_info=True
+                        )
+                        break
+                    self.__idle.append((sock, monotonic()))
+                self.__wakeup.clear()
+                try:
+                    await wait_for(self.__wakeup.wait(), RETRY_DELAY)
+                except TimeoutError:
+                    pass
+        finally:
+            while self.__idle:
+                self.__idle.popleft()[0].close()
+
+    def __expire(self) -> None:
+        now = monotonic()
+        while self.__idle and now - self.__idle[0][1] >= self.__config.max_age:
+            self.__idle.popleft()[0].close()
@@ -0,0 +1,242 @@
+from __future__ import annotations
+from asyncio import (
+    BaseTransport,
+    BufferedProtocol,
+    Future,
+    TimerHandle,
+    Transport,
+    get_running_loop,
+)
+from logging import getLogger
+from socket import socket
+from typing import TYPE_CHECKING, cast
+from typing_extensions import override
+
+from ._laproxy import Connection
+from ._matcher import HOLD_TIMEOUT
+
+if TYPE_CHECKING:
+    from ._tcp import TCPHandler
+
+MAX_READ_SIZE = 256 * 1024
+SHRINK_AFTER = 8
+
+
+class PacketProtocol(BufferedProtocol):
+    """Protocol receiving the data of one side of a connection in a reusable buffer
+    and passing it to the process method of a TCPHandler.
+    The read size doubles when a read fills the buffer and halves after
+    several reads that use less than half of it"""
+
+    __logger = getLogger("laproxy.PacketProtocol")
+
+    def __init__(
+        self,
+        handler: TCPHandler,
+        connection: Connection,
+        inbound: bool,
+        closed: Future[None],
+        /,
+    ):
+        """- handler: The handler of the connection
+        - connection: The flow control of the connection
+        - inbound: If the data received by this protocol is coming from the outside
+        - closed: Future to complete when the transport is closed"""
+        self.__handler = handler
+        self.__connection = connection
+        self.__inbound = inbound
+        self.__extra = connection.context(inbound)
+        self.__closed = closed
+        self.__zero_copy = handler.zero_copy()
+        self.__min_size = handler.buffsize()
+        self.__buffer = bytearray(self.__min_size)
+        self.__view = memoryview(self.__buffer)
+        self.__small_reads = 0
+        self.__pending = bytearray()
+        self.__transport: Transport | None = None
+        self.__peer: PacketProtocol | None = None
+        self.__throttled = False
+        self.__flush: TimerHandle | None = None
+
+    def link(self, peer: PacketProtocol, /) -> None:
+        """Start forwarding the received data to another protocol
+
+        - peer: The protocol of the other side of the connection"""
+        self.__peer = peer
+        assert self.__transport is not None
+        flow = self.__connection.flow(not self.__inbound)
+        self.__transport.set_write_buffer_limits(
+            flow.high_watermark, flow.low_watermark
+        )
+        if self.__pending:
+            pending = bytes(self.__pending)
+            self.__pending.clear()
+            if self.__forward(pending) is None:
+                return
+        self.__transport.resume_reading()
+
+    @override
+    def connection_made(self, transport: BaseTransport) -> None:
+        self.__transport = cast(Transport, transport)
+
+    @override
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self.__view
+
+    @override
+    def buffer_updated(self, nbytes: int) -> None:
+        data = self.__view[:nbytes]
+        if self.__peer is None:
+            assert self.__transport is not None
+            self.__pending.extend(data)
+            self.__transport.pause_reading()
+            return
+        packet = self.__forward(data if self.__zero_copy else bytes(data))
+        if packet is None:
+            return
+        transport = self.__peer.__transport
+        assert transport is not None
+        size = transport.get_write_buffer_size()
+        if size and isinstance(packet, memoryview) and packet.obj is self.__buffer:
+            # The transport may still reference the buffer, stop reusing it
+            self.__resize(len(self.__buffer))
+        elif nbytes == len(self.__buffer):
+            self.__small_reads = 0
+            if nbytes < MAX_READ_SIZE:
+                self.__resize(nbytes * 2)
+        elif nbytes < len(self.__buffer) // 2 and len(self.__buffer) > self.__min_size:
+            self.__small_reads += 1
+            if self.__small_reads >= SHRINK_AFTER:
+                self.__small_reads = 0
+                self.__resize(len(self.__buffer) // 2)
+        else:
+            self.__small_reads = 0
+
+    @override
+    def eof_received(self) -> bool | None:
+        if self.__flush is not None:
+            self.__flush.cancel()
+        if self.__peer is not None and self.__handler.holding(self.__inbound):
+            self.__forward(b"", final=True)
+        self.close()
+        return False
+
+    @override
+    def pause_writing(self) -> None:
+        assert self.__peer is not None and self.__peer.__transport is not None
+        self.__connection.stats.throttled(not self.__inbound)
+        self.__peer.__transport.pause_reading()
+
+    @override
+    def resume_writing(self) -> None:
+        assert self.__peer is not None and self.__peer.__transport is not None
+        if not self.__peer.__transport.is_closing() and not self.__peer.__throttled:
+            self.__peer.__transport.resume_reading()
+
+    @override
+    def connection_lost(self, exc: Exception | None) -> None:
+        if exc is not None:
+            PacketProtocol.__logger.debug(
+                "Connection lost, inbound=%s",
+                self.__inbound,
+                exc_info=exc,
+                extra=self.__extra,
+            )
+        if self.__flush is not None:
+            self.__flush.cancel()
+        self.close()
+        if not self.__closed.done():
+            self.__closed.set_result(None)
+
+    def __forward(
+        self, data: bytes | memoryview, final: bool = False
+    ) -> bytes | memoryview | None:
+        assert self.__peer is not None and self.__peer.__transport is not None
+        if self.__flush is not None:
+            self.__flush.cancel()
+            self.__flush = None
+        packet = self.__handler.process_packet(data, self.__inbound, final=final)
+        if packet is None:
+            PacketProtocol.__logger.info(
+                "Dropping connection, inbound=%s", self.__inbound, extra=self.__extra
+            )
+            self.__connection.dropped(self.__handler.drop_reason())
+            self.close()
+            return None
+        transport = self.__peer.__transport
+        transport.write(packet)
+        delay = self.__connection.transferred(len(packet), self.__inbound)
+        if delay:
+            self.__throttle(delay)
+        size = transport.get_write_buffer_size()
+        flow = self.__connection.flow(self.__inbound)
+        if flow.max_buffer is not None and size > flow.max_buffer:
+            PacketProtocol.__logger.info(
+                "Write buffer limit exceeded, %d > %d, inbound=%s",
+                size,
+                flow.max_buffer,
+                self.__inbound,
+                extra=self.__extra,
+            )
+            self.__connection.stats.overflowed(self.__inbound)
+            self.__connection.dropped("buffer_limit")
+            self.close()
+            return None
+        if self.__handler.holding(self.__inbound):
+            self.__flush = get_running_loop().call_later(
+                HOLD_TIMEOUT, self.__forward, b"", True
+            )
+        return packet
+
+    def __throttle(self, delay: float) -> None:
+        assert self.__transport is not None
+        self.__throttled = True
+        self.__transport.pause_reading()
+        get_running_loop().call_later(delay, self.__unthrottle)
+
+    def __unthrottle(self) -> None:
+        self.__throttled = False
+        assert self.__transport is not None and self.__peer is not None
+        peer = self.__peer.__transport
+        if self.__transport.is_closing() or peer is None:
+            return
+        flow = self.__connection.flow(self.__inbound)
+        if peer.get_write_buffer_size() <= flow.high_watermark:
+            self.__transport.resume_reading()
+
+    def __resize(self, size: int) -> None:
+        self.__buffer = bytearray(size)
+        self.__view = memoryview(self.__buffer)
+
+    def close(self) -> None:
+        """Close both sides of the connection after sending the buffered data"""
+        if self.__transport is not None:
+            self.__transport.close()
+        if self.__peer is not None and self.__peer.__transport is not None:
+            self.__peer.__transport.close()
+
+
+async def handle_protocol(
+    handler: TCPHandler, connection: Connection, client: socket, target: socket, /
+) -> None:
+    """Forward a connection using buffered protocols instead of streams
+
+    - handler: The handler of the connection
+    - connection: The flow control of the connection
+    - client: The socket of the client
+    - target: The socket of the target"""
+    loop = get_running_loop()
+    inbound_closed: Future[None] = loop.create_future()
+    outbound_closed: Future[None] = loop.create_future()
+    inbound = PacketProtocol(handler, connection, True, inbound_closed)
+    outbound = PacketProtocol(handler, connection, False, outbound_closed)
+    try:
+        await loop.connect_accepted_socket(lambda: inbound, client)
+        await loop.create_connection(lambda: outbound, sock=target)
+        inbound.link(outbound)
+        outbound.link(inbound)
+        await inbound_closed
+        await outbound_closed
+    finally:
+        inbound.close()
+        outbound.close()
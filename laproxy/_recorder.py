@@ -0,0 +1,175 @@
+from __future__ import annotations
+from collections.abc import Iterator
+from logging import getLogger
+from os import getpid, path as os_path
+from queue import Empty, SimpleQueue
+from struct import Struct
+from threading import Thread
+from time import localtime, monotonic, strftime, time
+from typing import BinaryIO, Literal, Tuple, Union
+from attrs import define
+
+Event = Literal["open", "received", "sent", "drop", "close"]
+"""What happened to a connection: opened with the peer as data, data read before the handler,
+data written after the handler, dropped with the reason as data, closed"""
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_AGE = 3600.0
+BATCH_SIZE = 1024 * 1024
+MAGIC = b"LAPXREC\x01"
+SUFFIX = ".lprec"
+
+_EVENTS: tuple[Event, ...] = ("open", "received", "sent", "drop", "close")
+_CODES = {event: code for code, event in enumerate(_EVENTS)}
+_HEADER = Struct("<dQB?I")
+_Item = Union[Tuple[float, int, int, bool, bytes], None]
+
+
+@define(frozen=True)
+class Record:
+    """An event of a recorded connection"""
+
+    time: float
+    """Unix time of the event"""
+    connection: int
+    """Id of the connection in the proxy process"""
+    event: Event
+    """What happened"""
+    inbound: bool
+    """The direction of the data, False for the events without a direction"""
+    data: bytes
+    """The bytes of the event"""
+
+
+class Recorder:
+    """Records the data of the connections before and after the handler.
+    The events are queued by the event loop and written in batches by a background thread
+    in an append-only file of records, rotated when it is too big or too old.
+    Every record is a little endian header with the time as a double,
+    the connection id, the event code, the direction and the size of the data,
+    followed by the data"""
+
+    __logger = getLogger("laproxy.Recorder")
+
+    def __init__(
+        self,
+        directory: str,
+        /,
+        *,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_age: float = DEFAULT_MAX_AGE,
+    ):
+        """- directory: Where to create the files, their names contain the time they were opened and the process id
+        - max_bytes: The size after which a new file is started
+        - max_age: The seconds after which a new file is started"""
+        self.__directory = directory
+        self.__max_bytes = max_bytes
+        self.__max_age = max_age
+        self.__queue: SimpleQueue[_Item] = SimpleQueue()
+        self.__thread: Thread | None = None
+        self.__files = 0
+
+    def start(self) -> None:
+        """Start the thread writing the events"""
+        if self.__thread is not None:
+            return
+        self.__thread = Thread(
+            target=self.__write, name="laproxy recorder", daemon=True
+        )
+        self.__thread.start()
+
+    def stop(self) -> None:
+        """Write the queued events and close the file"""
+        thread = self.__thread
+        if thread is None:
+            return
+        self.__thread = None
+        self.__queue.put(None)
+        thread.join()
+
+    def record(
+        self, connection: int, event: Event, data: bytes | memoryview, inbound: bool, /
+    ) -> None:
+        """Queue an event, copying the data if it is a view
+
+        - connection: The id of the connection
+        - event: What happened
+        - data: The bytes of the event
+        - inbound: The direction of the data"""
+        self.__queue.put((time(), connection, _CODES[event], inbound, bytes(data)))
+
+    def __write(self) -> None:
+        file: BinaryIO | None = None
+        opened = 0.0
+        try:
+            while True:
+                batch, stopping = self.__batch()
+                try:
+                    if file is not None and (
+                        file.tell() >= self.__max_bytes
+                        or monotonic() - opened >= self.__max_age
+                    ):
+                        file.close()
+                        file = None
+                    if batch:
+                        if file is None:
+                            file = self.__open()
+                            opened = monotonic()
+                        file.write(b"".join(batch))
+                        file.flush()
+                except OSError:
+                    Recorder.__logger.error(
+                        "Unable to write the recording, discarding a batch",
+                        exc_info=True,
+                    )
+                if stopping:
+                    return
+        finally:
+            if file is not None:
+                file.close()
+
+    def __batch(self) -> tuple[list[bytes], bool]:
+        parts: list[bytes] = []
+        size = 0
+        item = self.__queue.get()
+        while item is not None:
+            moment, connection, code, inbound, data = item
+            parts.append(_HEADER.pack(moment, connection, code, inbound, len(data)))
+            parts.append(data)
+            size += _HEADER.size + len(data)
+            if size >= BATCH_SIZE:
+                return parts, False
+            try:
+                item = self.__queue.get_nowait()
+            except Empty:
+                return parts, False
+        return parts, True
+
+    def __open(self) -> BinaryIO:
+        self.__files += 1
+        opened = strftime("%Y%m%d-%H%M%S", localtime())
+        name = f"laproxy-{opened}-{getpid()}-{self.__files}{SUFFIX}"
+        file = open(os_path.join(self.__directory, name), "ab")
+        if file.tell() == 0:
+            file.write(MAGIC)
+        Recorder.__logger.info(f"Recording to {file.name}")
+        return file
+
+
+def read_records(path: str, /) -> Iterator[Record]:
+    """Read the events of a recording file
+
+    - path: The file written by a Recorder
+
+    - returns: The events in the order they were written"""
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a recording")
+        while header := file.read(_HEADER.size):
+            if len(header) < _HEADER.size:
+                return
+            moment, connection, code, inbound, size = _HEADER.unpack(header)
+            data = file.read(size)
+            if len(data) < size:
+                return
+            yield Record(moment, connection, _EVENTS[code], inbound, data)
@@ -0,0 +1,127 @@
+from __future__ import annotations
+from asyncio import get_running_loop, sleep
+from collections.abc import Callable
+from functools import reduce
+from importlib.util import module_from_spec, spec_from_file_location
+from logging import getLogger
+from os import stat
+from pathlib import Path
+from sys import modules
+from typing import TYPE_CHECKING, Tuple, cast
+
+from ._metrics import Metrics
+
+if TYPE_CHECKING:
+    from ._laproxy import Handler
+
+    Loaded = Tuple[str, Callable[[], Handler]]
+
+DEFAULT_RELOAD_INTERVAL = 0.5
+
+
+class Reloader:
+    """Handler constructor that imports again the file of a handler when it changes.
+    The new code is loaded as a new module, so the connections already open
+    keep the handler they were created with, and a file that fails to load
+    leaves the previous code in use"""
+
+    __logger = getLogger("laproxy.Reloader")
+
+    def __init__(
+        self,
+        handler: Callable[[], Handler],
+        /,
+        *,
+        interval: float = DEFAULT_RELOAD_INTERVAL,
+        metrics: Metrics | None = None,
+    ):
+        """- handler: The handler class or function, defined at the top level of a file
+        - interval: The seconds between two checks of the file
+        - metrics: Where to count the reloads"""
+        module = modules.get(getattr(handler, "__module__", ""))
+        path = getattr(module, "__file__", None)
+        qualname: str = getattr(handler, "__qualname__", "<unknown>")
+        if path is None or "<" in qualname:
+            raise ValueError(
+                f"Unable to reload {handler!r}, it must be defined at the top level of a file"
+            )
+        self.__path: str = path
+        self.__qualname = qualname
+        self.__handler = handler
+        self.__interval = interval
+        self.__metrics = metrics or Metrics()
+        self.__generation = 0
+        self.__module: str | None = None
+        self.__mtime = self.__modified()
+
+    def __call__(self) -> Handler:
+        return self.__handler()
+
+    @property
+    def generation(self) -> int:
+        """Number of successful reloads, 0 while the original code is in use"""
+        return self.__generation
+
+    async def run(self) -> None:
+        """Check the file until cancelled, loading it in a thread when it changes.
+        The new handler is put in use back in the event loop"""
+        loop = get_running_loop()
+        Reloader.__logger.info(f"Watching {self.__path} for changes")
+        while True:
+            await sleep(self.__interval)
+            mtime = self.__modified()
+            if mtime is None or mtime == self.__mtime:
+                continue
+            self.__mtime = mtime
+            self.__swap(await loop.run_in_executor(None, self.__load))
+
+    def reload(self) -> bool:
+        """Load the file again and use its handler for the next connections
+
+        - returns: False if the file couldn't be loaded and the previous handler is kept
+        """
+        return self.__swap(self.__load())
+
+    def __load(self) -> Loaded | None:
+        generation = self.__generation + 1
+        name = f"_laproxy_reload{generation}_{Path(self.__path).stem}"
+        try:
+            spec = spec_from_file_location(name, self.__path)
+            if spec is None or spec.loader is None:
+                raise ImportError(f"Unable to load {self.__path}")
+            module = module_from_spec(spec)
+            modules[name] = module
+            spec.loader.exec_module(module)
+            handler = cast(
+                "Callable[[], Handler]",
+                reduce(getattr, self.__qualname.split("."), module),
+            )
+        except Exception:
+            modules.pop(name, None)
+            Reloader.__logger.error(
+                f"Unable to reload {self.__path}, keeping the previous handler",
+                exc_info=True,
+            )
+            return None
+        return name, handler
+
+    def __swap(self, loaded: Loaded | None, /) -> bool:
+        if loaded is None:
+            self.__metrics.inc("laproxy_reloads_total", result="error")
+            return False
+        name, handler = loaded
+        generation = self.__generation + 1
+        if self.__module is not None:
+            modules.pop(self.__module, None)
+        self.__module = name
+        self.__handler = handler
+        self.__generation = generation
+        Reloader.__logger.info(f"Reloaded {self.__path}, generation {generation}")
+        self.__metrics.inc("laproxy_reloads_total", result="ok")
+        return True
+
+    def __modified(self) -> int | None:
+        try:
+            return stat(self.__path).st_mtime_ns
+        except OSError:
+            return None
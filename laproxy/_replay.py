@@ -0,0 +1,142 @@
+from __future__ import annotations
+from asyncio import StreamReader, gather, get_running_loop, open_connection
+from collections.abc import Callable, Iterable
+from logging import getLogger
+from socket import create_connection, socket
+from time import perf_counter
+from attrs import define, field
+
+from ._laproxy import CONNECTION, Connection, Handler
+from ._recorder import Event, Record, read_records
+from ._tcp import TCPHandler
+
+_replay_logger = getLogger("laproxy.replay")
+
+
+@define
+class ReplayReport:
+    """Outcome of feeding recorded connections to a handler"""
+
+    sessions: int = 0
+    """Number of replayed connections"""
+    packets: int = 0
+    """Number of recorded reads given to the handler"""
+    bytes: int = 0
+    """Number of bytes given to the handler"""
+    seconds: float = 0.0
+    """Time spent replaying"""
+    mismatches: list[int] = field(factory=list)
+    """Ids of the connections whose output or verdict is different from the recorded one"""
+
+
+def sessions(paths: Iterable[str], /) -> list[list[Record]]:
+    """Group the events of recording files by connection
+
+    - paths: The files written by a Recorder
+
+    - returns: The events of every connection, in the order the connections were opened"""
+    result: list[list[Record]] = []
+    for path in paths:
+        current: dict[int, list[Record]] = {}
+        for record in read_records(path):
+            if record.event == "open" or record.connection not in current:
+                current[record.connection] = []
+                result.append(current[record.connection])
+            current[record.connection].append(record)
+    return result
+
+
+async def replay(
+    paths: Iterable[str], handler: Callable[[], Handler], /
+) -> ReplayReport:
+    """Feed the recorded connections to a handler as fast as possible, one after the other,
+    comparing what it sends and if it drops the connection with the recording.
+    TCP handlers receive the packets as they were read,
+    other handlers read the recorded data of each direction from a stream
+
+    - paths: The files written by a Recorder
+    - handler: The constructor of the handler to test
+
+    - returns: The totals and the connections that behaved differently"""
+    report = ReplayReport()
+    loaded = sessions(paths)
+    start = perf_counter()
+    for records in loaded:
+        received = [record for record in records if record.event == "received"]
+        report.sessions += 1
+        report.packets += len(received)
+        report.bytes += sum(len(record.data) for record in received)
+        task = get_running_loop().create_task(_replay_session(records, handler))
+        if not await task:
+            _replay_logger.info(f"Connection {records[0].connection} changed")
+            report.mismatches.append(records[0].connection)
+    report.seconds = perf_counter() - start
+    return report
+
+
+def _output(records: list[Record], event: Event, inbound: bool, /) -> bytes:
+    return b"".join(
+        record.data
+        for record in records
+        if record.event == event and record.inbound == inbound
+    )
+
+
+async def _replay_session(
+    records: list[Record], factory: Callable[[], Handler], /
+) -> bool:
+    connection = Connection()
+    CONNECTION.set(connection)
+    handler = factory()
+    expected = (_output(records, "sent", False), _output(records, "sent", True))
+    if isinstance(handler, TCPHandler):
+        output: tuple[list[bytes], list[bytes]] = ([], [])
+        stopped: set[bool] = set()
+        for record in records:
+            if record.event != "received" or record.inbound in stopped:
+                continue
+            packet = await handler.process_packet_async(record.data, record.inbound)
+            if packet is None:
+                handler.dropped()
+                stopped.add(record.inbound)
+                continue
+            output[record.inbound].append(packet)
+        for inbound in (False, True):
+            if inbound in stopped or not handler.holding(inbound):
+                continue
+            packet = await handler.process_packet_async(b"", inbound, final=True)
+            if packet is None:
+                handler.dropped()
+                continue
+            output[inbound].append(packet)
+        actual = (b"".join(output[False]), b"".join(output[True]))
+    else:
+        actual = tuple(
+            await gather(
+                _replay_stream(handler, _output(records, "received", False), False),
+                _replay_stream(handler, _output(records, "received", True), True),
+            )
+        )
+    dropped = any(record.event == "drop" for record in records)
+    return actual == expected and (connection.drop_reason is not None) == dropped
+
+
+async def _replay_stream(handler: Handler, data: bytes, inbound: bool, /) -> bytes:
+    reader = StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    with socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        left = create_connection(listener.getsockname())
+        right, _ = listener.accept()
+    _, writer = await open_connection(sock=left)
+    output, other = await open_connection(sock=right)
+    collected = get_running_loop().create_task(output.read())
+    try:
+        await handler.handle(reader, writer, inbound)
+    finally:
+        writer.close()
+    result = await collected
+    other.close()
+    return result
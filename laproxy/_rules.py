@@ -0,0 +1,554 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from collections.abc import Mapping, Sequence
+from functools import lru_cache
+from json import loads as json_loads
+from logging import getLogger
+from mmap import mmap
+from os import PathLike, stat
+from pathlib import Path
+from re import IGNORECASE, Pattern as RegexPattern, compile, escape
+from typing import Any, Literal
+from attrs import define
+from typing_extensions import override
+
+from ._encoding import ContentEncodingException, content_encodings
+from ._laproxy import Handler
+from ._http import HTTPHandler, HTTPHeaders, HTTPPayload, HTTPRequest, HTTPResponse
+from ._matcher import Action, Pattern, Scanner, compile_patterns
+from ._tcp import TCPHandler
+
+try:
+    from tomllib import loads as toml_loads  # type: ignore
+except ImportError:  # pragma: no cover
+    try:
+        from tomli import loads as toml_loads  # type: ignore
+    except ImportError:
+        toml_loads = None
+
+try:
+    import yaml  # type: ignore
+except ImportError:  # pragma: no cover
+    yaml = None
+
+RuleAction = Literal["drop", "replace", "delay", "log"]
+"""What to do when a rule matches: close the connection, replace the matches of its pattern,
+wait before forwarding the message or log it"""
+
+PLAN_CACHE_SIZE = 1024
+_ACTIONS: dict[RuleAction, Action] = {
+    "drop": "drop",
+    "replace": "replace",
+    "delay": "log",
+    "log": "log",
+}
+_DIRECTIONS = {"inbound": True, "outbound": False, "both": None}
+_KEYS = {
+    "name",
+    "action",
+    "direction",
+    "method",
+    "path",
+    "header",
+    "regex",
+    "bytes",
+    "ignore_case",
+    "replacement",
+    "delay",
+}
+
+_rules_logger = getLogger("laproxy.rules")
+
+
+class InvalidRulesException(ValueError):
+    """Exception raised when a rules file can't be read or a rule is not valid"""
+
+    ...
+
+
+@define(frozen=True)
+class Rule:
+    """A condition on a message or a packet and the action to take when it holds.
+    All the given conditions must hold for the rule to match"""
+
+    name: str
+    """Name of the rule, used in the logs"""
+    action: RuleAction = "drop"
+    """What to do when the rule matches"""
+    inbound: bool | None = None
+    """The direction the rule applies to, None for both"""
+    method: str | None = None
+    """The method of the request, for the responses the one of the request they answer.
+    None for any method, a rule with a method never matches tcp packets"""
+    path: str | None = None
+    """Prefix of the path of the request, for the responses the one of the request they answer.
+    None for any path, a rule with a path never matches tcp packets"""
+    header: str | None = None
+    """Name of a header the message must have, None to not check the headers"""
+    header_pattern: RegexPattern[str] | None = None
+    """Regular expression searched in the values of the header, None to only require the header"""
+    pattern: bytes | RegexPattern[bytes] | None = None
+    """Bytes or bytes regular expression to find in the body or in the packet,
+    None to match without looking at the data"""
+    replacement: bytes = b""
+    """The bytes to put in place of the matches of the pattern when the action is replace"""
+    delay: float = 0.0
+    """Seconds to wait before forwarding the message when the action is delay"""
+
+
+@define(frozen=True)
+class Verdict:
+    """The outcome of the rules for a message or a packet"""
+
+    drop: bool = False
+    """If the connection should be closed"""
+    delay: float = 0.0
+    """Seconds to wait before forwarding, the longest delay of the matched rules"""
+    data: bytes | None = None
+    """The data with the replacements applied, None if nothing was replaced"""
+    matched: tuple[Rule, ...] = ()
+    """The rules that matched, in the order they were found"""
+
+
+class _Plan:
+    """The rules selected for a message with their patterns compiled together,
+    so the data is scanned once whatever the number of patterns"""
+
+    def __init__(self, rules: Sequence[Rule], /):
+        self.__always = tuple(rule for rule in rules if rule.pattern is None)
+        self.__rules: dict[Pattern, Rule] = {}
+        for rule in rules:
+            if rule.pattern is not None:
+                pattern = Pattern(rule.pattern, _ACTIONS[rule.action], rule.replacement)
+                self.__rules.setdefault(pattern, rule)
+        self.__matcher = compile_patterns(tuple(self.__rules)) if self.__rules else None
+
+    def scanner(self) -> Scanner | None:
+        if self.__matcher is None:
+            return None
+        return self.__matcher.scanner(True, quiet=True)
+
+    def verdict(
+        self,
+        found: Sequence[Pattern],
+        /,
+        *,
+        drop: bool = False,
+        data: bytes | None = None,
+    ) -> Verdict:
+        matched = list(self.__always)
+        for pattern in found:
+            rule = self.__rules[pattern]
+            if rule not in matched:
+                matched.append(rule)
+        return Verdict(
+            drop=drop or any(rule.action == "drop" for rule in matched),
+            delay=max(
+                (rule.delay for rule in matched if rule.action == "delay"),
+                default=0.0,
+            ),
+            data=data,
+            matched=tuple(matched),
+        )
+
+    def apply(self, data: bytes | mmap, /) -> Verdict:
+        if any(rule.action == "drop" for rule in self.__always):
+            return self.verdict(())
+        scanner = self.scanner()
+        if scanner is None:
+            return self.verdict(())
+        result = scanner.scan(data, final=True)  # type: ignore
+        return self.verdict(
+            scanner.found,
+            drop=result is None,
+            data=None if result is None or result is data else result,
+        )
+
+
+class RuleSet:
+    """Rules compiled in a single decision structure.
+    The rules are indexed by direction, method and path prefix,
+    and the patterns of the selected rules are found with one scan of the data.
+    When several patterns match at the same position the first rule wins"""
+
+    def __init__(self, rules: Sequence[Rule], /):
+        """- rules: The rules, in order of priority"""
+        self.__rules = tuple(rules)
+        for rule in self.__rules:
+            if rule.action == "replace" and rule.pattern is None:
+                raise InvalidRulesException(
+                    f"Rule {rule.name} replaces without a pattern"
+                )
+        buckets: defaultdict[
+            tuple[bool, str | None], defaultdict[str, list[int]]
+        ] = defaultdict(lambda: defaultdict(list))
+        for index, rule in enumerate(self.__rules):
+            method = None if rule.method is None else rule.method.upper()
+            for inbound in (False, True):
+                if rule.inbound is None or rule.inbound == inbound:
+                    buckets[inbound, method][rule.path or ""].append(index)
+        self.__index: dict[
+            tuple[bool, str | None], list[tuple[int, dict[str, tuple[int, ...]]]]
+        ] = {}
+        for key, prefixes in buckets.items():
+            lengths: defaultdict[int, dict[str, tuple[int, ...]]] = defaultdict(dict)
+            for prefix, indices in prefixes.items():
+                lengths[len(prefix)][prefix] = tuple(indices)
+            self.__index[key] = sorted(lengths.items())
+        self.__plans: dict[tuple[int, ...], _Plan] = {}
+
+    @property
+    def rules(self) -> tuple[Rule, ...]:
+        """The rules, in order of priority"""
+        return self.__rules
+
+    def evaluate(
+        self,
+        data: bytes | mmap,
+        inbound: bool,
+        /,
+        *,
+        method: str | None = None,
+        path: str | None = None,
+        headers: HTTPHeaders | None = None,
+    ) -> Verdict:
+        """Apply the rules to a message or a packet
+
+        - data: The body of the message or the packet
+        - inbound: The direction of the data
+        - method: The method of the request, None for a tcp packet
+        - path: The path of the request, None for a tcp packet
+        - headers: The headers of the message, None for a tcp packet
+
+        - returns: What to do with the data"""
+        plan = self.__plan(inbound, method, path, headers)
+        if plan is None:
+            return Verdict()
+        return plan.apply(data)
+
+    def scanner(self, inbound: bool, /) -> Scanner | None:
+        """Create the scanner of the patterns of the rules applied to the packets
+        of a direction of a tcp connection, it finds them also when split among packets.
+        After every scan verdict() tells what to do with the packet
+
+        - inbound: The direction of the packets
+
+        - returns: The scanner or None if none of these rules has a pattern"""
+        plan = self.__plan(inbound, None, None, None)
+        return None if plan is None else plan.scanner()
+
+    def verdict(self, scanner: Scanner | None, inbound: bool, /) -> Verdict:
+        """Apply the rules to the last packet scanned by a scanner made by scanner()
+
+        - scanner: The scanner of the direction, it already applied the replacements
+        - inbound: The direction of the packet
+
+        - returns: What to do with the packet"""
+        plan = self.__plan(inbound, None, None, None)
+        if plan is None:
+            return Verdict()
+        return plan.verdict(() if scanner is None else scanner.found)
+
+    def __plan(
+        self,
+        inbound: bool,
+        method: str | None,
+        path: str | None,
+        headers: HTTPHeaders | None,
+        /,
+    ) -> _Plan | None:
+        selected = tuple(
+            index
+            for index in self.__candidates(inbound, method, path)
+            if self.__headers(self.__rules[index], headers)
+        )
+        if not selected:
+            return None
+        plan = self.__plans.get(selected)
+        if plan is None:
+            if len(self.__plans) >= PLAN_CACHE_SIZE:
+                self.__plans.clear()
+            plan = self.__plans[selected] = _Plan(
+                [self.__rules[index] for index in selected]
+            )
+        return plan
+
+    def __candidates(
+        self, inbound: bool, method: str | None, path: str | None, /
+    ) -> list[int]:
+        keys: list[tuple[bool, str | None]] = [(inbound, None)]
+        if method is not None:
+            keys.append((inbound, method.upper()))
+        found: list[int] = []
+        for key in keys:
+            for length, prefixes in self.__index.get(key, ()):
+                if length > (0 if path is None else len(path)):
+                    break
+                found.extend(prefixes.get("" if path is None else path[:length], ()))
+        found.sort()
+        return found
+
+    def __headers(self, rule: Rule, headers: HTTPHeaders | None, /) -> bool:
+        if rule.header is None:
+            return True
+        if headers is None:
+            return False
+        values = headers.get_all(rule.header)
+        if rule.header_pattern is None:
+            return bool(values)
+        return any(rule.header_pattern.search(value) for value in values)
+
+    def __len__(self) -> int:
+        return len(self.__rules)
+
+
+def _text(rule: Mapping[str, Any], key: str, /) -> str | None:
+    value = rule.get(key)
+    if value is not None and not isinstance(value, str):
+        raise InvalidRulesException(f"The {key} of a rule must be a string")
+    return value
+
+
+def _rule(index: int, rule: object, /) -> Rule:
+    if not isinstance(rule, Mapping):
+        raise InvalidRulesException(f"Rule {index} is not a table")
+    unknown = set(rule) - _KEYS
+    if unknown:
+        raise InvalidRulesException(f"Unknown keys in rule {index}: {sorted(unknown)}")
+    name = _text(rule, "name") or f"rule{index}"
+    action = rule.get("action", "drop")
+    if action not in ("drop", "replace", "delay", "log"):
+        raise InvalidRulesException(f"Unknown action {action!r} in rule {name}")
+    direction = rule.get("direction", "both")
+    if direction not in _DIRECTIONS:
+        raise InvalidRulesException(f"Unknown direction {direction!r} in rule {name}")
+    header = rule.get("header")
+    header_regex: str | None = None
+    if isinstance(header, Mapping):
+        header, header_regex = _text(header, "name"), _text(header, "regex")
+        if header is None:
+            raise InvalidRulesException(f"The header of rule {name} has no name")
+    elif header is not None and not isinstance(header, str):
+        raise InvalidRulesException(
+            f"The header of rule {name} must be a string or a table"
+        )
+    regex, literal = _text(rule, "regex"), _text(rule, "bytes")
+    if regex is not None and literal is not None:
+        raise InvalidRulesException(f"Rule {name} has both a regex and bytes")
+    flags = IGNORECASE if rule.get("ignore_case", False) else 0
+    pattern: bytes | RegexPattern[bytes] | None = None
+    try:
+        if regex is not None:
+            pattern = compile(regex.encode(), flags)
+        elif literal is not None:
+            pattern = (
+                compile(escape(literal.encode()), flags) if flags else literal.encode()
+            )
+        header_pattern = (
+            None if header_regex is None else compile(header_regex, IGNORECASE)
+        )
+    except Exception as e:
+        raise InvalidRulesException(f"Invalid regex in rule {name}: {e}") from e
+    delay = rule.get("delay", 0.0)
+    if not isinstance(delay, (int, float)) or delay < 0:
+        raise InvalidRulesException(
+            f"The delay of rule {name} must be a positive number"
+        )
+    return Rule(
+        name,
+        action,
+        inbound=_DIRECTIONS[direction],
+        method=_text(rule, "method"),
+        path=_text(rule, "path"),
+        header=header,
+        header_pattern=header_pattern,
+        pattern=pattern,
+        replacement=(_text(rule, "replacement") or "").encode(),
+        delay=float(delay),
+    )
+
+
+def parse_rules(document: object, /) -> RuleSet:
+    """Compile the rules of a parsed rules file
+
+    - document: A list of rules or a table with the list in its rules key,
+    as loaded from a JSON, TOML or YAML file
+
+    - returns: The compiled rules"""
+    if isinstance(document, Mapping):
+        document = document.get("rules", [])
+    if not isinstance(document, list):
+        raise InvalidRulesException("The rules must be a list")
+    return RuleSet([_rule(index, rule) for index, rule in enumerate(document)])
+
+
+@lru_cache(maxsize=32)
+def _load(path: str, _: int, /) -> RuleSet:
+    text = Path(path).read_text()
+    suffix = Path(path).suffix.lower()
+    try:
+        if suffix == ".json":
+            document = json_loads(text)
+        elif suffix == ".toml":
+            if toml_loads is None:
+                raise InvalidRulesException("The tomli package is not installed")
+            document = toml_loads(text)
+        elif suffix in (".yaml", ".yml"):
+            if yaml is None:
+                raise InvalidRulesException("The pyyaml package is not installed")
+            document = yaml.safe_load(text)
+        else:
+            raise InvalidRulesException(f"Unknown rules format {suffix}")
+    except InvalidRulesException:
+        raise
+    except Exception as e:
+        raise InvalidRulesException(f"Unable to parse {path}: {e}") from e
+    return parse_rules(document)
+
+
+def load_rules(path: str | PathLike[str], /) -> RuleSet:
+    """Read and compile a JSON, TOML or YAML rules file, chosen by its extension.
+    The compiled rules are reused until the file is modified
+
+    - path: The path of the file
+
+    - returns: The compiled rules"""
+    return _load(str(path), stat(path).st_mtime_ns)
+
+
+def _enforce(handler: Handler, verdict: Verdict, inbound: bool, /) -> bool:
+    for rule in verdict.matched:
+        if rule.action == "log":
+            _rules_logger.warning("Rule %s matched, inbound=%s", rule.name, inbound)
+    if verdict.drop:
+        rule = next(rule for rule in verdict.matched if rule.action == "drop")
+        _rules_logger.info("Rule %s matched, dropping the connection", rule.name)
+        handler.dropping("rule")
+        return False
+    if verdict.delay:
+        handler.delaying(verdict.delay, inbound)
+    return True
+
+
+class RuleTCPHandler(TCPHandler, ABC):
+    """TCP handler driven by rules instead of code.
+    Only the rules without a method, a path and a header apply to the packets,
+    their patterns take the place of patterns() and are found also when split among packets.
+    The protocol engine is not used when some of these rules delay"""
+
+    @abstractmethod
+    def rules(self) -> RuleSet:
+        """The rules applied to the packets, called once per connection.
+        Use load_rules() to compile a file once for all the connections
+
+        - returns: The compiled rules"""
+        ...
+
+    @override
+    def scanner(self, inbound: bool, /) -> Scanner | None:
+        try:
+            scanners = self.__scanners
+        except AttributeError:
+            rules = self.__ruleset()
+            scanners = self.__scanners = (rules.scanner(False), rules.scanner(True))
+        return scanners[inbound]
+
+    @override
+    def waits(self) -> bool:
+        return any(
+            rule.action == "delay"
+            and rule.method is None
+            and rule.path is None
+            and rule.header is None
+            for rule in self.__ruleset().rules
+        )
+
+    @override
+    def process(self, packet: bytes, inbound: bool, /) -> bytes | None:
+        verdict = self.__ruleset().verdict(self.scanner(inbound), inbound)
+        if not _enforce(self, verdict, inbound):
+            return None
+        return packet
+
+    def __ruleset(self) -> RuleSet:
+        try:
+            return self.__rules
+        except AttributeError:
+            rules = self.__rules = self.rules()
+            return rules
+
+
+class RuleHTTPHandler(HTTPHandler, ABC):
+    """HTTP handler driven by rules instead of code.
+    The patterns are searched in the bodies without their Content-Encoding,
+    the streamed bodies are only matched by the rules without a pattern"""
+
+    @abstractmethod
+    def rules(self) -> RuleSet:
+        """The rules applied to the messages, called once per connection.
+        Use load_rules() to compile a file once for all the connections
+
+        - returns: The compiled rules"""
+        ...
+
+    @override
+    def request(self, request: HTTPRequest, /) -> HTTPRequest | None:
+        if not self.__apply(request, True, request.method, request.path):
+            return None
+        return request
+
+    @override
+    def response_to(
+        self, request: HTTPRequest | None, response: HTTPResponse, /
+    ) -> HTTPResponse | None:
+        if request is None:
+            method = path = None
+        else:
+            method, path = request.method, request.path
+        if not self.__apply(response, False, method, path):
+            return None
+        return response
+
+    def __apply(
+        self,
+        message: HTTPPayload,
+        inbound: bool,
+        method: str | None,
+        path: str | None,
+        /,
+    ) -> bool:
+        try:
+            rules = self.__rules
+        except AttributeError:
+            rules = self.__rules = self.rules()
+        decoded = False
+        data: bytes | mmap
+        if message.streaming:
+            data = b""
+        elif message.spool is not None:
+            data = message.spool.data
+        elif content_encodings(message.headers):
+            try:
+                data = message.decoded_body
+                decoded = True
+            except ContentEncodingException:
+                data = message.body
+        else:
+            data = message.body
+        verdict = rules.evaluate(
+            data,
+            inbound,
+            method=method or "",
+            path=path or "",
+            headers=message.headers,
+        )
+        if not _enforce(self, verdict, inbound):
+            return False
+        if verdict.data is not None:
+            if decoded:
+                message.decoded_body = verdict.data
+            else:
+                message.body = verdict.data
+                message._update_length()
+        return True
@@ -0,0 +1,234 @@
+from __future__ import annotations
+from asyncio import AbstractEventLoop, Future, get_running_loop
+import socket as _socket
+from time import monotonic
+from typing import TYPE_CHECKING, Any, List, Tuple
+from socket import (
+    AI_PASSIVE,
+    IPPROTO_TCP,
+    SO_KEEPALIVE,
+    SO_RCVBUF,
+    SO_REUSEADDR,
+    SO_SNDBUF,
+    SOCK_STREAM,
+    SOL_SOCKET,
+    TCP_NODELAY,
+    getaddrinfo,
+    socket,
+)
+from attrs import define
+
+DEFAULT_BACKLOG = 100
+SO_REUSEPORT: int | None = getattr(_socket, "SO_REUSEPORT", None)
+TCP_KEEPIDLE: int | None = getattr(_socket, "TCP_KEEPIDLE", None)
+TCP_KEEPINTVL: int | None = getattr(_socket, "TCP_KEEPINTVL", None)
+TCP_KEEPCNT: int | None = getattr(_socket, "TCP_KEEPCNT", None)
+
+if TYPE_CHECKING:
+    AddressInfo = List[Tuple[Any, Any, int, str, Any]]
+
+
+@define
+class SocketOptions:
+    """Options of the sockets of a proxy, applied to the listening socket,
+    to the accepted clients and to the connections to the target"""
+
+    @staticmethod
+    def latency() -> SocketOptions:
+        """Preset for interactive traffic, small writes are sent at once
+        and the send buffer is kept small so that the data doesn't wait in the kernel
+
+        - returns: The options"""
+        return SocketOptions(nodelay=True, send_buffer=64 * 1024)
+
+    @staticmethod
+    def throughput() -> SocketOptions:
+        """Preset for bulk transfers, the kernel merges small writes
+        and large buffers keep the connections busy
+
+        - returns: The options"""
+        size = 4 * 1024 * 1024
+        return SocketOptions(nodelay=False, receive_buffer=size, send_buffer=size)
+
+    nodelay: bool = True
+    """Send small writes at once instead of merging them, TCP_NODELAY"""
+    receive_buffer: int | None = None
+    """Size of the kernel receive buffer, SO_RCVBUF, None to let the kernel size it"""
+    send_buffer: int | None = None
+    """Size of the kernel send buffer, SO_SNDBUF, None to let the kernel size it"""
+    keepalive: bool = False
+    """Probe idle connections to detect the dead peers, SO_KEEPALIVE"""
+    keepalive_idle: int | None = None
+    """Seconds of inactivity before the first probe, None for the system default"""
+    keepalive_interval: int | None = None
+    """Seconds between two probes, None for the system default"""
+    keepalive_count: int | None = None
+    """Unanswered probes after which the connection is closed, None for the system default
+    """
+
+    def apply(self, sock: socket, /) -> None:
+        """Set the options on a socket, the buffers of a listening socket
+        are inherited by the accepted ones
+
+        - sock: The socket to configure"""
+        sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, self.nodelay)
+        if self.receive_buffer is not None:
+            sock.setsockopt(SOL_SOCKET, SO_RCVBUF, self.receive_buffer)
+        if self.send_buffer is not None:
+            sock.setsockopt(SOL_SOCKET, SO_SNDBUF, self.send_buffer)
+        if not self.keepalive:
+            return
+        sock.setsockopt(SOL_SOCKET, SO_KEEPALIVE, 1)
+        for option, value in (
+            (TCP_KEEPIDLE, self.keepalive_idle),
+            (TCP_KEEPINTVL, self.keepalive_interval),
+            (TCP_KEEPCNT, self.keepalive_count),
+        ):
+            if option is not None and value is not None:
+                sock.setsockopt(IPPROTO_TCP, option, value)
+
+
+class Resolver:
+    """Resolves addresses keeping the results for some time"""
+
+    def __init__(self, ttl: float, /) -> None:
+        """- ttl: Seconds a resolution is kept, 0 to resolve every time"""
+        self.__ttl = ttl
+        self.__cache: dict[tuple[str, int], tuple[float, AddressInfo]] = {}
+
+    async def resolve(self, address: str, port: int, /) -> AddressInfo:
+        """Resolve an address for a tcp connection
+
+        - address: The address to resolve
+        - port: The port to connect to
+
+        - returns: The results of getaddrinfo"""
+        key = (address, port)
+        cached = self.__cache.get(key)
+        if cached is not None and cached[0] > monotonic():
+            return cached[1]
+        infos = await get_running_loop().getaddrinfo(address, port, type=SOCK_STREAM)
+        if not infos:
+            raise OSError(f"Unable to resolve {address}")
+        if self.__ttl > 0:
+            self.__cache[key] = (monotonic() + self.__ttl, infos)
+        return infos
+
+
+def listen(
+    address: str,
+    port: int,
+    /,
+    *,
+    backlog: int = DEFAULT_BACKLOG,
+    reuse_port: bool = False,
+    options: SocketOptions | None = None,
+) -> socket:
+    """Create a non blocking listening socket
+
+    - address: The address to bind to
+    - port: The port to bind to
+    - backlog: The maximum number of connections waiting to be accepted
+    - reuse_port: allow other sockets to bind to the same port, the kernel balances the connections among them
+    - options: The options to set before binding, None to keep the system defaults
+
+    - returns: The listening socket"""
+    family, type, proto, _, sockaddr = getaddrinfo(
+        address, port, type=SOCK_STREAM, flags=AI_PASSIVE
+    )[0]
+    sock = socket(family, type, proto)
+    try:
+        sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        if reuse_port:
+            if SO_REUSEPORT is None:
+                raise OSError("SO_REUSEPORT is not supported")
+            sock.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+        if options is not None:
+            options.apply(sock)
+        sock.bind(sockaddr)
+        sock.listen(backlog)
+        sock.setblocking(False)
+    except:
+        sock.close()
+        raise
+    return sock
+
+
+def prepare(sock: socket, options: SocketOptions | None = None, /) -> None:
+    """Configure a connected socket to be used by the proxy
+
+    - sock: The socket to configure
+    - options: The options to set, None to only disable the merging of small writes"""
+    sock.setblocking(False)
+    if options is None:
+        sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+    else:
+        options.apply(sock)
+
+
+async def connect(
+    address: str,
+    port: int,
+    /,
+    *,
+    resolver: Resolver | None = None,
+    options: SocketOptions | None = None,
+) -> socket:
+    """Open a non blocking tcp connection trying all the resolved addresses
+
+    - address: The address to connect to
+    - port: The port to connect to
+    - resolver: The resolver to use, None to resolve the address every time
+    - options: The options of the socket, None to only disable the merging of small writes
+
+    - returns: The connected socket"""
+    loop = get_running_loop()
+    infos = await (resolver or Resolver(0)).resolve(address, port)
+    error: OSError | None = None
+    for family, type, proto, _, sockaddr in infos:
+        sock = socket(family, type, proto)
+        try:
+            sock.setblocking(False)
+            await loop.sock_connect(sock, sockaddr)
+        except OSError as e:
+            sock.close()
+            error = e
+            continue
+        except:
+            sock.close()
+            raise
+        prepare(sock, options)
+        return sock
+    assert error is not None
+    raise error
+
+
+def _wake(future: Future[None]) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+async def wait_readable(loop: AbstractEventLoop, sock: socket, /) -> None:
+    """Wait until a socket has data to read or is closed
+
+    - loop: The running event loop
+    - sock: The socket to wait for"""
+    future: Future[None] = loop.create_future()
+    loop.add_reader(sock.fileno(), _wake, future)
+    try:
+        await future
+    finally:
+        loop.remove_reader(sock.fileno())
+
+
+async def wait_writable(loop: AbstractEventLoop, sock: socket, /) -> None:
+    """Wait until a socket can accept more data
+
+    - loop: The running event loop
+    - sock: The socket to wait for"""
+    future: Future[None] = loop.create_future()
+    loop.add_writer(sock.fileno(), _wake, future)
+    try:
+        await future
+    finally:
+        loop.remove_writer(sock.fileno())
@@ -0,0 +1,96 @@
+from __future__ import annotations
+from asyncio import AbstractEventLoop, get_running_loop
+from collections.abc import Callable
+from errno import EINVAL, ENOSYS
+from logging import getLogger
+from socket import socket
+import os
+
+from ._sockets import wait_readable, wait_writable
+
+SPLICE_SIZE = 64 * 1024
+
+_logger = getLogger("laproxy.relay")
+
+
+async def relay(
+    source: socket,
+    destination: socket,
+    /,
+    *,
+    activity: Callable[[], None] | None = None,
+) -> int:
+    """Copy all the data of a socket to another one until the end of the stream.
+    The data is moved by the kernel with splice when available,
+    otherwise it is copied with a single reused buffer
+
+    - source: The socket to read from
+    - destination: The socket to write to
+    - activity: Function called every time some data is moved
+
+    - returns: The number of bytes copied"""
+    loop = get_running_loop()
+    if hasattr(os, "splice"):
+        try:
+            return await _splice(loop, source, destination, activity)
+        except _SpliceUnsupported:
+            _logger.debug("splice is not supported, falling back to recv_into")
+    return await _copy(loop, source, destination, activity)
+
+
+class _SpliceUnsupported(Exception):
+    ...
+
+
+async def _splice(
+    loop: AbstractEventLoop,
+    source: socket,
+    destination: socket,
+    activity: Callable[[], None] | None,
+) -> int:
+    flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+    read_fd, write_fd = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+    total = 0
+    try:
+        while True:
+            try:
+                n = os.splice(source.fileno(), write_fd, SPLICE_SIZE, flags=flags)
+            except BlockingIOError:
+                await wait_readable(loop, source)
+                continue
+            except OSError as e:
+                if total == 0 and e.errno in (EINVAL, ENOSYS):
+                    raise _SpliceUnsupported() from e
+                raise
+            if n == 0:
+                return total
+            total += n
+            if activity is not None:
+                activity()
+            while n:
+                try:
+                    n -= os.splice(read_fd, destination.fileno(), n, flags=flags)
+                except BlockingIOError:
+                    await wait_writable(loop, destination)
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+async def _copy(
+    loop: AbstractEventLoop,
+    source: socket,
+    destination: socket,
+    activity: Callable[[], None] | None,
+) -> int:
+    buffer = bytearray(SPLICE_SIZE)
+    view = memoryview(buffer)
+    total = 0
+    while True:
+        n = await loop.sock_recv_into(source, buffer)
+        if n == 0:
+            return total
+        await loop.sock_sendall(destination, view[:n])
+        total += n
+        if activity is not None:
+            activity()
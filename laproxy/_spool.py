@@ -0,0 +1,110 @@
+from __future__ import annotations
+from asyncio import StreamWriter, get_running_loop, sleep
+from logging import getLogger
+from mmap import ACCESS_READ, mmap
+from tempfile import TemporaryFile
+from typing import IO
+
+from ._body import PIECE_SIZE, BodyReader
+from ._laproxy import CONNECTION
+
+_spool_logger = getLogger("laproxy.spool")
+
+
+class Spool:
+    """Body written to an anonymous temporary file instead of being kept in memory,
+    readable through a read-only memory map and sent to the peer with sendfile.
+    It can't be pickled, so it is not available to the callbacks run in a process pool
+    """
+
+    @staticmethod
+    async def read(stream: BodyReader, /) -> Spool:
+        """Write the rest of a body to a temporary file
+
+        - stream: The body to read
+
+        - returns: The spooled body"""
+        file = TemporaryFile()
+        try:
+            async for piece in stream:
+                file.write(piece)
+            file.flush()
+        except BaseException:
+            file.close()
+            raise
+        return Spool(file)
+
+    def __init__(self, file: IO[bytes], /):
+        """- file: The file containing the body, closed with the spool"""
+        self.__file = file
+        self.__size = file.seek(0, 2)
+        self.__data = (
+            mmap(file.fileno(), 0, access=ACCESS_READ) if self.__size else None
+        )
+
+    @property
+    def data(self) -> mmap | bytes:
+        """The content of the body, mapped in memory as it is accessed.
+        It can be sliced and searched with find() or the re module"""
+        return b"" if self.__data is None else self.__data
+
+    def find(self, sub: bytes, start: int = 0, /) -> int:
+        """Find a sequence in the body without copying it
+
+        - sub: The sequence to search
+        - start: The position where to start
+
+        - returns: The position of the sequence or -1 if it is missing"""
+        return self.data.find(sub, start)
+
+    def close(self) -> None:
+        """Unmap and delete the file, the map stays open while a memoryview of it exists"""
+        if self.__data is not None:
+            try:
+                self.__data.close()
+            except BufferError:
+                return
+            self.__data = None
+        self.__file.close()
+
+    async def send(self, writer: StreamWriter, inbound: bool, /) -> bool:
+        """Send the body to a stream with sendfile, waiting for its buffer to drain first.
+        The data is copied from the memory map when the transport doesn't support sendfile
+
+        - writer: The stream to write the body to
+        - inbound: If the data is coming from the outside
+
+        - returns: False if the stream is closed"""
+        if self.__size == 0:
+            return True
+        try:
+            await writer.drain()
+            if writer.transport.is_closing():
+                raise ConnectionResetError()
+            try:
+                await get_running_loop().sendfile(
+                    writer.transport, self.__file, 0, self.__size
+                )
+            except (NotImplementedError, RuntimeError):
+                _spool_logger.debug("sendfile is not supported, copying the body")
+                for start in range(0, self.__size, PIECE_SIZE):
+                    writer.write(self.data[start : start + PIECE_SIZE])
+                    await writer.drain()
+        except ConnectionError:
+            _spool_logger.debug("Stream closed while sending, inbound=%s", inbound)
+            return False
+        connection = CONNECTION.get()
+        if connection is not None:
+            delay = connection.transferred(self.__size, inbound)
+            if delay:
+                await sleep(delay)
+        return True
+
+    def __len__(self) -> int:
+        return self.__size
+
+    def __contains__(self, sub: object) -> bool:
+        return isinstance(sub, bytes) and self.data.find(sub) != -1
+
+    def __del__(self) -> None:
+        self.close()
@@ -1,18 +1,55 @@
 from __future__ import annotations
 from asyncio import (
+    CancelledError,
+    current_task,
+    iscoroutinefunction,
     StreamReader,
     StreamWriter,
-    start_server,
+    Task,
+    gather,
+    get_running_loop,
     open_connection,
+    sleep,
+    wait,
+)
+from ._laproxy import (
+    CONNECTION,
+    DEFAULT_SLOW_CALLBACK,
+    Connection,
+    FlowControl,
+    FlowStats,
+    Handler,
+    Proxy,
+    forward,
+    log_context,
 )
-from ._laproxy import Handler, Proxy
 from abc import ABC, abstractmethod
-from collections.abc import Callable
+from collections.abc import Awaitable, Callable
+from functools import partial
+from concurrent.futures import Executor
 from typing_extensions import override
-from typing import final
-from logging import getLogger
+from typing import Literal, cast, final
+from logging import DEBUG, getLogger
+from socket import SHUT_RDWR, socket
+from time import monotonic, perf_counter
 
 from aiotools import TaskGroup
+from attrs import asdict
+from ._sockets import DEFAULT_BACKLOG, SocketOptions, connect, listen, prepare
+from ._access import AccessLog
+from ._admission import Admission, Limits
+from ._pool import PoolConfig, UpstreamPool
+from ._recorder import Recorder
+from ._reload import Reloader
+from ._metrics import Metrics
+from ._splice import relay
+from ._protocol import handle_protocol
+from ._lines import (
+    DEFAULT_MAX_LINE_LENGTH,
+    LineBuffer,
+    LineOverflowException,
+    Overflow,
+)
 
 DEFAULT_TCP_BUFFSIZE = 1024
 
@@ -32,35 +69,214 @@ class TCPHandler(Handler, ABC):
         - returns: The buffer size"""
         return DEFAULT_TCP_BUFFSIZE
 
+    def inspect(self, inbound: bool, /) -> bool:
+        """If the packets of a direction need to be processed.
+        When a direction doesn't need inspection, its data is relayed by the kernel without calling process
+
+        - inbound: The direction of the packets
+
+        - returns: False if the packets should be forwarded unmodified"""
+        return True
+
+    def zero_copy(self) -> bool:
+        """If process accepts a memoryview of the receive buffer instead of bytes.
+        The memoryview is only valid until process returns.
+        Used when the proxy runs with the protocol engine
+
+        - returns: True if the packets can be passed as memoryviews"""
+        return False
+
+    @final
+    def relayed(self, inbound: bool, /) -> bool:
+        """If a direction can be relayed by the kernel:
+        it doesn't need inspection and no pattern applies to it
+
+        - inbound: The direction of the packets
+
+        - returns: True if the packets can be forwarded without looking at them"""
+        return not self.inspect(inbound) and self.scanner(inbound) is None
+
+    @final
+    def process_packet(
+        self, packet: bytes | memoryview, inbound: bool, /, *, final: bool = False
+    ) -> bytes | memoryview | None:
+        """Apply the patterns to a packet and then process it,
+        the packet is a memoryview when zero_copy() is enabled
+
+        - packet: The packet to modify
+        - inbound: If the connection is coming from the outside
+        - final: If the direction ended and the data held back by the patterns is processed
+
+        - returns: The modified packet or None if the connection should be dropped"""
+        recording = self.recording()
+        if recording is not None and packet:
+            recording.record("received", packet, inbound)
+        scanned = self.scan(packet, inbound, final=final)
+        if not scanned:
+            return scanned
+        result = self.call_sync(self.process, scanned, inbound)
+        if recording is not None and result is not None:
+            recording.record("sent", result, inbound)
+        return result
+
+    @final
+    async def process_packet_async(
+        self, packet: bytes, inbound: bool, /, *, final: bool = False
+    ) -> bytes | None:
+        """Apply the patterns to a packet and then process it
+        in the executor of the handler or awaiting the async callbacks
+
+        - packet: The packet to modify
+        - inbound: If the connection is coming from the outside
+        - final: If the direction ended and the data held back by the patterns is processed
+
+        - returns: The modified packet or None if the connection should be dropped"""
+        recording = self.recording()
+        if recording is not None and packet:
+            recording.record("received", packet, inbound)
+        scanned = self.scan(packet, inbound, final=final)
+        if scanned is None:
+            return None
+        if not scanned:
+            return b""
+        result = await self._dispatch(bytes(scanned), inbound)
+        if result is not None and self.waits():
+            await self.delayed(inbound)
+        if recording is not None and result is not None:
+            recording.record("sent", result, inbound)
+        return result
+
+    @final
+    def synchronous(self) -> bool:
+        """If the callbacks of this handler can be called directly in the event loop:
+        there is no executor, they are not declared with async def and they don't wait.
+        Otherwise the proxy doesn't use the protocol engine
+
+        - returns: True if the callbacks are synchronous"""
+        return (
+            self.executor() is None
+            and not self.waits()
+            and not any(
+                iscoroutinefunction(getattr(self, name)) for name in self._callbacks
+            )
+        )
+
+    def waits(self) -> bool:
+        """If the callbacks call delaying() to make the packets wait before being forwarded,
+        the proxy doesn't use the protocol engine then
+
+        - returns: True if the packets may wait"""
+        return False
+
+    _callbacks: tuple[str, ...] = ("process",)
+
+    async def _dispatch(self, packet: bytes, inbound: bool, /) -> bytes | None:
+        return await self.call(self.process, packet, inbound)
+
     @override
     @final
     async def handle(
         self, reader: StreamReader, writer: StreamWriter, inbound: bool, /
     ) -> None:
         ip, port = get_remote_host(writer)
-        TCPHandler.__logger.debug(
-            f"Starting handling of {ip}:{port}, inbound={inbound}"
-        )
+        logger = TCPHandler.__logger
+        debug = logger.isEnabledFor(DEBUG)
+        extra = log_context(inbound)
+        if debug:
+            logger.debug(
+                "Starting handling of %s:%d, inbound=%s", ip, port, inbound, extra=extra
+            )
         while True:
-            TCPHandler.__logger.debug("Waiting for a packet")
-            packet = await reader.read(self.buffsize())
-            if not packet:
+            packet = await self.receive(partial(reader.read, self.buffsize()), inbound)
+            if not packet and not self.holding(inbound):
                 break
+            if debug:
+                logger.debug(
+                    "Processing a packet of %d bytes, inbound=%s",
+                    len(packet),
+                    inbound,
+                    extra=extra,
+                )
+            packet = await self.process_packet_async(
+                packet, inbound, final=not packet
+            )
+            if packet is None:
+                logger.info(
+                    "Dropping connection of %s:%d, inbound=%s",
+                    ip,
+                    port,
+                    inbound,
+                    extra=extra,
+                )
+                self.dropped()
+                break
+            if not await forward(writer, packet, inbound):
+                logger.info(
+                    "Stopping forwarding of %s:%d, inbound=%s",
+                    ip,
+                    port,
+                    inbound,
+                    extra=extra,
+                )
+                break
+
+    @final
+    async def handle_sockets(
+        self, source: socket, destination: socket, inbound: bool, /
+    ) -> None:
+        """Manages a direction of a connection using raw sockets,
+        used by the proxy when a direction doesn't need inspection
+
+        - source: The socket to read the data from
+        - destination: The socket to write the data to
+        - inbound: If the connection is coming from the outside"""
+        connection = CONNECTION.get()
+        extra = log_context(inbound)
+        if self.relayed(inbound):
             TCPHandler.__logger.debug(
-                f"Starting processing of packet inbound={inbound}"
+                "Relaying without inspection, inbound=%s", inbound, extra=extra
+            )
+            size = await relay(
+                source,
+                destination,
+                activity=None if connection is None else connection.touch,
+            )
+            if connection is not None:
+                connection.transferred(size, inbound)
+            return
+        loop = get_running_loop()
+        while True:
+            packet = await self.receive(
+                partial(loop.sock_recv, source, self.buffsize()), inbound
+            )
+            if not packet and not self.holding(inbound):
+                break
+            packet = await self.process_packet_async(
+                packet, inbound, final=not packet
             )
-            packet = self.process(packet, inbound)
             if packet is None:
+                ip, port = (source if inbound else destination).getpeername()[:2]
                 TCPHandler.__logger.info(
-                    f"Dropping connection of {ip}:{port}, inbound={inbound}"
+                    "Dropping connection of %s:%d, inbound=%s",
+                    ip,
+                    port,
+                    inbound,
+                    extra=extra,
                 )
+                self.dropped()
                 break
-            TCPHandler.__logger.debug("Sending packet")
-            writer.write(packet)
+            await loop.sock_sendall(destination, packet)
+            if connection is not None:
+                delay = connection.transferred(len(packet), inbound)
+                if delay:
+                    await sleep(delay)
 
     @abstractmethod
-    def process(self, packet: bytes, inbound: bool, /) -> bytes | None:
-        """Process a single tcp packet
+    def process(
+        self, packet: bytes, inbound: bool, /
+    ) -> bytes | None | Awaitable[bytes | None]:
+        """Process a single tcp packet,
+        it can be declared with async def to be awaited by the handler
 
         - packet: The packet to modify
         - inbound: If the connection is coming from the outside
@@ -77,29 +293,102 @@ class TCPLineHandler(TCPHandler, ABC):
 
     def __init__(self):
         super().__init__()
-        self.__inbound_buffer = bytearray()
-        self.__outbound_buffer = bytearray()
+        limit = self.max_line_length()
+        overflow = self.line_overflow()
+        self.__inbound_buffer = LineBuffer(limit, overflow)
+        self.__outbound_buffer = LineBuffer(limit, overflow)
+
+    @override
+    def zero_copy(self) -> bool:
+        return True
+
+    def max_line_length(self) -> int | None:
+        """Maximum length of a line waiting for its new line,
+        line_overflow() is used when it is exceeded
+
+        - returns: The length in bytes or None for no limit"""
+        return DEFAULT_MAX_LINE_LENGTH
+
+    def line_overflow(self) -> Overflow:
+        """What to do with a line longer than max_line_length(),
+        "drop" closes the connection, "split" processes it in pieces of the maximum length
+
+        - returns: The policy"""
+        return "split"
 
     @override
     @final
     def process(self, packet: bytes, inbound: bool, /) -> bytes | None:
+        lines = self.__split(packet, inbound)
+        if not lines:
+            return None if lines is None else b""
+        result = self.process_lines(lines, inbound)
+        if result is None:
+            return None
+        return b"".join(result)
+
+    _callbacks = ("process_lines", "process_line")
+
+    @override
+    async def _dispatch(self, packet: bytes, inbound: bool, /) -> bytes | None:
+        lines = self.__split(packet, inbound)
+        if not lines:
+            return None if lines is None else b""
+        if iscoroutinefunction(self.process_line):
+            result: list[bytes] | None = []
+            for line in lines:
+                new = await cast(
+                    "Awaitable[bytes | None]", self.process_line(line, inbound)
+                )
+                if new is None:
+                    return None
+                result.append(new)
+        else:
+            result = await self.call(self.process_lines, lines, inbound)
+        if result is None:
+            return None
+        return b"".join(result)
+
+    def __split(self, packet: bytes, inbound: bool, /) -> list[bytes] | None:
         buffer = self.__inbound_buffer if inbound else self.__outbound_buffer
-        buffer.extend(packet)
-        if b"\n" not in buffer:
-            TCPLineHandler.__logger.debug("Packet did not contain any new line")
-        response = bytearray()
-        while (index := buffer.find(b"\n")) != -1:
-            content = buffer[: index + 1]
-            del buffer[: index + 1]
-            new = self.process_line(content, inbound)
+        try:
+            lines = buffer.feed(packet)
+        except LineOverflowException:
+            TCPLineHandler.__logger.info(
+                "Line longer than %d bytes, inbound=%s",
+                self.max_line_length(),
+                inbound,
+                extra=log_context(inbound),
+            )
+            self.dropping("line_length")
+            return None
+        return lines
+
+    def process_lines(
+        self, lines: list[bytes], inbound: bool, /
+    ) -> list[bytes] | None:
+        """Process all the lines received together,
+        by default calls process_line() for each of them.
+        It can be declared with async def to be awaited by the handler
+
+        - lines: The lines to process
+        - inbound: If the connection is coming from the outside
+
+        - returns: The modified lines or None if the connection should be dropped"""
+        result: list[bytes] = []
+        for line in lines:
+            new = cast("bytes | None", self.process_line(line, inbound))
             if new is None:
                 return None
-            response.extend(new)
-        return response
+            result.append(new)
+        return result
 
     @abstractmethod
-    def process_line(self, line: bytes, inbound: bool, /) -> bytes | None:
-        """Process a single line
+    def process_line(
+        self, line: bytes, inbound: bool, /
+    ) -> bytes | None | Awaitable[bytes | None]:
+        """Process a single line,
+        it can be declared with async def to be awaited by the handler
 
         - line: The line to process
         - inbound: If the connection is coming from the outside
@@ -121,18 +410,114 @@ class TCPProxy(Proxy):
         target_port: int,
         handler: Callable[[], Handler],
         /,
+        *,
+        inbound_flow: FlowControl | None = None,
+        outbound_flow: FlowControl | None = None,
+        passthrough: bool = True,
+        engine: Literal["streams", "protocol"] = "streams",
+        shutdown_timeout: float = 0,
+        executor: Executor | None = None,
+        pool: PoolConfig | None = None,
+        slow_callback: float = DEFAULT_SLOW_CALLBACK,
+        access_log: AccessLog | None = None,
+        recorder: Recorder | None = None,
+        reload_interval: float | None = None,
+        limits: Limits | None = None,
+        socket_options: SocketOptions | None = None,
     ):
         """- listen_address: address to use to accept external connections
         - listen_port: port to use to accept external connections
         - target_address: address to redirect connections to
         - target_port: port to redirect connections to
         - handler: handler's constructor to use to process connections, it will be called each time a new connection is opened
+        - inbound_flow: write buffer limits of the data going to the target
+        - outbound_flow: write buffer limits of the data going to the client
+        - passthrough: relay with the kernel the directions that a TCPHandler doesn't inspect
+        - engine: how the data of a TCPHandler is read, "streams" uses asyncio streams,
+        "protocol" uses buffered protocols with reusable buffers sized on the observed throughput
+        - shutdown_timeout: seconds to wait for the open connections to end when the proxy is stopped
+        - executor: thread or process pool where the handler callbacks are run, keeping the order within a direction,
+        the protocol engine is not used when it is set.
+        A process pool should use the "forkserver" or "spawn" context, forked workers keep the sockets open
+        - pool: keep connections to the target open before the clients arrive,
+        the ones left idle by an HTTPHandler with keep-alive are reused by the next clients
+        - slow_callback: seconds a handler callback can block the event loop before a warning is logged
+        - access_log: where to write an entry for each connection that ends
+        - recorder: where to record the data of the connections before and after the handler,
+        the kernel passthrough is not used when it is set
+        - reload_interval: seconds between two checks of the file of the handler,
+        when it changes it is imported again and used for the new connections, None to not reload it
+        - limits: caps on the connections and the traffic of the clients, and timeouts of the connections
+        - socket_options: options of the listening socket, of the clients and of the connections to the target,
+        like SocketOptions.latency() or SocketOptions.throughput(), None to only disable the merging of small writes
         """
+        if engine not in ("streams", "protocol"):
+            raise ValueError(f"Unknown engine {engine}")
         self.__listen_address = listen_address
         self.__listen_port = listen_port
         self.__target_address = target_address
         self.__target_port = target_port
+        self.__metrics = Metrics()
+        self.__reloader: Reloader | None = None
+        if reload_interval is not None:
+            self.__reloader = Reloader(
+                handler, interval=reload_interval, metrics=self.__metrics
+            )
+            handler = self.__reloader
         self.__handler = handler
+        self.__inbound_flow = inbound_flow or FlowControl()
+        self.__outbound_flow = outbound_flow or FlowControl()
+        self.__stats = FlowStats()
+        self.__passthrough = (
+            passthrough
+            and recorder is None
+            and (limits is None or limits.byte_rate is None)
+        )
+        self.__engine = engine
+        self.__shutdown_timeout = shutdown_timeout
+        self.__executor = executor
+        self.__pool_config = pool
+        self.__pool: UpstreamPool | None = None
+        self.__slow_callback = slow_callback
+        self.__access_log = access_log
+        self.__recorder = recorder
+        self.__limits = limits or Limits()
+        self.__admission = None if limits is None else Admission(limits, self.__metrics)
+        self.__active: dict[Task[None], Connection] = {}
+        self.__listener: socket | None = None
+        self.__socket_options = socket_options
+
+    @property
+    def stats(self) -> FlowStats:
+        """Flow control counters of all the connections handled by this proxy"""
+        return self.__stats
+
+    @property
+    def metrics(self) -> Metrics:
+        """Metrics of all the connections handled by this proxy"""
+        return self.__metrics
+
+    @override
+    def counters(self) -> dict[str, float]:
+        samples = self.__metrics.samples()
+        for name, value in asdict(self.__stats).items():
+            event, direction = name.split("_")
+            samples[f'laproxy_{event}_total{{direction="{direction}"}}'] = value
+        if self.__pool is not None:
+            samples["laproxy_pool_idle"] = len(self.__pool)
+        if self.__reloader is not None:
+            samples["laproxy_handler_generation"] = self.__reloader.generation
+        return samples
+
+    @override
+    def bind(self, *, reuse_port: bool) -> None:
+        self.__listener = listen(
+            self.__listen_address,
+            self.__listen_port,
+            backlog=self.__limits.backlog,
+            reuse_port=reuse_port,
+            options=self.__socket_options,
+        )
 
     @override
     @final
@@ -140,23 +525,185 @@ class TCPProxy(Proxy):
         TCPProxy.__logger.info(
             f"Starting the server on {self.__listen_address}:{self.__listen_port}"
         )
-        server = await start_server(
-            self.__thread, self.__listen_address, self.__listen_port
-        )
-        async with server:
+        loop = get_running_loop()
+        if self.__listener is None:
+            self.bind(reuse_port=False)
+        listener = self.__listener
+        assert listener is not None
+        connections: set[Task[None]] = set()
+        refill: Task[None] | None = None
+        if self.__pool_config is not None:
+            self.__pool = UpstreamPool(
+                self.__target_address,
+                self.__target_port,
+                self.__pool_config,
+                options=self.__socket_options,
+            )
+            refill = loop.create_task(self.__pool.run(), name="upstream pool")
+        if self.__access_log is not None:
+            self.__access_log.start()
+        if self.__recorder is not None:
+            self.__recorder.start()
+        watch: Task[None] | None = None
+        if self.__reloader is not None:
+            watch = loop.create_task(self.__reloader.run(), name="handler reload")
+        admission = self.__admission
+        watchdog: Task[None] | None = None
+        if admission is not None and admission.timeouts():
+            watchdog = loop.create_task(self.__watch(admission), name="watchdog")
+
+        def accept() -> None:
+            for _ in range(DEFAULT_BACKLOG):
+                try:
+                    client, address = listener.accept()
+                except (BlockingIOError, InterruptedError):
+                    return
+                except OSError:
+                    TCPProxy.__logger.error(
+                        "Unable to accept a connection", exc_info=True
+                    )
+                    loop.remove_reader(listener.fileno())
+                    loop.call_later(1, loop.add_reader, listener.fileno(), accept)
+                    return
+                if admission is not None and not admission.admit(address[0]):
+                    client.close()
+                    continue
+                task = loop.create_task(self.__thread(client, address[0]))
+                connections.add(task)
+                task.add_done_callback(connections.discard)
+
+        try:
+            loop.add_reader(listener.fileno(), accept)
             TCPProxy.__logger.info(
                 f"Forwarding connections to {self.__target_address}:{self.__target_port}"
             )
-            await server.serve_forever()
-
-    async def __thread(self, reader: StreamReader, writer: StreamWriter, /) -> None:
+            await loop.create_future()
+        finally:
+            loop.remove_reader(listener.fileno())
+            listener.close()
+            self.__listener = None
+            if connections and self.__shutdown_timeout > 0:
+                TCPProxy.__logger.info(
+                    f"Waiting for {len(connections)} connections to end"
+                )
+                await wait(connections, timeout=self.__shutdown_timeout)
+            stopping = [
+                task
+                for task in (*connections, refill, watch, watchdog)
+                if task is not None
+            ]
+            for task in stopping:
+                task.cancel()
+            await gather(*stopping, return_exceptions=True)
+            self.__pool = None
+            if self.__access_log is not None:
+                self.__access_log.stop()
+            if self.__recorder is not None:
+                self.__recorder.stop()
+
+    async def __watch(self, admission: Admission, /) -> None:
+        interval = admission.interval()
+        while True:
+            await sleep(interval)
+            now = monotonic()
+            for task, connection in list(self.__active.items()):
+                reason = admission.expired(connection, now)
+                if reason is None:
+                    continue
+                TCPProxy.__logger.info(
+                    "Closing the connection of %s, %s",
+                    connection.peer,
+                    reason,
+                    extra={"connection": connection.id, "peer": connection.peer},
+                )
+                del self.__active[task]
+                connection.dropped(reason)
+                task.cancel()
+
+    async def __thread(self, client: socket, ip: str, /) -> None:
+        target: socket | None = None
+        connection: Connection | None = None
+        streams = False
+        metrics = self.__metrics
+        metrics.inc("laproxy_connections_total")
+        metrics.inc("laproxy_connections_open")
+        task = current_task()
+        assert task is not None
         try:
-            target_reader, target_writer = await open_connection(
-                self.__target_address, self.__target_port
+            start = perf_counter()
+            prepare(client, self.__socket_options)
+            try:
+                if self.__pool is not None:
+                    target = await self.__pool.acquire()
+                else:
+                    target = await connect(
+                        self.__target_address,
+                        self.__target_port,
+                        options=self.__socket_options,
+                    )
+            except OSError:
+                metrics.inc("laproxy_drops_total", reason="upstream")
+                raise
+            metrics.observe("laproxy_upstream_connect_seconds", perf_counter() - start)
+            ip, port = client.getpeername()[:2]
+            connection = Connection(
+                self.__inbound_flow,
+                self.__outbound_flow,
+                self.__stats,
+                self.__executor,
+                metrics=metrics,
+                slow_callback=self.__slow_callback,
+                peer=f"{ip}:{port}",
+                started=start,
+                recorder=self.__recorder,
+                throttle=(
+                    None if self.__admission is None else self.__admission.throttle(ip)
+                ),
+                generation=(
+                    0 if self.__reloader is None else self.__reloader.generation
+                ),
             )
-            ip, port = get_remote_host(writer)
-            TCPProxy.__logger.info(f"Received a connection from {ip}:{port}")
+            self.__active[task] = connection
+            connection.record("open", connection.peer.encode(), False)
+            TCPProxy.__logger.info(
+                "Received a connection from %s:%d",
+                ip,
+                port,
+                extra={"connection": connection.id, "peer": connection.peer},
+            )
+            CONNECTION.set(connection)
             handler = self.__handler()
+            if (
+                self.__passthrough
+                and isinstance(handler, TCPHandler)
+                and (handler.relayed(True) or handler.relayed(False))
+            ):
+                async with TaskGroup() as group:
+                    group.create_task(
+                        self.__relay(handler, client, target, True),
+                        name="tcp inbound",
+                    )
+                    group.create_task(
+                        self.__relay(handler, target, client, False),
+                        name="tcp outbound",
+                    )
+                return
+            streams = True
+            if (
+                self.__engine == "protocol"
+                and isinstance(handler, TCPHandler)
+                and handler.synchronous()
+            ):
+                await handle_protocol(handler, connection, client, target)
+                return
+            reader, writer = await open_connection(sock=client)
+            target_reader, target_writer = await open_connection(sock=target)
+            target_writer.transport.set_write_buffer_limits(
+                self.__inbound_flow.high_watermark, self.__inbound_flow.low_watermark
+            )
+            writer.transport.set_write_buffer_limits(
+                self.__outbound_flow.high_watermark, self.__outbound_flow.low_watermark
+            )
             async with TaskGroup() as group:
                 group.create_task(
                     self.__handle(handler, reader, target_writer, True),
@@ -166,12 +713,45 @@ class TCPProxy(Proxy):
                     self.__handle(handler, target_reader, writer, False),
                     name="tcp outbound",
                 )
-        except GeneratorExit:
+        except (GeneratorExit, CancelledError):
             pass
         except:
             TCPProxy.__logger.error(
                 "Exception while handling a connection", exc_info=True
             )
+        finally:
+            metrics.inc("laproxy_connections_open", -1)
+            self.__active.pop(task, None)
+            if self.__admission is not None:
+                self.__admission.release(ip)
+            if connection is not None:
+                connection.record("close", b"", False)
+                if self.__access_log is not None:
+                    self.__access_log.record(connection)
+            if not streams:
+                client.close()
+                if target is not None:
+                    target.close()
+
+    async def __relay(
+        self,
+        handler: TCPHandler,
+        source: socket,
+        destination: socket,
+        inbound: bool,
+        /,
+    ) -> None:
+        try:
+            await handler.handle_sockets(source, destination, inbound)
+        except ConnectionError:
+            TCPProxy.__logger.debug(
+                "Connection reset, inbound=%s", inbound, extra=log_context(inbound)
+            )
+        finally:
+            try:
+                destination.shutdown(SHUT_RDWR)
+            except OSError:
+                pass
 
     async def __handle(
         self,
@@ -183,6 +763,9 @@ class TCPProxy(Proxy):
     ) -> None:
         try:
             await handler.handle(reader, writer, inbound)
+            if inbound and self.__pool is not None and handler.reusable():
+                TCPProxy.__logger.debug("Keeping the connection to the target")
+                self.__pool.release(writer.get_extra_info("socket").dup())
         finally:
             writer.close()
             await writer.wait_closed()
@@ -191,6 +774,16 @@ class TCPProxy(Proxy):
 class NoTCPHandler(TCPHandler):
     """Simple tcp handler that doesn't modify any packet"""
 
+    @override
+    @final
+    def inspect(self, _: bool, /) -> bool:
+        return False
+
+    @override
+    @final
+    def zero_copy(self) -> bool:
+        return True
+
     @override
     @final
     def process(self, packet: bytes, _: bool, /) -> bytes | None:
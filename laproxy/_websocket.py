@@ -0,0 +1,103 @@
+from __future__ import annotations
+from asyncio import IncompleteReadError, StreamReader
+from struct import Struct
+from attrs import define, field
+
+DEFAULT_MAX_FRAME_SIZE = 16 * 1024 * 1024
+TEXT = 0x1
+BINARY = 0x2
+CLOSE = 0x8
+PING = 0x9
+PONG = 0xA
+
+_LENGTH16 = Struct("!H")
+_LENGTH64 = Struct("!Q")
+
+
+class MalformedFrameException(Exception):
+    """Exception raised when a websocket frame is malformed or too large"""
+
+    ...
+
+
+def mask(data: bytes, key: bytes, /) -> bytes:
+    """Apply a websocket masking key, masking and unmasking are the same operation.
+    The payload is xored as a single big integer instead of byte by byte
+
+    - data: The payload
+    - key: The four bytes of the key
+
+    - returns: The masked payload"""
+    size = len(data)
+    if size == 0:
+        return data
+    repeated = (key * (size // 4 + 1))[:size]
+    value = int.from_bytes(data, "little") ^ int.from_bytes(repeated, "little")
+    return value.to_bytes(size, "little")
+
+
+@define
+class WebSocketFrame:
+    """A frame of a websocket connection, with its payload unmasked"""
+
+    opcode: int
+    """Type of the frame, like TEXT, BINARY, CLOSE, PING or PONG"""
+    payload: bytes
+    """Content of the frame, already unmasked"""
+    fin: bool = True
+    """If this is the last frame of a message"""
+    rsv: int = 0
+    """The three reserved bits, used by the extensions"""
+    key: bytes | None = field(default=None, repr=False)
+    """The masking key of the frame, present in the frames sent by the client"""
+
+    def __bytes__(self) -> bytes:
+        first = (0x80 if self.fin else 0) | (self.rsv & 0x7) << 4 | self.opcode & 0xF
+        size = len(self.payload)
+        masked = 0x80 if self.key is not None else 0
+        if size < 126:
+            head = bytes((first, masked | size))
+        elif size < 1 << 16:
+            head = bytes((first, masked | 126)) + _LENGTH16.pack(size)
+        else:
+            head = bytes((first, masked | 127)) + _LENGTH64.pack(size)
+        if self.key is None:
+            return head + self.payload
+        return head + self.key + mask(self.payload, self.key)
+
+
+async def read_frame(
+    reader: StreamReader, /, *, max_size: int = DEFAULT_MAX_FRAME_SIZE
+) -> WebSocketFrame | None:
+    """Read a websocket frame from a stream reader, reading the head before the payload
+
+    - reader: The stream reader to read the data from
+    - max_size: The maximum size of the payload
+
+    - returns: The frame or None if the end of the stream is reached before starting the reading
+    """
+    try:
+        start = await reader.readexactly(2)
+    except IncompleteReadError as e:
+        if e.partial:
+            raise MalformedFrameException(e.partial) from e
+        return None
+    try:
+        size = start[1] & 0x7F
+        if size == 126:
+            (size,) = _LENGTH16.unpack(await reader.readexactly(2))
+        elif size == 127:
+            (size,) = _LENGTH64.unpack(await reader.readexactly(8))
+        if size > max_size:
+            raise MalformedFrameException(f"Frame of {size} bytes")
+        key = await reader.readexactly(4) if start[1] & 0x80 else None
+        payload = await reader.readexactly(size)
+    except IncompleteReadError as e:
+        raise MalformedFrameException("Truncated frame") from e
+    return WebSocketFrame(
+        start[0] & 0xF,
+        payload if key is None else mask(payload, key),
+        fin=bool(start[0] & 0x80),
+        rsv=start[0] >> 4 & 0x7,
+        key=key,
+    )
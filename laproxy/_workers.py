@@ -0,0 +1,207 @@
+from __future__ import annotations
+from asyncio import CancelledError, current_task, get_running_loop, run, sleep
+from collections import Counter
+from logging import Logger, LogRecord, getLogger
+from logging.handlers import QueueHandler
+from multiprocessing import get_context
+from multiprocessing.connection import wait
+from multiprocessing.context import ForkProcess
+from multiprocessing.queues import Queue
+from signal import SIG_IGN, SIGINT, SIGTERM, signal
+from threading import Thread
+from time import monotonic, sleep as sleep_for
+from typing import TYPE_CHECKING, Any, Dict, Tuple, Union
+
+from ._loop import LoopFactory, run_loop
+from ._sockets import SO_REUSEPORT
+from ._metrics import METRICS_ADDRESS, expose
+
+if TYPE_CHECKING:
+    from ._laproxy import Proxy
+
+    Message = Union[LogRecord, Tuple[int, Dict[str, float]], None]
+
+STATS_INTERVAL = 1.0
+RESTART_DELAY = 1.0
+_CUMULATIVE = ("_total", "_bucket", "_sum", "_count")
+
+
+def _cumulative(counters: dict[str, float], /) -> dict[str, float]:
+    return {
+        key: value
+        for key, value in counters.items()
+        if key.split("{", 1)[0].endswith(_CUMULATIVE)
+    }
+
+
+class Supervisor:
+    """Runs a proxy in several worker processes, restarting the ones that crash.
+    The logs and the counters of the workers are collected by the supervisor"""
+
+    __logger = getLogger("laproxy.Supervisor")
+
+    def __init__(
+        self,
+        proxy: Proxy,
+        workers: int,
+        log_level: int | None,
+        metrics_port: int | None = None,
+        loop_factory: LoopFactory | None = None,
+        /,
+    ):
+        """- proxy: The proxy to run in every worker
+        - workers: The number of worker processes
+        - log_level: The log level of the workers, None to keep the default one
+        - metrics_port: The local port where the aggregated counters are exposed, None to not expose them
+        - loop_factory: The function creating the event loop of every worker, None for the default one
+        """
+        self.__proxy = proxy
+        self.__workers = workers
+        self.__log_level = log_level
+        self.__metrics_port = metrics_port
+        self.__loop_factory = loop_factory
+        self.__context = get_context("fork")
+        self.__queue: Queue[Message] = self.__context.Queue()
+        self.__processes: dict[int, tuple[ForkProcess, float]] = {}
+        self.__counters: dict[int, dict[str, float]] = {}
+        self.__retired: Counter[str] = Counter()
+        self.__stopping = False
+        self.__reuse_port = SO_REUSEPORT is not None
+
+    def counters(self) -> dict[str, float]:
+        """Sum of the counters of all the workers, including the ones that exited.
+        The gauges of the exited workers are not included
+
+        - returns: The aggregated counters"""
+        total = Counter(self.__retired)
+        for counters in list(self.__counters.values()):
+            total.update(counters)
+        return dict(total)
+
+    def run(self) -> None:
+        """Start the workers and supervise them until SIGTERM or SIGINT is received"""
+        if not self.__reuse_port:
+            Supervisor.__logger.info("SO_REUSEPORT not available, sharing one socket")
+            self.__proxy.bind(reuse_port=False)
+        collector = Thread(target=self.__collect, name="laproxy collector")
+        collector.start()
+        if self.__metrics_port is not None:
+            Thread(
+                target=run,
+                args=(expose(self.counters, METRICS_ADDRESS, self.__metrics_port),),
+                name="laproxy metrics",
+                daemon=True,
+            ).start()
+        previous = signal(SIGTERM, self.__stop)
+        try:
+            for index in range(self.__workers):
+                self.__start(index)
+            while not self.__stopping:
+                sentinels = {
+                    process.sentinel: index
+                    for index, (process, _) in self.__processes.items()
+                }
+                for sentinel in wait(list(sentinels), timeout=STATS_INTERVAL):
+                    if not self.__stopping:
+                        self.__restart(sentinels[sentinel])  # type: ignore
+        except KeyboardInterrupt:
+            Supervisor.__logger.debug("Keyboard Interrupt received, stopping workers")
+        finally:
+            signal(SIGTERM, previous)
+            self.__shutdown()
+            self.__queue.put(None)
+            collector.join()
+            Supervisor.__logger.info(f"Workers stopped, counters: {self.counters()}")
+
+    def __stop(self, *_: Any) -> None:
+        Supervisor.__logger.info("SIGTERM received, stopping workers")
+        self.__stopping = True
+
+    def __start(self, index: int) -> None:
+        process = self.__context.Process(
+            target=_worker,
+            args=(
+                self.__proxy,
+                index,
+                self.__queue,
+                self.__log_level,
+                self.__reuse_port,
+                self.__loop_factory,
+            ),
+            name=f"laproxy worker {index}",
+        )
+        process.start()
+        self.__processes[index] = (process, monotonic())
+        Supervisor.__logger.debug(f"Started worker {index} with pid {process.pid}")
+
+    def __restart(self, index: int) -> None:
+        process, started = self.__processes.pop(index)
+        process.join()
+        self.__retired.update(_cumulative(self.__counters.pop(index, {})))
+        Supervisor.__logger.warning(
+            f"Worker {index} exited with code {process.exitcode}, restarting it"
+        )
+        if monotonic() - started < RESTART_DELAY:
+            sleep_for(RESTART_DELAY)
+        self.__start(index)
+
+    def __shutdown(self) -> None:
+        for process, _ in self.__processes.values():
+            if process.is_alive():
+                process.terminate()
+        try:
+            for process, _ in self.__processes.values():
+                process.join()
+        except KeyboardInterrupt:
+            Supervisor.__logger.warning("Killing workers")
+            for process, _ in self.__processes.values():
+                process.kill()
+                process.join()
+
+    def __collect(self) -> None:
+        while (message := self.__queue.get()) is not None:
+            if isinstance(message, LogRecord):
+                getLogger(message.name).handle(message)
+            else:
+                index, counters = message
+                if index in self.__processes:
+                    self.__counters[index] = counters
+
+
+def _worker(
+    proxy: Proxy,
+    index: int,
+    queue: Queue[Message],
+    log_level: int | None,
+    reuse_port: bool,
+    loop_factory: LoopFactory | None,
+    /,
+) -> None:
+    signal(SIGINT, SIG_IGN)
+    root: Logger = getLogger()
+    root.handlers = [QueueHandler(queue)]
+    if log_level is not None:
+        root.setLevel(log_level)
+    if reuse_port:
+        proxy.bind(reuse_port=True)
+    run_loop(_serve(proxy, index, queue), loop_factory=loop_factory)
+
+
+async def _serve(proxy: Proxy, index: int, queue: Queue[Message], /) -> None:
+    task = current_task()
+    assert task is not None
+    get_running_loop().add_signal_handler(SIGTERM, task.cancel)
+    reporter = get_running_loop().create_task(_report(proxy, index, queue))
+    try:
+        await proxy.run_async()
+    except CancelledError:
+        pass
+    finally:
+        reporter.cancel()
+        queue.put((index, proxy.counters()))
+
+
+async def _report(proxy: Proxy, index: int, queue: Queue[Message], /) -> None:
+    while True:
+        await sleep(STATS_INTERVAL)
+        queue.put((index, proxy.counters()))
@@ -0,0 +1,18 @@
+from __future__ import annotations
+from laproxy import MultiProxy, TCPProxy, NoHTTPHandler, TCPLineHandler
+
+
+class Handler(TCPLineHandler):
+    def process_line(self, line: bytes, inbound: bool, /) -> bytes | None:
+        if b"ciao" in line and not inbound:
+            return None
+        return line
+
+
+if __name__ == "__main__":
+    MultiProxy(
+        {
+            "web": TCPProxy("0.0.0.0", 8081, "www.google.com", 80, NoHTTPHandler),
+            "lines": TCPProxy("0.0.0.0", 5002, "www.google.com", 80, Handler),
+        }
+    ).run()
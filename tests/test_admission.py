@@ -0,0 +1,44 @@
+from __future__ import annotations
+from time import sleep
+from laproxy import Limits
+from laproxy._admission import Admission, TokenBucket
+from laproxy._metrics import Metrics
+
+
+def test_token_bucket():
+    bucket = TokenBucket(100, 2)
+    assert bucket.try_take()
+    assert bucket.try_take()
+    assert not bucket.try_take()
+    assert 0.09 < bucket.take(10) <= 0.1
+    sleep(0.12)
+    assert bucket.take(1) == 0
+
+
+def test_admission():
+    metrics = Metrics()
+    admission = Admission(
+        Limits(
+            max_connections=3,
+            max_connections_per_ip=2,
+            connection_rate=0.001,
+            connection_burst=3,
+        ),
+        metrics,
+    )
+    assert admission.admit("10.0.0.1")
+    assert admission.admit("10.0.0.1")
+    assert not admission.admit("10.0.0.1")
+    admission.release("10.0.0.1")
+    assert admission.admit("10.0.0.1")
+    for _ in range(2):
+        admission.release("10.0.0.1")
+    assert not admission.admit("10.0.0.1")
+    for ip in ("10.0.0.2", "10.0.0.3", "10.0.0.4"):
+        assert admission.admit(ip)
+    assert not admission.admit("10.0.0.5")
+    assert metrics.samples() == {
+        'laproxy_rejected_total{reason="max_connections_per_ip"}': 1,
+        'laproxy_rejected_total{reason="connection_rate"}': 1,
+        'laproxy_rejected_total{reason="max_connections"}': 1,
+    }
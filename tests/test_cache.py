@@ -0,0 +1,67 @@
+from __future__ import annotations
+from asyncio import StreamReader
+from time import sleep
+from laproxy import CachedVerdict, HTTPRequest, VerdictCache
+
+REQUEST = (
+    b"POST /login HTTP/1.1\r\n"
+    b"Host: example.com\r\n"
+    b"User-Agent: %s\r\n"
+    b"Content-Length: 5\r\n"
+    b"\r\n"
+    b"%s"
+)
+
+
+async def request(agent: bytes, body: bytes) -> HTTPRequest:
+    reader = StreamReader()
+    reader.feed_data(REQUEST % (agent, body))
+    reader.feed_eof()
+    result = await HTTPRequest.parse_request(reader)
+    assert result is not None
+    return result
+
+
+async def test_fingerprint():
+    cache = VerdictCache(headers=("Host",))
+    first = await request(b"curl", b"hello")
+    second = await request(b"wget", b"hello")
+    key = cache.fingerprint(first, first)
+    assert key == cache.fingerprint(second, second)
+    third = await request(b"curl", b"world")
+    assert key != cache.fingerprint(third, third)
+    cache = VerdictCache(headers=("host", "user-agent"))
+    assert cache.fingerprint(first, first) != cache.fingerprint(second, second)
+
+
+def test_lru():
+    cache = VerdictCache(2)
+    cache.put("a", 0, CachedVerdict(True))
+    cache.put("b", 0, CachedVerdict(False, "rule"))
+    assert cache.get("a", 0) == CachedVerdict(True)
+    cache.put("c", 0, CachedVerdict(True))
+    assert cache.get("b", 0) is None
+    assert cache.get("c", 0) is not None
+    assert len(cache) == 2
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.evictions) == (2, 1, 1)
+
+
+def test_ttl():
+    cache = VerdictCache(16, 0.05)
+    cache.put("a", 0, CachedVerdict(True))
+    assert cache.get("a", 0) is not None
+    sleep(0.1)
+    assert cache.get("a", 0) is None
+    assert cache.stats.expirations == 1
+
+
+def test_reload():
+    cache = VerdictCache()
+    cache.put("a", 0, CachedVerdict(True))
+    assert cache.get("a", 1) is None
+    assert cache.stats.invalidations == 1
+    cache.put("a", 0, CachedVerdict(True))
+    assert len(cache) == 0
+    cache.put("a", 1, CachedVerdict(True))
+    assert cache.get("a", 0) is None
+    assert cache.get("a", 1) is not None
@@ -0,0 +1,286 @@
+from __future__ import annotations
+from laproxy import (
+    BodyTooLargeException,
+    Decoder,
+    DecodedBodyTooLargeException,
+    HTTPHeaders,
+    HTTPRequest,
+    HTTPResponse,
+    WebSocketFrame,
+)
+from laproxy._body import BodyReader, MalformedBodyException
+from laproxy._websocket import read_frame
+from asyncio import StreamReader
+from gzip import compress, decompress
+from zlib import compress as zlib_compress
+from pytest import raises
+
+REQUEST = (
+    b"POST /login HTTP/1.1\r\n"
+    b"Host: example.com\r\n"
+    b"X-Custom-Header: A\r\n"
+    b"Content-Length: 5\r\n"
+    b"\r\n"
+    b"hello"
+)
+
+
+def reader(*data: bytes) -> StreamReader:
+    result = StreamReader()
+    for chunk in data:
+        result.feed_data(chunk)
+    result.feed_eof()
+    return result
+
+
+async def test_unmodified_request():
+    request = await HTTPRequest.parse_request(reader(REQUEST, REQUEST))
+    assert request is not None
+    assert request.method == "POST"
+    assert request.path == "/login"
+    assert request.headers["x-custom-header"] == "A"
+    assert bytes(request) == REQUEST
+
+
+async def test_modified_request():
+    request = await HTTPRequest.parse_request(reader(REQUEST))
+    assert request is not None
+    request.path = "/logout"
+    assert bytes(request) == REQUEST.replace(b"/login", b"/logout")
+    request.headers["X-Custom-Header"] = "B"
+    assert bytes(request) == REQUEST.replace(b"/login", b"/logout").replace(
+        b"X-Custom-Header: A", b"X-Custom-Header: B"
+    )
+
+
+async def test_response():
+    stream = reader(b"HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+    response = await HTTPResponse.parse_response(stream)
+    assert response is not None
+    assert (response.version, response.code, response.message) == (
+        1.0,
+        404,
+        "Not Found",
+    )
+    assert await HTTPResponse.parse_response(stream) is None
+
+
+CHUNKED = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Transfer-Encoding: chunked\r\n"
+    b"\r\n"
+    b"5;ext=1\r\nhello\r\n"
+    b"6\r\n world\r\n"
+    b"0\r\n"
+    b"Expires: never\r\n"
+    b"\r\n"
+)
+
+
+async def test_chunked_response():
+    response = await HTTPResponse.parse_response(reader(CHUNKED))
+    assert response is not None
+    assert response.body == b"hello world"
+    assert response.trailers is not None
+    assert response.trailers["expires"] == "never"
+    assert bytes(response) == (
+        b"HTTP/1.1 200 OK\r\n"
+        b"Transfer-Encoding: chunked\r\n"
+        b"\r\n"
+        b"b\r\nhello world\r\n"
+        b"0\r\n"
+        b"Expires: never\r\n"
+        b"\r\n"
+    )
+
+
+async def test_close_delimited_response():
+    stream = reader(b"HTTP/1.0 200 OK\r\n\r\nuntil the end")
+    response = await HTTPResponse.parse_response(stream)
+    assert response is not None
+    assert response.body == b"until the end"
+
+
+async def test_streamed_response():
+    response = await HTTPResponse.parse_response(reader(CHUNKED), threshold=4)
+    assert response is not None
+    assert response.streaming
+    assert response.body == b""
+    assert bytes(response) == b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+
+
+async def test_repeated_headers():
+    response = await HTTPResponse.parse_response(
+        reader(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Set-Cookie: a=1\r\n"
+            b"content-length: 0\r\n"
+            b"Set-Cookie: b=2\r\n"
+            b"\r\n"
+        )
+    )
+    assert response is not None
+    headers = response.headers
+    assert headers["set-cookie"] == "b=2"
+    assert headers.get_all("SET-COOKIE") == ["a=1", "b=2"]
+    assert list(headers) == ["set-cookie", "content-length"]
+    headers.add("Set-Cookie", "c=3")
+    assert headers.get_all("set-cookie") == ["a=1", "b=2", "c=3"]
+    assert bytes(response) == (
+        b"HTTP/1.1 200 OK\r\n"
+        b"Set-Cookie: a=1\r\n"
+        b"content-length: 0\r\n"
+        b"Set-Cookie: b=2\r\n"
+        b"Set-Cookie: c=3\r\n"
+        b"\r\n"
+    )
+    headers["Set-Cookie"] = "d=4"
+    assert headers.serialize() == b"Set-Cookie: d=4\r\ncontent-length: 0\r\n"
+    del headers["CONTENT-LENGTH"]
+    assert "content-length" not in headers
+    assert headers.fields() == [("Set-Cookie", "d=4")]
+
+
+def test_new_headers():
+    headers = HTTPHeaders({"Host": "example.com"}, Accept="*/*")
+    assert headers.modified
+    assert headers["host"] == "example.com"
+    assert headers.serialize() == b"Host: example.com\r\nAccept: */*\r\n"
+    copy = headers.copy()
+    copy["host"] = "example.org"
+    assert headers["HOST"] == "example.com"
+    assert copy != headers
+
+
+async def test_decoded_body():
+    body = compress(b"the flag is here", mtime=0)
+    response = await HTTPResponse.parse_response(
+        reader(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Encoding: gzip\r\n"
+            b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+            b"\r\n" + body
+        )
+    )
+    assert response is not None
+    assert b"flag" not in response.body
+    assert b"flag" in response.decoded_body
+    assert response.decoded_body is response.decoded_body
+    assert not response.headers.modified
+    response.decoded_body = response.decoded_body.replace(b"flag", b"nothing")
+    assert decompress(response.body) == b"the nothing is here"
+    assert response.headers["content-length"] == str(len(response.body))
+
+
+def test_decoder_limit():
+    bomb = zlib_compress(bytes(1024 * 1024))
+    decoder = Decoder(["deflate"], limit=1024)
+    try:
+        decoder.feed(bomb)
+    except DecodedBodyTooLargeException:
+        pass
+    else:
+        assert False
+    assert Decoder(["deflate"]).feed(zlib_compress(b"data")[2:-4]) == b"data"
+
+
+async def test_head_response():
+    stream = reader(
+        b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\n"
+        b"HTTP/1.1 204 No Content\r\n\r\n"
+    )
+    request = HTTPRequest(HTTPHeaders(), b"", "HEAD", "/", 1.1)
+    response = await HTTPResponse.parse_response(stream, request=request)
+    assert response is not None
+    assert response.body == b""
+    response = await HTTPResponse.parse_response(stream)
+    assert response is not None
+    assert response.code == 204
+
+
+async def test_websocket_frame():
+    frame = WebSocketFrame(0x1, b"x" * 300, key=b"\x01\x02\x03\x04")
+    data = bytes(frame)
+    assert data[1] == 0x80 | 126
+    assert b"x" not in data
+    parsed = await read_frame(reader(data, bytes(WebSocketFrame(0x9, b"ping"))))
+    assert parsed == frame
+    stream = reader(bytes(WebSocketFrame(0x9, b"ping")))
+    parsed = await read_frame(stream)
+    assert parsed is not None
+    assert (parsed.opcode, parsed.payload, parsed.key) == (0x9, b"ping", None)
+    assert await read_frame(stream) is None
+
+
+async def test_spooled_body():
+    request = await HTTPRequest.parse_request(reader(REQUEST), threshold=4, spool=True)
+    assert request is not None
+    assert request.body == b""
+    assert request.spool is not None
+    assert b"ell" in request.spool
+    assert request.spool.data[:] == b"hello"
+    assert bytes(request) == REQUEST
+    response = await HTTPResponse.parse_response(
+        reader(CHUNKED), threshold=4, spool=True
+    )
+    assert response is not None
+    assert response.spool is not None
+    assert bytes(response).endswith(
+        b"b\r\nhello world\r\n0\r\nExpires: never\r\n\r\n"
+    )
+    response.body = b"replaced"
+    assert response.spool is None
+
+
+async def test_max_body_size():
+    try:
+        await HTTPRequest.parse_request(reader(REQUEST[:-5]), max_size=4)
+    except BodyTooLargeException:
+        pass
+    else:
+        assert False
+    response = await HTTPResponse.parse_response(reader(CHUNKED), max_size=11)
+    assert response is not None
+    try:
+        await HTTPResponse.parse_response(reader(CHUNKED), max_size=10)
+    except BodyTooLargeException:
+        pass
+    else:
+        assert False
+
+
+async def test_truncated_body():
+    with raises(MalformedBodyException):
+        await HTTPRequest.parse_request(reader(REQUEST[:-2]))
+    request = await HTTPRequest.parse_request(reader(REQUEST[:-2]), threshold=1)
+    assert request is not None and request.streaming
+    with raises(MalformedBodyException):
+        async for _ in request._stream:  # type: ignore
+            pass
+
+
+async def test_invalid_sizes():
+    for length in (b"-1", b"+5", b"0x5", b"5 5"):
+        data = REQUEST.replace(b"Content-Length: 5", b"Content-Length: " + length)
+        with raises(MalformedBodyException):
+            await HTTPRequest.parse_request(reader(data))
+    for size in (b"-1", b"+5", b" 5", b"0x5"):
+        data = b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n%s\r\n" % size
+        with raises(MalformedBodyException):
+            await HTTPRequest.parse_request(reader(data + b"hello\r\n0\r\n\r\n"))
+
+
+async def test_negative_size_limit():
+    body = b"x" * 5 * 1024 * 1024
+    with raises(MalformedBodyException):
+        BodyReader(reader(body), "length", -1, max_size=1024)
+    stream = reader(b"POST / HTTP/1.1\r\nContent-Length: -1\r\n\r\n", body)
+    with raises(MalformedBodyException):
+        await HTTPRequest.parse_request(stream, threshold=1024, max_size=1024)
+    assert len(await stream.read()) == len(body)
+    stream = reader(
+        b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n-1\r\n", body
+    )
+    with raises(MalformedBodyException):
+        await HTTPRequest.parse_request(stream, threshold=1024, max_size=1024)
+    assert len(await stream.read()) == len(body)
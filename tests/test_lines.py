@@ -0,0 +1,55 @@
+from __future__ import annotations
+from laproxy import TCPLineHandler
+from laproxy._lines import LineBuffer, LineOverflowException
+from pytest import raises
+
+
+class Upper(TCPLineHandler):
+    def max_line_length(self) -> int | None:
+        return 8
+
+    def process_lines(
+        self, lines: list[bytes], inbound: bool, /
+    ) -> list[bytes] | None:
+        if b"ciao\n" in lines:
+            return None
+        return super().process_lines(lines, inbound)
+
+    def process_line(self, line: bytes, inbound: bool, /) -> bytes | None:
+        return line.upper()
+
+
+def test_split():
+    buffer = LineBuffer(None, "drop")
+    assert buffer.feed(b"a\nbb\nc") == [b"a\n", b"bb\n"]
+    assert buffer.feed(b"c") == []
+    assert buffer.feed(memoryview(b"c\nd\n")) == [b"ccc\n", b"d\n"]
+    assert len(buffer) == 0
+
+
+def test_many_lines():
+    buffer = LineBuffer(None, "drop")
+    lines = buffer.feed(b"x" * 3)
+    for _ in range(1000):
+        lines.extend(buffer.feed(b"y\nz"))
+    assert len(lines) == 1000
+    assert lines[0] == b"xxxy\n"
+    assert lines[-1] == b"zy\n"
+
+
+def test_overflow():
+    buffer = LineBuffer(4, "drop")
+    assert buffer.feed(b"abcd") == []
+    with raises(LineOverflowException):
+        buffer.feed(b"e")
+    buffer = LineBuffer(4, "split")
+    assert buffer.feed(b"abcdefghi\nj") == [b"abcdefghi\n"]
+    assert buffer.feed(b"klmnopq") == [b"jklm"]
+    assert buffer.feed(b"r") == [b"nopq"]
+
+
+def test_handler():
+    handler = Upper()
+    assert handler.process(b"hello\nwor", False) == b"HELLO\n"
+    assert handler.process(b"ld\nand more!", False) == b"WORLD\nAND MORE"
+    assert handler.process(b"bye\nciao\n", True) is None
@@ -0,0 +1,50 @@
+from __future__ import annotations
+from laproxy import Pattern
+from laproxy._matcher import Matcher
+from re import IGNORECASE, compile
+
+
+def scanner(*patterns: Pattern):
+    result = Matcher(patterns).scanner(True)
+    assert result is not None
+    return result
+
+
+def test_split_literal():
+    flags = scanner(Pattern(b"flag{"))
+    assert flags.scan(b"aaaaf") == b"aaaaf"
+    assert flags.scan(b"la") == b"la"
+    assert flags.scan(b"g{1234}") is None
+
+
+def test_split_replace():
+    flags = scanner(Pattern(b"flag", "replace", b"FLAG"), Pattern(b"x", "replace"))
+    assert flags.scan(b"a fl") == b"a "
+    assert flags.scan(b"ag and flag x") == b"FLAG and FLAG "
+    assert flags.scan(b"hello world\n") == b"hello world\n"
+    assert flags.scan(b"", final=True) == b""
+
+
+def test_regex():
+    flags = scanner(
+        Pattern(compile(rb"[A-Z]{4}\{\w+\}", IGNORECASE), "replace", b"-", window=16)
+    )
+    assert flags.scan(b"see flag") == b""
+    assert flags.scan(b"{abc} FLAG{d}") == b"see -"
+    assert flags.scan(b"", final=True) == b" -"
+
+
+def test_directions():
+    matcher = Matcher([Pattern(b"flag", inbound=False)])
+    assert matcher.scanner(True) is None
+    outbound = matcher.scanner(False)
+    assert outbound is not None
+    assert outbound.scan(b"flag") is None
+
+
+def test_flushed():
+    flags = scanner(Pattern(b"flag{"), Pattern(b"secret", "replace", b"******"))
+    assert flags.scan(b"a fl") == b"a "
+    assert flags.scan(b"", final=True) == b"fl"
+    assert flags.scan(b"a") == b"a"
+    assert flags.scan(b"g{1234}") is None
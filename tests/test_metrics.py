@@ -0,0 +1,79 @@
+from __future__ import annotations
+from laproxy import TCPProxy, TCPHandler
+from laproxy._metrics import Metrics, expose, labelled, render
+from asyncio import StreamReader, StreamWriter, open_connection, sleep, start_server
+from aiotools import TaskGroup
+from httpx import AsyncClient
+from time import sleep as block
+
+
+class Slow(TCPHandler):
+    def process(self, packet: bytes, inbound: bool, /) -> bytes | None:
+        block(0.05)
+        return None if b"ciao" in packet else packet
+
+
+async def echo(reader: StreamReader, writer: StreamWriter) -> None:
+    while data := await reader.read(65536):
+        writer.write(data)
+        await writer.drain()
+    writer.close()
+
+
+def test_render():
+    metrics = Metrics()
+    metrics.inc("laproxy_bytes_total", 12345678, direction="inbound")
+    metrics.inc("laproxy_connections_open")
+    metrics.observe("laproxy_callback_seconds", 0.002, callback="process")
+    metrics.observe("laproxy_callback_seconds", 5, callback="process")
+    assert render(metrics.samples()).splitlines() == [
+        "# TYPE laproxy_bytes_total counter",
+        'laproxy_bytes_total{direction="inbound"} 12345678',
+        "# TYPE laproxy_callback_seconds histogram",
+        'laproxy_callback_seconds_bucket{callback="process",le="0.0025"} 1',
+        'laproxy_callback_seconds_bucket{callback="process",le="+Inf"} 2',
+        'laproxy_callback_seconds_sum{callback="process"} 5.002',
+        'laproxy_callback_seconds_count{callback="process"} 2',
+        "# TYPE laproxy_connections_open gauge",
+        "laproxy_connections_open 1",
+    ]
+
+
+def test_labelled():
+    metrics = Metrics()
+    metrics.inc("laproxy_connections_open")
+    metrics.observe("laproxy_callback_seconds", 0.002, callback="process")
+    lines = render(labelled(metrics.samples(), route="web")).splitlines()
+    bucket = 'laproxy_callback_seconds_bucket{route="web",callback="process",le="+Inf"}'
+    assert f"{bucket} 1" in lines
+    assert 'laproxy_connections_open{route="web"} 1' in lines
+
+
+async def test_proxy_metrics(caplog):
+    server = await start_server(echo, "127.0.0.1", 1262)
+    proxy = TCPProxy(
+        "127.0.0.1", 1263, "127.0.0.1", 1262, Slow, slow_callback=0.01
+    )
+    async with server, TaskGroup() as group:
+        task = group.create_task(proxy.run_async(), name="proxy")
+        endpoint = group.create_task(expose(proxy.counters, "127.0.0.1", 1264))
+        await sleep(0.1)
+        reader, writer = await open_connection("127.0.0.1", 1263)
+        writer.write(b"hello")
+        assert await reader.readexactly(5) == b"hello"
+        writer.write(b"ciao")
+        assert await reader.read() == b""
+        writer.close()
+        await sleep(0.1)
+        counters = proxy.counters()
+        assert counters["laproxy_connections_total"] == 1
+        assert counters["laproxy_connections_open"] == 0
+        assert counters['laproxy_bytes_total{direction="inbound"}'] == 5
+        assert counters['laproxy_drops_total{reason="handler"}'] == 1
+        assert counters['laproxy_callback_seconds_count{callback="process"}'] == 3
+        assert "blocked the event loop" in caplog.text
+        async with AsyncClient() as session:
+            r = await session.get("http://127.0.0.1:1264/metrics")
+            assert "# TYPE laproxy_upstream_connect_seconds histogram" in r.text
+        task.cancel()
+        endpoint.cancel()
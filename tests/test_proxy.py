@@ -1,12 +1,52 @@
 from __future__ import annotations
-from laproxy import TCPProxy, NoTCPHandler, NoHTTPHandler
+from laproxy import (
+    TCPProxy,
+    TCPHandler,
+    NoTCPHandler,
+    HTTPHandler,
+    HTTPPayload,
+    HTTPRequest,
+    HTTPResponse,
+    NoHTTPHandler,
+    FlowControl,
+    Pattern,
+    TCPLineHandler,
+    PoolConfig,
+    AccessLog,
+    Recorder,
+    replay,
+    MultiProxy,
+    Limits,
+    WebSocketFrame,
+    RuleHTTPHandler,
+    RuleTCPHandler,
+    RuleSet,
+    parse_rules,
+    VerdictCache,
+)
 from httpx import AsyncClient, get
-from asyncio import sleep as asleep, run, Task
+from asyncio import (
+    IncompleteReadError,
+    StreamReader,
+    StreamWriter,
+    sleep as asleep,
+    run,
+    Task,
+    start_server,
+    open_connection,
+    get_running_loop,
+    wait,
+)
 from aiotools import TaskGroup
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 from sys import executable
 from os import environ
 from subprocess import Popen, check_call
 from time import sleep
+from json import loads
+from gzip import compress, decompress
+from pathlib import Path
 
 
 async def check(task: Task[None], port: int) -> None:
@@ -18,6 +58,89 @@ async def check(task: Task[None], port: int) -> None:
     task.cancel()
 
 
+async def bulk(reader: StreamReader, writer: StreamWriter) -> None:
+    writer.write(b"x" * 32 * 1024 * 1024)
+    await writer.drain()
+    writer.close()
+
+
+async def echo(reader: StreamReader, writer: StreamWriter) -> None:
+    while data := await reader.read(65536):
+        writer.write(data)
+        await writer.drain()
+    writer.close()
+
+
+class OutboundFilter(TCPHandler):
+    def inspect(self, inbound: bool, /) -> bool:
+        return not inbound
+
+    def process(self, packet: bytes, inbound: bool, /) -> bytes | None:
+        if b"ciao" in packet:
+            return None
+        return packet
+
+
+async def chunked(reader: StreamReader, writer: StreamWriter) -> None:
+    await reader.readuntil(b"\r\n\r\n")
+    writer.write(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n")
+    for _ in range(100):
+        writer.write(b"a\r\nflag{1234}\r\n")
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+    writer.close()
+
+
+class FlagFilter(NoTCPHandler):
+    def patterns(self) -> list[Pattern]:
+        return [
+            Pattern(b"flag{", inbound=False),
+            Pattern(b"secret", "replace", b"******", inbound=False),
+        ]
+
+
+class AsyncLineFilter(TCPLineHandler):
+    async def process_line(self, line: bytes, inbound: bool, /) -> bytes | None:
+        await asleep(0)
+        if b"ciao" in line:
+            return None
+        return line.upper()
+
+
+def keep_alive(requests: list[int]):
+    async def serve(reader: StreamReader, writer: StreamWriter) -> None:
+        index = len(requests)
+        requests.append(0)
+        while True:
+            try:
+                await reader.readuntil(b"\r\n\r\n")
+            except IncompleteReadError:
+                break
+            requests[index] += 1
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+            await writer.drain()
+        writer.close()
+
+    return serve
+
+
+class StreamingHandler(HTTPHandler):
+    def body_threshold(self) -> int:
+        return 16
+
+    def body_chunk(
+        self, message: HTTPPayload, chunk: bytes, inbound: bool, /
+    ) -> bytes | None:
+        return chunk.replace(b"flag", b"FLAG")
+
+    def request(self, request: HTTPRequest, /) -> HTTPRequest | None:
+        return request
+
+    def response(self, response: HTTPResponse, /) -> HTTPResponse | None:
+        assert response.streaming
+        return response
+
+
 def check_http(port: int) -> None:
     sleep(1)
     r = get(f"http://127.0.0.1:{port}", follow_redirects=False)
@@ -62,6 +185,757 @@ async def test_http():
         group.create_task(check(task, 1235), name="client")
 
 
+async def test_backpressure():
+    server = await start_server(bulk, "127.0.0.1", 1240)
+    proxy = TCPProxy(
+        "127.0.0.1",
+        1241,
+        "127.0.0.1",
+        1240,
+        NoTCPHandler,
+        outbound_flow=FlowControl(high_watermark=1024, low_watermark=256),
+        passthrough=False,
+    )
+    async with server, TaskGroup() as group:
+        task = group.create_task(proxy.run_async(), name="proxy")
+        await asleep(0.1)
+        reader, writer = await open_connection("127.0.0.1", 1241)
+        await asleep(0.5)
+        assert proxy.stats.throttled_outbound > 0
+        assert len(await reader.read()) == 32 * 1024 * 1024
+        writer.close()
+        task.cancel()
+
+
+async def test_buffer_limit():
+    server = await start_server(bulk, "127.0.0.1", 1242)
+    proxy = TCPProxy(
+        "127.0.0.1",
+        1243,
+        "127.0.0.1",
+        1242,
+        NoTCPHandler,
+        outbound_flow=FlowControl(max_buffer=1),
+        passthrough=False,
+    )
+    async with server, TaskGroup() as group:
+        task = group.create_task(proxy.run_async(), name="proxy")
+        await asleep(0.1)
+        reader, writer = await open_connection("127.0.0.1", 1243)
+        await asleep(0.5)
+        assert proxy.stats.overflowed_outbound == 1
+        assert len(await reader.read()) < 32 * 1024 * 1024
+        writer.close()
+        task.cancel()
+
+
+async def test_passthrough():
+    server = await start_server(echo, "127.0.0.1", 1244)
+    async with server, TaskGroup() as group:
+        task = group.create_task(
+            TCPProxy("127.0.0.1", 1245, "127.0.0.1", 1244, NoTCPHandler).run_async(),
+            name="proxy",
+        )
+        await asleep(0.1)
+        reader, writer = await open_connection("127.0.0.1", 1245)
+        payload = bytes(range(256)) * 4096
+        writer.write(payload)
+        assert await reader.readexactly(len(payload)) == payload
+        writer.close()
+        task.cancel()
+
+
+async def test_partial_passthrough():
+    server = await start_server(echo, "127.0.0.1", 1246)
+    async with server, TaskGroup() as group:
+        task = group.create_task(
+            TCPProxy("127.0.0.1", 1247, "127.0.0.1", 1246, OutboundFilter).run_async(),
+            name="proxy",
+        )
+        await asleep(0.1)
+        reader, writer = await open_connection("127.0.0.1", 1247)
+        writer.write(b"hello\n")
+        assert await reader.readexactly(6) == b"hello\n"
+        writer.write(b"ciao\n")
+        assert await reader.read() == b""
+        writer.close()
+        task.cancel()
+
+
+async def test_protocol_engine():
+    server = await start_server(echo, "127.0.0.1", 1248)
+    async with server, TaskGroup() as group:
+        task = group.create_task(
+            TCPProxy(
+                "127.0.0.1",
+                1249,
+                "127.0.0.1",
+                1248,
+                OutboundFilter,
+                passthrough=False,
+                engine="protocol",
+            ).run_async(),
+            name="proxy",
+        )
+        await asleep(0.1)
+        reader, writer = await open_connection("127.0.0.1", 1249)
+        payload = b"hello\n" * 100000
+        writer.write(payload)
+        assert await reader.readexactly(len(payload)) == payload
+        writer.write(b"ciao\n")
+        assert await reader.read() == b""
+        writer.close()
+        task.cancel()
+
+
+async def test_workers():
+    server = await start_server(echo, "127.0.0.1", 1250)
+    process = Popen(
+        [
+            executable,
+            "-c",
+            "from laproxy import TCPProxy, NoTCPHandler;"
+            "TCPProxy('127.0.0.1', 1251, '127.0.0.1', 1250, NoTCPHandler).run(workers=2)",
+        ],
+        env={**environ, "PYTHONPATH": "."},
+    )
+    async with server:
+        await asleep(1)
+        for _ in range(4):
+            reader, writer = await open_connection("127.0.0.1", 1251)
+            writer.write(b"hello")
+            assert await reader.readexactly(5) == b"hello"
+            writer.close()
+        process.terminate()
+        assert process.wait(10) == 0
+
+
+async def test_streaming():
+    server = await start_server(chunked, "127.0.0.1", 1252)
+    async with server, TaskGroup() as group:
+        task = group.create_task(
+            TCPProxy(
+                "127.0.0.1", 1253, "127.0.0.1", 1252, StreamingHandler
+            ).run_async(),
+            name="proxy",
+        )
+        async with AsyncClient() as session:
+            await asleep(0.1)
+            r = await session.get("http://127.0.0.1:1253")
+            assert r.content == b"FLAG{1234}" * 100
+        task.cancel()
+
+
+async def test_patterns():
+    server = await start_server(echo, "127.0.0.1", 1254)
+    async with server, TaskGroup() as group:
+        task = group.create_task(
+            TCPProxy("127.0.0.1", 1255, "127.0.0.1", 1254, FlagFilter).run_async(),
+            name="proxy",
+        )
+        await asleep(0.1)
+        reader, writer = await open_connection("127.0.0.1", 1255)
+        writer.write(b"hello world\n")
+        assert await reader.readexactly(12) == b"hello world\n"
+        writer.write(b"the sec")
+        writer.write(b"ret is fl")
+        assert await reader.readexactly(14) == b"the ****** is "
+        assert await reader.readexactly(2) == b"fl"
+        writer.write(b"ag{1234}")
+        assert await reader.read() == b""
+        writer.close()
+        reader, writer = await open_connection("127.0.0.1", 1255)
+        writer.write(b"a secret is")
+        await asleep(0.1)
+        writer.write_eof()
+        assert await reader.read() == b"a ****** is"
+        writer.close()
+        task.cancel()
+
+
+async def test_executor():
+    server = await start_server(echo, "127.0.0.1", 1256)
+    with ProcessPoolExecutor(2, get_context("forkserver")) as executor:
+        async with server, TaskGroup() as group:
+            task = group.create_task(
+                TCPProxy(
+                    "127.0.0.1",
+                    1257,
+                    "127.0.0.1",
+                    1256,
+                    OutboundFilter,
+                    passthrough=False,
+                    executor=executor,
+                ).run_async(),
+                name="proxy",
+            )
+            await asleep(0.1)
+            reader, writer = await open_connection("127.0.0.1", 1257)
+            payload = bytes(range(256)) * 1024
+            writer.write(payload)
+            assert await reader.readexactly(len(payload)) == payload
+            writer.write(b"ciao\n")
+            assert await reader.read() == b""
+            writer.close()
+            task.cancel()
+
+
+async def test_async_callbacks():
+    server = await start_server(echo, "127.0.0.1", 1258)
+    async with server, TaskGroup() as group:
+        task = group.create_task(
+            TCPProxy(
+                "127.0.0.1", 1259, "127.0.0.1", 1258, AsyncLineFilter, engine="protocol"
+            ).run_async(),
+            name="proxy",
+        )
+        await asleep(0.1)
+        reader, writer = await open_connection("127.0.0.1", 1259)
+        writer.write(b"hello\nwor")
+        assert await reader.readexactly(6) == b"HELLO\n"
+        writer.write(b"ld\n")
+        assert await reader.readexactly(6) == b"WORLD\n"
+        writer.write(b"ciao\n")
+        assert await reader.read() == b""
+        writer.close()
+        task.cancel()
+
+
+async def test_pool():
+    requests: list[int] = []
+    server = await start_server(keep_alive(requests), "127.0.0.1", 1260)
+    async with server, TaskGroup() as group:
+        task = group.create_task(
+            TCPProxy(
+                "127.0.0.1",
+                1261,
+                "127.0.0.1",
+                1260,
+                NoHTTPHandler,
+                pool=PoolConfig(min_idle=1),
+            ).run_async(),
+            name="proxy",
+        )
+        await asleep(0.1)
+        assert requests == [0]
+        for _ in range(3):
+            reader, writer = await open_connection("127.0.0.1", 1261)
+            writer.write(b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            assert (await reader.readuntil(b"ok")).endswith(b"\r\n\r\nok")
+            writer.close()
+            await asleep(0.1)
+        assert len(requests) == 2
+        assert sum(requests) == 3
+        task.cancel()
+
+
+async def test_access_log(tmp_path: Path):
+    path = tmp_path / "access.log"
+    server = await start_server(echo, "127.0.0.1", 1265)
+    async with server:
+        async with TaskGroup() as group:
+            task = group.create_task(
+                TCPProxy(
+                    "127.0.0.1",
+                    1266,
+                    "127.0.0.1",
+                    1265,
+                    OutboundFilter,
+                    access_log=AccessLog(str(path), sample_rate=0),
+                ).run_async(),
+                name="proxy",
+            )
+            await asleep(0.1)
+            reader, writer = await open_connection("127.0.0.1", 1266)
+            writer.write(b"hello")
+            assert await reader.readexactly(5) == b"hello"
+            writer.close()
+            reader, writer = await open_connection("127.0.0.1", 1266)
+            writer.write(b"ciao")
+            assert await reader.read() == b""
+            writer.close()
+            await asleep(0.1)
+            task.cancel()
+    entries = [loads(line) for line in path.read_text().splitlines()]
+    assert len(entries) == 1
+    assert entries[0]["dropped"] == "handler"
+    assert entries[0]["bytes_inbound"] == 4
+    assert entries[0]["peer"].startswith("127.0.0.1:")
+
+
+class Upper(TCPLineHandler):
+    def process_line(self, line: bytes, inbound: bool, /) -> bytes | None:
+        if b"ciao" in line:
+            return None
+        return line.upper() if inbound else line
+
+
+async def test_record_replay(tmp_path: Path):
+    server = await start_server(echo, "127.0.0.1", 1267)
+    async with server:
+        async with TaskGroup() as group:
+            task = group.create_task(
+                TCPProxy(
+                    "127.0.0.1",
+                    1268,
+                    "127.0.0.1",
+                    1267,
+                    Upper,
+                    recorder=Recorder(str(tmp_path)),
+                ).run_async(),
+                name="proxy",
+            )
+            await asleep(0.1)
+            reader, writer = await open_connection("127.0.0.1", 1268)
+            writer.write(b"hel")
+            writer.write(b"lo\n")
+            assert await reader.readexactly(6) == b"HELLO\n"
+            writer.write(b"ciao\n")
+            assert await reader.read() == b""
+            writer.close()
+            await asleep(0.1)
+            task.cancel()
+    paths = [str(path) for path in tmp_path.iterdir()]
+    report = await replay(paths, Upper)
+    assert (report.sessions, report.mismatches) == (1, [])
+    assert report.bytes >= 15
+    report = await replay(paths, NoTCPHandler)
+    assert len(report.mismatches) == 1
+
+
+class Redact(NoTCPHandler):
+    def patterns(self) -> list[Pattern]:
+        return [Pattern(b"secret", "replace", b"******", inbound=False)]
+
+
+async def test_replay_held(tmp_path: Path):
+    server = await start_server(echo, "127.0.0.1", 1295)
+    async with server, TaskGroup() as group:
+        recorder = Recorder(str(tmp_path))
+        proxy = TCPProxy(
+            "127.0.0.1", 1296, "127.0.0.1", 1295, Redact, recorder=recorder
+        )
+        task = group.create_task(proxy.run_async())
+        await asleep(0.1)
+        reader, writer = await open_connection("127.0.0.1", 1296)
+        writer.write(b"a secret or a sec")
+        await asleep(0.1)
+        writer.write_eof()
+        assert await reader.read() == b"a ****** or a sec"
+        writer.close()
+        await asleep(0.1)
+        task.cancel()
+    report = await replay([str(path) for path in tmp_path.iterdir()], Redact)
+    assert (report.sessions, report.mismatches) == (1, [])
+
+
+async def test_multi_proxy():
+    server = await start_server(echo, "127.0.0.1", 1269)
+    proxy = MultiProxy(
+        {
+            "plain": TCPProxy("127.0.0.1", 1270, "127.0.0.1", 1269, NoTCPHandler),
+            "upper": TCPProxy("127.0.0.1", 1271, "127.0.0.1", 1269, Upper),
+        }
+    )
+    async with server, TaskGroup() as group:
+        task = group.create_task(proxy.run_async(), name="proxy")
+        await asleep(0.1)
+        for port, expected in ((1270, b"hello\n"), (1271, b"HELLO\n")):
+            reader, writer = await open_connection("127.0.0.1", port)
+            writer.write(b"hello\n")
+            assert await reader.readexactly(6) == expected
+            writer.close()
+        await asleep(0.1)
+        counters = proxy.counters()
+        assert counters['laproxy_connections_total{route="plain"}'] == 1
+        assert counters['laproxy_bytes_total{route="upper",direction="inbound"}'] == 6
+        task.cancel()
+
+
+async def test_limits():
+    server = await start_server(echo, "127.0.0.1", 1272)
+    limits = Limits(max_connections_per_ip=1, idle_timeout=0.2)
+    tcp = TCPProxy("127.0.0.1", 1273, "127.0.0.1", 1272, NoTCPHandler, limits=limits)
+    limits = Limits(idle_timeout=10, header_timeout=0.2)
+    http = TCPProxy("127.0.0.1", 1274, "127.0.0.1", 1272, NoHTTPHandler, limits=limits)
+    async with server, TaskGroup() as group:
+        tasks = [group.create_task(proxy.run_async()) for proxy in (tcp, http)]
+        await asleep(0.1)
+        reader, writer = await open_connection("127.0.0.1", 1273)
+        writer.write(b"hello")
+        assert await reader.readexactly(5) == b"hello"
+        rejected, other = await open_connection("127.0.0.1", 1273)
+        assert await rejected.read() == b""
+        other.close()
+        assert await reader.read() == b""
+        writer.close()
+        reader, writer = await open_connection("127.0.0.1", 1274)
+        writer.write(b"GET / HTTP/1.1\r\n")
+        assert await reader.read() == b""
+        writer.close()
+        await asleep(0.1)
+        counters = tcp.counters()
+        assert counters['laproxy_rejected_total{reason="max_connections_per_ip"}'] == 1
+        assert counters['laproxy_drops_total{reason="idle_timeout"}'] == 1
+        counters = http.counters()
+        assert counters['laproxy_drops_total{reason="header_timeout"}'] == 1
+        for task in tasks:
+            task.cancel()
+
+
+async def test_slow_body():
+    server = await start_server(body_server, "127.0.0.1", 1288)
+    proxies = [
+        TCPProxy("127.0.0.1", port, "127.0.0.1", 1288, NoHTTPHandler, limits=limits)
+        for port, limits in (
+            (1289, Limits(header_timeout=0.3)),
+            (1290, Limits(idle_timeout=0.3)),
+        )
+    ]
+    async with server, TaskGroup() as group:
+        tasks = [group.create_task(proxy.run_async()) for proxy in proxies]
+        await asleep(0.1)
+        for port in (1289, 1290):
+            reader, writer = await open_connection("127.0.0.1", port)
+            writer.write(b"POST / HTTP/1.1\r\nContent-Length: 10\r\n\r\n")
+            for _ in range(5):
+                await asleep(0.1)
+                writer.write(b"ab")
+            await reader.readuntil(b"\r\n\r\n")
+            assert await reader.readexactly(10) == b"ab" * 5
+            writer.close()
+        for proxy in proxies:
+            assert not any("drops_total" in name for name in proxy.counters())
+        for task in tasks:
+            task.cancel()
+
+
+async def head_server(reader: StreamReader, writer: StreamWriter) -> None:
+    while True:
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except IncompleteReadError:
+            break
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n")
+        if not request.startswith(b"HEAD"):
+            writer.write(b"ok")
+        await writer.drain()
+    writer.close()
+
+
+class PathHandler(HTTPHandler):
+    def request(self, request: HTTPRequest, /) -> HTTPRequest | None:
+        return request
+
+    def response_to(
+        self, request: HTTPRequest | None, response: HTTPResponse, /
+    ) -> HTTPResponse | None:
+        assert request is not None
+        response.headers["X-Path"] = request.path
+        return response
+
+
+async def test_pipelining():
+    server = await start_server(head_server, "127.0.0.1", 1275)
+    async with server, TaskGroup() as group:
+        task = group.create_task(
+            TCPProxy("127.0.0.1", 1276, "127.0.0.1", 1275, PathHandler).run_async()
+        )
+        await asleep(0.1)
+        reader, writer = await open_connection("127.0.0.1", 1276)
+        writer.write(
+            b"HEAD /a HTTP/1.1\r\n\r\n"
+            b"GET /b HTTP/1.1\r\n\r\n"
+            b"HEAD /c HTTP/1.1\r\n\r\n"
+        )
+        for path, body in ((b"/a", b""), (b"/b", b"ok"), (b"/c", b"")):
+            head = await reader.readuntil(b"\r\n\r\n")
+            assert head.endswith(b"X-Path: " + path + b"\r\n\r\n")
+            assert await reader.readexactly(len(body)) == body
+        writer.close()
+        task.cancel()
+
+
+async def upgrade_server(reader: StreamReader, writer: StreamWriter) -> None:
+    request = await reader.readuntil(b"\r\n\r\n")
+    if request.startswith(b"CONNECT"):
+        writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+    else:
+        writer.write(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n\r\n")
+    await echo(reader, writer)
+
+
+class FrameHandler(NoHTTPHandler):
+    def websocket_frame(
+        self, frame: WebSocketFrame, inbound: bool, /
+    ) -> WebSocketFrame | None:
+        if b"flag" in frame.payload:
+            return None
+        frame.payload = frame.payload.upper()
+        return frame
+
+
+async def test_upgrade():
+    server = await start_server(upgrade_server, "127.0.0.1", 1277)
+    async with server, TaskGroup() as group:
+        tasks = [
+            group.create_task(
+                TCPProxy("127.0.0.1", port, "127.0.0.1", 1277, handler).run_async()
+            )
+            for port, handler in ((1278, NoHTTPHandler), (1279, FrameHandler))
+        ]
+        await asleep(0.1)
+        reader, writer = await open_connection("127.0.0.1", 1278)
+        writer.write(b"CONNECT example.com:443 HTTP/1.1\r\n\r\n\x16\x03\x01 binary")
+        head = await reader.readuntil(b"\r\n\r\n")
+        assert head.startswith(b"HTTP/1.1 200")
+        assert await reader.readexactly(10) == b"\x16\x03\x01 binary"
+        writer.close()
+        reader, writer = await open_connection("127.0.0.1", 1279)
+        writer.write(b"GET /chat HTTP/1.1\r\nUpgrade: websocket\r\n\r\n")
+        head = await reader.readuntil(b"\r\n\r\n")
+        assert head.startswith(b"HTTP/1.1 101")
+        writer.write(bytes(WebSocketFrame(0x1, b"hello", key=b"abcd")))
+        frame = bytes(WebSocketFrame(0x1, b"HELLO", key=b"abcd"))
+        assert await reader.readexactly(len(frame)) == frame
+        writer.write(bytes(WebSocketFrame(0x1, b"flag", key=b"abcd")))
+        assert await reader.read() == b""
+        writer.close()
+        for task in tasks:
+            task.cancel()
+
+
+async def body_server(reader: StreamReader, writer: StreamWriter) -> None:
+    while True:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except IncompleteReadError:
+            break
+        length = int(head.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+        body = await reader.readexactly(length)
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % length)
+        writer.write(body)
+        await writer.drain()
+    writer.close()
+
+
+class SpoolHandler(HTTPHandler):
+    def body_threshold(self) -> int:
+        return 16
+
+    def spool_bodies(self) -> bool:
+        return True
+
+    def max_body_size(self) -> int | None:
+        return 1024 * 1024
+
+    def request(self, request: HTTPRequest, /) -> HTTPRequest | None:
+        assert request.spool is not None
+        return request
+
+    def response(self, response: HTTPResponse, /) -> HTTPResponse | None:
+        assert response.spool is not None
+        if b"flag" in response.spool:
+            return None
+        return response
+
+
+async def test_spooling():
+    server = await start_server(body_server, "127.0.0.1", 1280)
+    async with server, TaskGroup() as group:
+        proxy = TCPProxy("127.0.0.1", 1281, "127.0.0.1", 1280, SpoolHandler)
+        task = group.create_task(proxy.run_async())
+        await asleep(0.1)
+        reader, writer = await open_connection("127.0.0.1", 1281)
+        body = b"x" * 100_000
+        writer.write(b"POST / HTTP/1.1\r\nContent-Length: 100000\r\n\r\n" + body)
+        await reader.readuntil(b"\r\n\r\n")
+        assert await reader.readexactly(len(body)) == body
+        writer.write(b"POST / HTTP/1.1\r\nContent-Length: 2000000\r\n\r\n")
+        assert await reader.read() == b""
+        writer.close()
+        reader, writer = await open_connection("127.0.0.1", 1281)
+        writer.write(b"POST / HTTP/1.1\r\nContent-Length: 20\r\n\r\n" + b"flag" * 5)
+        assert await reader.read() == b""
+        writer.close()
+        counters = proxy.counters()
+        assert counters['laproxy_drops_total{reason="body_too_large"}'] == 1
+        assert counters['laproxy_drops_total{reason="handler"}'] == 1
+        task.cancel()
+
+
+RULES = parse_rules(
+    [
+        {"name": "flag", "direction": "outbound", "bytes": "flag", "action": "drop"},
+        {
+            "name": "hide",
+            "direction": "inbound",
+            "method": "POST",
+            "path": "/echo",
+            "bytes": "secret",
+            "action": "replace",
+            "replacement": "public",
+        },
+    ]
+)
+
+
+class RulesHandler(RuleHTTPHandler):
+    def rules(self) -> RuleSet:
+        return RULES
+
+
+async def test_rules():
+    server = await start_server(body_server, "127.0.0.1", 1282)
+    async with server, TaskGroup() as group:
+        proxy = TCPProxy("127.0.0.1", 1283, "127.0.0.1", 1282, RulesHandler)
+        task = group.create_task(proxy.run_async())
+        await asleep(0.1)
+        reader, writer = await open_connection("127.0.0.1", 1283)
+        writer.write(b"POST /echo HTTP/1.1\r\nContent-Length: 8\r\n\r\nsecret!!")
+        head = await reader.readuntil(b"\r\n\r\n")
+        assert b"Content-Length: 8\r\n" in head
+        assert await reader.readexactly(8) == b"public!!"
+        writer.write(b"POST / HTTP/1.1\r\nContent-Length: 4\r\n\r\nflag")
+        assert await reader.read() == b""
+        writer.close()
+        counters = proxy.counters()
+        assert counters['laproxy_drops_total{reason="rule"}'] == 1
+        task.cancel()
+
+
+async def gzip_server(reader: StreamReader, writer: StreamWriter) -> None:
+    await reader.readuntil(b"\r\n\r\n")
+    body = compress(b"the secret is here", mtime=0)
+    writer.write(
+        b"HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\nContent-Length: %d\r\n\r\n"
+        % len(body)
+    )
+    writer.write(body)
+    await writer.drain()
+    writer.close()
+
+
+class EncodedFilter(NoHTTPHandler):
+    def patterns(self) -> list[Pattern]:
+        return [Pattern(b"secret", "replace", b"******", inbound=False)]
+
+
+async def test_encoded_patterns():
+    server = await start_server(gzip_server, "127.0.0.1", 1293)
+    async with server, TaskGroup() as group:
+        proxy = TCPProxy("127.0.0.1", 1294, "127.0.0.1", 1293, EncodedFilter)
+        task = group.create_task(proxy.run_async())
+        await asleep(0.1)
+        reader, writer = await open_connection("127.0.0.1", 1294)
+        writer.write(b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        head = await reader.readuntil(b"\r\n\r\n")
+        length = int(head.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+        assert decompress(await reader.readexactly(length)) == b"the ****** is here"
+        writer.close()
+        task.cancel()
+
+
+TCP_RULES = parse_rules(
+    [
+        {"name": "flag", "direction": "outbound", "bytes": "flag{"},
+        {
+            "name": "redact",
+            "direction": "outbound",
+            "bytes": "secret",
+            "action": "replace",
+            "replacement": "******",
+        },
+    ]
+)
+
+
+class TCPRulesHandler(RuleTCPHandler):
+    def rules(self) -> RuleSet:
+        return TCP_RULES
+
+
+async def test_tcp_rules():
+    server = await start_server(echo, "127.0.0.1", 1291)
+    async with server, TaskGroup() as group:
+        proxy = TCPProxy(
+            "127.0.0.1", 1292, "127.0.0.1", 1291, TCPRulesHandler, engine="protocol"
+        )
+        task = group.create_task(proxy.run_async())
+        await asleep(0.1)
+        assert TCPRulesHandler().synchronous()
+        reader, writer = await open_connection("127.0.0.1", 1292)
+        writer.write(b"hello world\n")
+        assert await reader.readexactly(12) == b"hello world\n"
+        writer.write(b"the sec")
+        writer.write(b"ret is fl")
+        assert await reader.readexactly(14) == b"the ****** is "
+        assert await reader.readexactly(2) == b"fl"
+        writer.write(b"ag{1234}")
+        assert await reader.read() == b""
+        writer.close()
+        counters = proxy.counters()
+        assert counters['laproxy_drops_total{reason="pattern"}'] == 1
+        task.cancel()
+
+
+CACHE = VerdictCache()
+
+
+class CachedHandler(HTTPHandler):
+    calls = 0
+
+    def verdict_cache(self) -> VerdictCache | None:
+        return CACHE
+
+    def request(self, request: HTTPRequest, /) -> HTTPRequest | None:
+        CachedHandler.calls += 1
+        if b"flag" in request.body:
+            self.dropping("flag")
+            return None
+        return request
+
+
+async def test_verdict_cache():
+    server = await start_server(body_server, "127.0.0.1", 1284)
+    async with server, TaskGroup() as group:
+        proxy = TCPProxy("127.0.0.1", 1285, "127.0.0.1", 1284, CachedHandler)
+        task = group.create_task(proxy.run_async())
+        await asleep(0.1)
+        for _ in range(2):
+            reader, writer = await open_connection("127.0.0.1", 1285)
+            for _ in range(3):
+                writer.write(b"POST / HTTP/1.1\r\nContent-Length: 5\r\n\r\nhello")
+                await reader.readuntil(b"\r\n\r\n")
+                assert await reader.readexactly(5) == b"hello"
+            writer.write(b"POST / HTTP/1.1\r\nContent-Length: 4\r\n\r\nflag")
+            assert await reader.read() == b""
+            writer.close()
+        assert CachedHandler.calls == 2
+        assert (CACHE.stats.hits, CACHE.stats.misses) == (6, 2)
+        counters = proxy.counters()
+        assert counters['laproxy_verdict_cache_total{result="hit"}'] == 6
+        assert counters['laproxy_drops_total{reason="flag"}'] == 2
+        task.cancel()
+
+
+async def test_shutdown():
+    server = await start_server(echo, "127.0.0.1", 1286)
+    async with server:
+        proxy = TCPProxy("127.0.0.1", 1287, "127.0.0.1", 1286, NoTCPHandler)
+        task = get_running_loop().create_task(proxy.run_async())
+        await asleep(0.1)
+        reader, writer = await open_connection("127.0.0.1", 1287)
+        writer.write(b"hello")
+        assert await reader.readexactly(5) == b"hello"
+        assert proxy.counters()["laproxy_connections_open"] == 1
+        task.cancel()
+        await wait([task])
+        assert proxy.counters()["laproxy_connections_open"] == 0
+        assert await reader.read() == b""
+        writer.close()
+
+
 def test_httpsample():
     check_sample("samples/httpproxy.py", 8080)
 
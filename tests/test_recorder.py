@@ -0,0 +1,20 @@
+from __future__ import annotations
+from pathlib import Path
+from time import sleep
+from laproxy import Recorder, read_records
+
+
+def test_rotation(tmp_path: Path):
+    recorder = Recorder(str(tmp_path), max_bytes=32)
+    recorder.start()
+    recorder.record(1, "open", b"127.0.0.1:1234", False)
+    sleep(0.1)
+    recorder.record(1, "received", memoryview(b"x" * 100), True)
+    recorder.record(1, "close", b"", False)
+    recorder.stop()
+    files = sorted(tmp_path.iterdir())
+    assert len(files) == 2
+    records = [record for path in files for record in read_records(str(path))]
+    assert [record.event for record in records] == ["open", "received", "close"]
+    assert records[1].data == b"x" * 100
+    assert records[1].inbound
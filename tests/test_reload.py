@@ -0,0 +1,42 @@
+from __future__ import annotations
+from asyncio import get_running_loop, sleep
+from importlib import import_module
+from os import utime
+from pathlib import Path
+from sys import path
+from laproxy._reload import Reloader
+
+HANDLER = """
+from laproxy import NoTCPHandler
+
+
+class Handler(NoTCPHandler):
+    VERSION = {}
+"""
+
+
+async def test_reload(tmp_path: Path):
+    source = tmp_path / "reloaded_handler.py"
+    source.write_text(HANDLER.format(1))
+    path.insert(0, str(tmp_path))
+    try:
+        module = import_module("reloaded_handler")
+    finally:
+        path.remove(str(tmp_path))
+    reloader = Reloader(module.Handler, interval=0.01)
+    old = reloader()
+    task = get_running_loop().create_task(reloader.run())
+    source.write_text(HANDLER.format(2))
+    utime(source, ns=(0, 10**18))
+    for _ in range(100):
+        await sleep(0.01)
+        if reloader.generation:
+            break
+    assert reloader.generation == 1
+    assert getattr(reloader(), "VERSION") == 2
+    assert getattr(old, "VERSION") == 1
+    source.write_text("class Handler(")
+    assert not reloader.reload()
+    assert getattr(reloader(), "VERSION") == 2
+    assert reloader.generation == 1
+    task.cancel()
@@ -0,0 +1,116 @@
+from __future__ import annotations
+from json import dumps
+from pathlib import Path
+from re import compile
+from pytest import importorskip, raises
+from laproxy import (
+    HTTPHeaders,
+    InvalidRulesException,
+    Rule,
+    RuleSet,
+    load_rules,
+    parse_rules,
+)
+
+RULES = [
+    {"name": "flag", "direction": "outbound", "regex": "flag[{]\\w+[}]"},
+    {
+        "name": "redact",
+        "direction": "outbound",
+        "bytes": "secret",
+        "ignore_case": True,
+        "action": "replace",
+        "replacement": "******",
+    },
+    {"name": "login", "direction": "inbound", "method": "POST", "path": "/login"},
+    {
+        "name": "bot",
+        "direction": "inbound",
+        "header": {"name": "User-Agent", "regex": "^python"},
+        "action": "delay",
+        "delay": 0.5,
+    },
+    {"name": "api", "path": "/api/", "bytes": "x", "action": "log"},
+]
+
+
+def test_evaluate():
+    rules = parse_rules({"rules": RULES})
+    verdict = rules.evaluate(b"a flag{abc} and a SECRET", False)
+    assert verdict.drop
+    assert [rule.name for rule in verdict.matched] == ["flag"]
+    verdict = rules.evaluate(b"a Secret and a secret", False)
+    assert not verdict.drop
+    assert verdict.data == b"a ****** and a ******"
+    assert not rules.evaluate(b"flag{abc}", True).drop
+
+
+def test_index():
+    rules = parse_rules(RULES)
+    assert rules.evaluate(b"", True, method="post", path="/login?next=/").drop
+    assert not rules.evaluate(b"", True, method="GET", path="/login").drop
+    assert not rules.evaluate(b"", True, method="POST", path="/").drop
+    assert not rules.evaluate(b"", True).drop
+    verdict = rules.evaluate(b"xx", True, method="GET", path="/api/users")
+    assert [rule.name for rule in verdict.matched] == ["api"]
+    assert not rules.evaluate(b"xx", True, method="GET", path="/ap").matched
+
+
+def test_headers():
+    rules = parse_rules(RULES)
+    headers = HTTPHeaders({"User-Agent": "python-requests/2.31"})
+    verdict = rules.evaluate(b"", True, method="GET", path="/", headers=headers)
+    assert verdict.delay == 0.5
+    headers = HTTPHeaders({"User-Agent": "curl/8.0"})
+    assert not rules.evaluate(b"", True, method="GET", path="/", headers=headers).delay
+    assert not rules.evaluate(b"", True).delay
+
+
+def test_priority():
+    rules = RuleSet(
+        [
+            Rule("first", "replace", pattern=b"abc", replacement=b"1"),
+            Rule("second", "replace", pattern=compile(rb"a\w+"), replacement=b"2"),
+        ]
+    )
+    assert rules.evaluate(b"abc abd", True).data == b"1 2"
+
+
+def test_scanner():
+    rules = parse_rules(RULES)
+    scanner = rules.scanner(False)
+    assert scanner is not None
+    assert scanner.scan(b"a Sec") == b""
+    assert scanner.scan(b"ret", final=True) == b"a ******"
+    assert [rule.name for rule in rules.verdict(scanner, False).matched] == ["redact"]
+    assert rules.scanner(True) is None
+    assert not rules.verdict(None, True).matched
+
+
+def test_invalid():
+    with raises(InvalidRulesException):
+        parse_rules([{"action": "explode"}])
+    with raises(InvalidRulesException):
+        parse_rules([{"action": "replace"}])
+    with raises(InvalidRulesException):
+        parse_rules([{"bytes": "a", "regex": "b"}])
+    with raises(InvalidRulesException):
+        parse_rules([{"regex": "("}])
+    with raises(InvalidRulesException):
+        parse_rules([{"pattern": "typo"}])
+
+
+def test_load_rules(tmp_path: Path):
+    path = tmp_path / "rules.json"
+    path.write_text(dumps({"rules": RULES}))
+    assert len(load_rules(path)) == len(RULES)
+    assert load_rules(path) is load_rules(path)
+    path = tmp_path / "rules.toml"
+    path.write_text('[[rules]]\nname = "flag"\nbytes = "flag"\n')
+    assert load_rules(path).evaluate(b"flag", True).drop
+    importorskip("yaml")
+    path = tmp_path / "rules.yaml"
+    path.write_text("- name: flag\n  bytes: flag\n  direction: inbound\n")
+    rules = load_rules(path)
+    assert rules.evaluate(b"flag", True).drop
+    assert not rules.evaluate(b"flag", False).drop
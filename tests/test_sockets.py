@@ -0,0 +1,43 @@
+from __future__ import annotations
+from asyncio import get_running_loop, new_event_loop, sleep
+from socket import IPPROTO_TCP, SO_KEEPALIVE, SOL_SOCKET, SO_SNDBUF, TCP_NODELAY, socket
+from laproxy import SocketOptions
+from laproxy._loop import run_loop
+
+
+def test_socket_options():
+    with socket() as sock:
+        SocketOptions(nodelay=False, send_buffer=32 * 1024, keepalive=True).apply(sock)
+        assert not sock.getsockopt(IPPROTO_TCP, TCP_NODELAY)
+        assert sock.getsockopt(SOL_SOCKET, SO_SNDBUF) >= 32 * 1024
+        assert sock.getsockopt(SOL_SOCKET, SO_KEEPALIVE)
+    with socket() as sock:
+        SocketOptions.latency().apply(sock)
+        assert sock.getsockopt(IPPROTO_TCP, TCP_NODELAY)
+        assert not sock.getsockopt(SOL_SOCKET, SO_KEEPALIVE)
+
+
+def test_run_loop():
+    created = []
+    cancelled = []
+
+    def factory():
+        loop = new_event_loop()
+        created.append(loop)
+        return loop
+
+    async def forever():
+        try:
+            await sleep(3600)
+        except BaseException:
+            cancelled.append(True)
+            raise
+
+    async def main():
+        get_running_loop().create_task(forever())
+        await sleep(0)
+        return 42
+
+    assert run_loop(main(), loop_factory=factory) == 42
+    assert len(created) == 1 and created[0].is_closed()
+    assert cancelled == [True]